@@ -0,0 +1,203 @@
+""" Background purge of deleted accounts
+
+Deleting an account only sets users.deleted_at, which hides the user at once,
+and queues them to be purged by a background thread of the worker. Their
+bests, scores, games, snapshots, achievements and stats are deleted in batches
+of <batch_size> rows, each committed on its own, so no transaction holds many
+locks or runs for long; the user row goes last. Every worker is told to drop
+its cached leaderboards and the users' profiles once, when the queue is empty.
+
+Purges left unfinished by a worker exiting are finished by
+`flask users purge-deleted`.
+"""
+
+import os
+import queue
+import threading
+
+from sqlalchemy import delete, exists, select, tuple_
+
+from models import (
+    db, User, MinesweeperPeriodBest, MinesweeperPersonalBest,
+    MinesweeperScore, MinesweeperGame, MinesweeperStatSnapshot,
+    UserMinesweeperAchievement, MinesweeperStat)
+from leaderboard_cache import invalidate_leaderboards
+from leaderboard_events import notify_users_removed
+
+# Deleted in this order, before the user. Bests go before the scores they
+# point to, so deleting scores does not cascade to them.
+PURGED_MODELS = (
+    MinesweeperPeriodBest,
+    MinesweeperPersonalBest,
+    MinesweeperScore,
+    MinesweeperGame,
+    MinesweeperStatSnapshot,
+    UserMinesweeperAchievement,
+    MinesweeperStat
+)
+
+
+def delete_user_rows(model, user_id, batch_size):
+    """ Delete up to <batch_size> rows of <model> belonging to <user_id>.
+    Returns the number of rows deleted. """
+
+    key = model.__table__.primary_key.columns
+
+    batch = (select(*key)
+        .where(model.user_id == user_id)
+        .limit(batch_size))
+
+    return db.session.execute(
+        delete(model)
+        .where(tuple_(*key).in_(batch))
+        .execution_options(synchronize_session = False)
+    ).rowcount
+
+
+def purge_user(user_id, batch_size):
+    """ Delete the rows of the deleted user <user_id> in batches of up to
+    <batch_size>, each committed on its own, then the user. Does nothing if
+    the user is not deleted.
+
+    Returns the number of rows deleted, including the user.
+    """
+
+    is_deleted = db.session.query(exists().where(
+        User.id == user_id, User.deleted_at.isnot(None))).scalar()
+    if not is_deleted:
+        return 0
+
+    total = 0
+
+    for model in PURGED_MODELS:
+        while True:
+            deleted = delete_user_rows(model, user_id, batch_size)
+            db.session.commit()
+            total += deleted
+
+            if deleted < batch_size:
+                break
+
+    # Rows recorded since their batches were deleted go with the user
+    total += (User.query
+        .filter(User.id == user_id)
+        .delete(synchronize_session = False))
+    db.session.commit()
+
+    return total
+
+
+class AccountPurger:
+    """ Purges deleted users queued by this worker in a background thread """
+
+    def __init__(self, batch_size = 1000):
+        self.app = None
+        self.batch_size = batch_size
+        self.pid = None
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.purged = 0
+        self.rows_deleted = 0
+        self.failed = 0
+
+
+    def init_app(self, app):
+        """ Configure the purger from <app> config """
+
+        self.app = app
+        self.batch_size = app.config['ACCOUNT_PURGE_BATCH_SIZE']
+
+
+    def _start(self):
+        """ Start the purge thread. Started again in a process forked since,
+        as threads are not copied by fork. """
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.queue = queue.Queue()
+
+        thread = threading.Thread(target = self._purge_queued, daemon = True)
+        thread.start()
+
+
+    def enqueue(self, user_id):
+        """ Queue the deleted user <user_id> to be purged """
+
+        self._start()
+        self.queue.put(user_id)
+
+
+    def wait(self):
+        """ Wait until every queued user is purged """
+
+        self.queue.join()
+
+
+    def _purge_queued(self):
+        """ Purge users as they are queued, invalidating the leaderboards of
+        every worker whenever the queue empties """
+
+        while True:
+            user_ids = [self.queue.get()]
+            while not self.queue.empty():
+                user_ids.append(self.queue.get())
+
+            with self.app.app_context():
+                for user_id in user_ids:
+                    self._purge_logging_errors(user_id)
+
+                # The purged users' scores were already hidden from the
+                # leaderboards, but may still be cached
+                invalidate_leaderboards()
+                self._notify_removed(user_ids)
+
+            for _ in user_ids:
+                self.queue.task_done()
+
+
+    def _notify_removed(self, user_ids):
+        """ Tell the other workers that <user_ids> were purged, logging
+        instead of raising errors, as their caches expire anyway """
+
+        try:
+            notify_users_removed(user_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.app.logger.exception('Notifying purged users failed')
+
+
+    def _purge_logging_errors(self, user_id):
+        """ Purge <user_id>, logging instead of raising errors, since the
+        user stays deleted for `flask users purge-deleted` to purge """
+
+        try:
+            rows = purge_user(user_id, self.batch_size)
+        except Exception:
+            db.session.rollback()
+            self.app.logger.exception(f'Purging deleted user {user_id} failed')
+            with self.lock:
+                self.failed += 1
+            return
+
+        with self.lock:
+            self.purged += 1
+            self.rows_deleted += rows
+
+
+    def metrics(self):
+        """ Return the purge counters """
+
+        with self.lock:
+            return {
+                "queued": self.queue.unfinished_tasks,
+                "purged": self.purged,
+                "rows_deleted": self.rows_deleted,
+                "failed": self.failed
+            }
+
+
+account_purger = AccountPurger()
@@ -1,18 +1,41 @@
 import os
+from functools import wraps
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from flask import (
     Flask, render_template, flash, request, url_for, redirect, abort,
-    jsonify, session
+    jsonify, session, g
 )
 from flask_wtf.csrf import CSRFProtect
 from urllib.parse import (urlparse, urljoin)
+from sqlalchemy import or_, update
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.local import LocalProxy
 from flask_debugtoolbar import DebugToolbarExtension
 from models import (
-    db, connect_db, User, MinesweeperScore, MinesweeperStat,
-    MinesweeperAchievement, UserMinesweeperAchievement)
+    db, connect_db, User, MinesweeperScore, MinesweeperPersonalBest,
+    MinesweeperPeriodBest, format_time_since)
 from forms import (LoginForm, UserAddForm, CSRFProtectForm, UserEditForm)
-from minesweeper import MINESWEEPER_LEVELS, calc_minesweeper_achievements
+from commands import minesweeper_cli, users_cli
+from write_behind import minesweeper_buffer
+from leaderboard_events import (
+    leaderboard_hub, calc_leaderboard_rank, notify_leaderboard_entries,
+    notify_users_removed)
+from profile_cache import profile_cache, load_profile
+from passwords import password_hasher, PasswordHasherBusy
+from account_purge import account_purger
+from rate_limit import TokenBucketLimiter
+from leaderboard_cache import (
+    MINESWEEPER_LEADERBOARDS, MINESWEEPER_PERIOD_LEADERBOARDS,
+    init_leaderboards, serialize_entering_scores, add_scores,
+    invalidate_leaderboards, leaderboard_metrics)
+from minesweeper import (
+    MINESWEEPER_LEVELS, MAX_GAMES_PER_BATCH, add_minesweeper_game_stats,
+    validate_game_result, validate_score, validate_game_stats,
+    parse_game_stats, record_minesweeper_games, encode_score_cursor,
+    decode_score_cursor)
 
 load_dotenv()
 
@@ -26,13 +49,124 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+
+# Database connections per worker, and seconds a request waits for one before
+# failing. A gevent worker runs up to worker_connections greenlets, but live
+# leaderboard streams return their connection before streaming, so the pool
+# only needs to cover the requests querying at once.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    "pool_size": int(os.environ.get('DATABASE_POOL_SIZE', 20)),
+    "max_overflow": int(os.environ.get('DATABASE_MAX_OVERFLOW', 30)),
+    "pool_timeout": float(os.environ.get('DATABASE_POOL_TIMEOUT', 10))
+}
+
+# Opt-in buffering of minesweeper score/stats writes, flushed in bulk
+app.config['MINESWEEPER_WRITE_BEHIND'] = (
+    os.environ.get('MINESWEEPER_WRITE_BEHIND') == '1')
+app.config['MINESWEEPER_WRITE_BEHIND_MAX_ENTRIES'] = int(
+    os.environ.get('MINESWEEPER_WRITE_BEHIND_MAX_ENTRIES', 200))
+app.config['MINESWEEPER_WRITE_BEHIND_INTERVAL'] = float(
+    os.environ.get('MINESWEEPER_WRITE_BEHIND_INTERVAL', 5))
+app.config['MINESWEEPER_WRITE_BEHIND_SPILL_DIR'] = os.environ.get(
+    'MINESWEEPER_WRITE_BEHIND_SPILL_DIR',
+    os.path.join(app.instance_path, 'write_behind'))
+
+# Seconds before a worker reloads its cached leaderboards, to pick up scores
+# submitted to other workers
+app.config['MINESWEEPER_LEADERBOARD_CACHE_TTL'] = float(
+    os.environ.get('MINESWEEPER_LEADERBOARD_CACHE_TTL', 60))
+
+# Live leaderboard streams: seconds between keep-alive comments, and deltas
+# queued per client before a slow client is disconnected
+app.config['MINESWEEPER_LEADERBOARD_STREAM_HEARTBEAT'] = float(
+    os.environ.get('MINESWEEPER_LEADERBOARD_STREAM_HEARTBEAT', 15))
+app.config['MINESWEEPER_LEADERBOARD_STREAM_MAX_QUEUED'] = int(
+    os.environ.get('MINESWEEPER_LEADERBOARD_STREAM_MAX_QUEUED', 100))
+
+# Page sizes of GET /api/minesweeper/scores/<level>
+app.config['MINESWEEPER_SCORES_PAGE_SIZE'] = int(
+    os.environ.get('MINESWEEPER_SCORES_PAGE_SIZE', 20))
+app.config['MINESWEEPER_SCORES_MAX_PAGE_SIZE'] = int(
+    os.environ.get('MINESWEEPER_SCORES_MAX_PAGE_SIZE', 100))
+
+# Profiles cached per worker, and seconds before a cached profile is reloaded
+# to pick up changes made through other workers
+app.config['PROFILE_CACHE_SIZE'] = int(
+    os.environ.get('PROFILE_CACHE_SIZE', 1000))
+app.config['PROFILE_CACHE_TTL'] = float(
+    os.environ.get('PROFILE_CACHE_TTL', 60))
+
+# Password hashing threads, and the time a hash should take, used to measure
+# the bcrypt cost factor on the first hash unless PASSWORD_HASH_ROUNDS is set
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', 1))
+app.config['PASSWORD_HASH_TARGET_MS'] = float(
+    os.environ.get('PASSWORD_HASH_TARGET_MS', 250))
+app.config['PASSWORD_HASH_ROUNDS'] = int(
+    os.environ.get('PASSWORD_HASH_ROUNDS', 0))
+# Hashes waiting for or running in the pool before logins and signups are
+# refused with a 429
+app.config['PASSWORD_HASH_MAX_IN_FLIGHT'] = int(
+    os.environ.get('PASSWORD_HASH_MAX_IN_FLIGHT', 4))
+
+# Login and signup attempts per minute allowed to a client IP or username,
+# per worker
+app.config['RATE_LIMITS_ENABLED'] = (
+    os.environ.get('RATE_LIMITS_ENABLED', '1') == '1')
+app.config['LOGIN_RATE_LIMIT_PER_IP'] = int(
+    os.environ.get('LOGIN_RATE_LIMIT_PER_IP', 10))
+app.config['LOGIN_RATE_LIMIT_PER_USERNAME'] = int(
+    os.environ.get('LOGIN_RATE_LIMIT_PER_USERNAME', 5))
+app.config['SIGNUP_RATE_LIMIT_PER_IP'] = int(
+    os.environ.get('SIGNUP_RATE_LIMIT_PER_IP', 3))
+app.config['GUEST_RATE_LIMIT_PER_IP'] = int(
+    os.environ.get('GUEST_RATE_LIMIT_PER_IP', 10))
+
+# Hours a guest account is kept after its last guest login, before
+# `flask users purge-guests` deletes it
+app.config['GUEST_TTL_HOURS'] = float(os.environ.get('GUEST_TTL_HOURS', 24))
+
+# Rows deleted per transaction when purging a deleted account
+app.config['ACCOUNT_PURGE_BATCH_SIZE'] = int(
+    os.environ.get('ACCOUNT_PURGE_BATCH_SIZE', 1000))
+
+# Users per page of GET /users and GET /api/users
+app.config['USERS_PAGE_SIZE'] = int(os.environ.get('USERS_PAGE_SIZE', 30))
 csrf = CSRFProtect(app)
 toolbar = DebugToolbarExtension(app)
+app.cli.add_command(minesweeper_cli)
+app.cli.add_command(users_cli)
 
 connect_db(app)
 with app.app_context():
     db.create_all()
 
+init_leaderboards(app)
+leaderboard_hub.init_app(app)
+profile_cache.init_app(app)
+password_hasher.init_app(app)
+account_purger.init_app(app)
+
+login_ip_limiter = TokenBucketLimiter.per_minute(
+    app.config['LOGIN_RATE_LIMIT_PER_IP'])
+login_username_limiter = TokenBucketLimiter.per_minute(
+    app.config['LOGIN_RATE_LIMIT_PER_USERNAME'])
+signup_ip_limiter = TokenBucketLimiter.per_minute(
+    app.config['SIGNUP_RATE_LIMIT_PER_IP'])
+guest_ip_limiter = TokenBucketLimiter.per_minute(
+    app.config['GUEST_RATE_LIMIT_PER_IP'])
+
+if app.config['MINESWEEPER_WRITE_BEHIND']:
+    minesweeper_buffer.init_app(app)
+
+
+@app.before_request
+def start_leaderboard_listener():
+    """ Listen on the leaderboard channel from the first request of each
+    worker, so it hears of users removed through other workers """
+
+    leaderboard_hub.start()
+
 ###### Flask-login redirect target check ######
 # Credit to:
 # https://web.archive.org/web/20120517003641/http://flask.pocoo.org/snippets/62/
@@ -60,23 +194,45 @@ def is_safe_url(target):
 #     return User.query.get(user_id)
 
 
+###### Rate limiting ######
+
+def get_client_ip():
+    """ Get the IP of the client. Behind fly.io's proxy, remote_addr is the
+    proxy's, and the client's is in the Fly-Client-IP header. """
+
+    return request.headers.get('Fly-Client-IP', request.remote_addr)
+
+
+def is_rate_limited(limiter, key):
+    """ Take a token for <key> from <limiter>, returning true if there is
+    none left """
+
+    return app.config['RATE_LIMITS_ENABLED'] and not limiter.allow(key)
+
+
+def too_many_requests(template, form, message):
+    """ Render <template> with <form> and <message> as a 429, asking the
+    client to retry after a minute """
+
+    flash(message, 'danger')
+    return render_template(template, form=form), 429, {'Retry-After': '60'}
+
+
 ###### User signup/login/logout ######
 
 @app.context_processor
 def inject_user():
-    """ Inject current user into all templates """
+    """ Inject current user into all templates, loaded only if the template
+    uses it """
 
-    user_id = session.get(CURR_USER_KEY)
-    if user_id:
-        user = User.query.get(user_id)
-        return {'curr_user': user}
-    return {'curr_user': None}
+    return {'curr_user': LocalProxy(get_current_user)}
 
 
 def login_user(user):
     """ Log in user """
 
     session[CURR_USER_KEY] = user.id
+    g.pop('curr_user', None)
 
 
 def logout_user():
@@ -84,13 +240,72 @@ def logout_user():
 
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+    g.pop('curr_user', None)
 
 
 def get_current_user():
-    """ Get current user """
+    """ Get current user, with their role, or None if they deleted their
+    account or are a guest that expired, who are logged out. Loaded at most
+    once per request and kept on flask.g. """
+
+    if 'curr_user' not in g:
+        user_id = session.get(CURR_USER_KEY)
+        g.curr_user = (
+            User.query
+                .options(joinedload(User.role))
+                .filter(
+                    User.id == user_id,
+                    User.deleted_at.is_(None),
+                    or_(User.guest_expires_at.is_(None),
+                        User.guest_expires_at > datetime.utcnow()))
+                .one_or_none()
+            if user_id else None
+        )
+
+        if user_id and g.curr_user is None:
+            del session[CURR_USER_KEY]
+        elif g.curr_user and g.curr_user.is_guest():
+            keep_guest(g.curr_user)
 
-    user_id = session.get(CURR_USER_KEY)
-    return User.query.get(user_id) if user_id else None
+    return g.curr_user
+
+
+def require_api_user(view):
+    """ Decorate an API view to respond 401 unless a user is logged in who
+    is not deleted or an expired guest. The view gets them from
+    get_current_user(). """
+
+    @wraps(view)
+    def require_user(*args, **kwargs):
+        if not get_current_user():
+            return jsonify(error="Please log in to access this endpoint."), 401
+
+        return view(*args, **kwargs)
+
+    return require_user
+
+
+def keep_guest(user):
+    """ Extend the guest <user> by GUEST_TTL_HOURS once less than half of it
+    is left, so guests expire that long after they were last active, with at
+    most one write per half TTL """
+
+    ttl = timedelta(hours = app.config['GUEST_TTL_HOURS'])
+
+    if user.guest_expires_at - datetime.utcnow() < ttl / 2:
+        expires_at = datetime.utcnow() + ttl
+
+        # Committed on a connection of its own, so the request's session is
+        # left as it was; another request may have extended the guest already
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(User)
+                .where(User.id == user.id,
+                       User.guest_expires_at < expires_at)
+                .values(guest_expires_at = expires_at)
+            )
+
+        set_committed_value(user, 'guest_expires_at', expires_at)
 
 
 @app.route('/signup', methods = ['GET', 'POST'])
@@ -103,6 +318,10 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        if is_rate_limited(signup_ip_limiter, get_client_ip()):
+            return too_many_requests('users/signup.html', form,
+                'Too many signups, please try again in a minute.')
+
         username = form.username.data
         display_name = form.display_name.data
         email = form.email.data
@@ -117,6 +336,11 @@ def signup():
 
             db.session.commit()
 
+        except PasswordHasherBusy:
+            db.session.rollback()
+            return too_many_requests('users/signup.html', form,
+                'Too many signups, please try again in a minute.')
+
         except IntegrityError as e:
             db.session.rollback()
 
@@ -155,12 +379,25 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(
-            username=form.username.data,
-            password=form.password.data
-        )
+        # Checked before hashing, so refused attempts cost no bcrypt time
+        if (is_rate_limited(login_ip_limiter, get_client_ip()) or
+                is_rate_limited(login_username_limiter,
+                                form.username.data.lower())):
+            return too_many_requests('users/login.html', form,
+                'Too many login attempts, please try again in a minute.')
+
+        try:
+            user = User.authenticate(
+                username=form.username.data,
+                password=form.password.data
+            )
+        except PasswordHasherBusy:
+            return too_many_requests('users/login.html', form,
+                'Too many login attempts, please try again in a minute.')
 
         if user:
+            # Saves the password hash if it was upgraded
+            db.session.commit()
             login_user(user)
             flash('Logged in successfully.', 'success')
 
@@ -193,22 +430,30 @@ def logout():
 
 @app.post('/guestlogin')
 def login_guest():
-    """ Log user in to guest account """
+    """ Log user in to a guest account of their own, created on their first
+    guest login and kept while they are active (see keep_guest) """
 
     form = CSRFProtectForm()
 
     if form.validate_on_submit():
-        user = (User.query
-            .filter(User.username == 'guest')
-            .first())
+        ttl = timedelta(hours = app.config['GUEST_TTL_HOURS'])
+        user = get_current_user()
 
-        if user:
-            login_user(user)
-            flash('Logged in as guest.', 'success')
-            return redirect(url_for('homepage'))
+        if user and user.is_guest():
+            user.extend_guest(ttl)
         else:
-            flash('Something went wrong. Please sign up to proceed.', 'danger')
-            return redirect(url_for('signup'))
+            if is_rate_limited(guest_ip_limiter, get_client_ip()):
+                flash('Too many guest logins, please try again in a minute.',
+                      'danger')
+                return redirect(url_for('homepage'))
+
+            user = User.create_guest(ttl)
+
+        db.session.commit()
+        login_user(user)
+
+        flash('Logged in as guest.', 'success')
+        return redirect(url_for('homepage'))
     else:
         flash('Invalid CSRF token, please try again.', 'danger')
         return redirect(url_for('homepage'))
@@ -216,51 +461,89 @@ def login_guest():
 
 ###### General user routes ######
 
+def get_users_page():
+    """ Get the page of users requested by the q (search) and cursor (the
+    display name to continue after) query params.
+
+    Returns a tuple of the users and the cursor of the next page, or None on
+    the last page.
+    """
+
+    page_size = app.config['USERS_PAGE_SIZE']
+
+    # Fetch one extra user to tell whether there is a next page
+    users = User.search(
+        request.args.get('q'),
+        page_size + 1,
+        request.args.get('cursor') or None
+    )
+    next_cursor = (
+        users[page_size - 1].display_name if len(users) > page_size else None)
+
+    return users[:page_size], next_cursor
+
+
 @app.get('/users')
 def list_users():
-    """ List all users, with an optional filter from the query string. """
+    """ List the first page of users, with an optional filter from the
+    query string. Further pages are loaded from /api/users on scroll. """
 
     curr_user = get_current_user()
     if not curr_user:
         flash('Please log in to view this page.', 'danger')
         return redirect(url_for('login', next=request.url))
 
-    search = request.args.get('q')
-    if not search:
-        users = User.query.order_by(User.display_name).all()
-    else:
-        users = (User.query
-                 .filter(User.display_name.like(f"%{search}%"))
-                 .order_by(User.display_name)
-                 .all())
+    users, next_cursor = get_users_page()
 
-    return render_template('users/index.html', users=users)
+    return render_template(
+        'users/index.html',
+        users=users,
+        search=request.args.get('q', ''),
+        next_cursor=next_cursor
+    )
+
+
+@app.get('/api/users')
+@require_api_user
+def get_users():
+    """ Get a page of users in display name order.
+    Optional query params: q (display name search) and cursor (the
+    next_cursor of the previous page).
+    Sends back the users and the cursor of the next page (null on the last
+    page) in JSON response.
+    """
+
+    users, next_cursor = get_users_page()
+
+    return jsonify(
+        users=[user.serialize() for user in users],
+        next_cursor=next_cursor
+    )
 
 
 @app.get('/users/<int:user_id>')
 def show_user_profile(user_id):
-    """ Show user profile page. """
+    """ Show user profile page, from the worker's profile cache. """
 
     curr_user = get_current_user()
     if not curr_user:
         flash('Please log in to view this page.', 'danger')
         return redirect(url_for('login', next=request.url))
 
-    minesweeper_achievements = (db.session
-        .query(MinesweeperAchievement)
-        .join(UserMinesweeperAchievement)
-        .filter(UserMinesweeperAchievement.user_id == user_id)
-        .order_by(MinesweeperAchievement.id)
-        .all()
-    )
-
-    minesweeper_stats = MinesweeperStat.query.get(user_id)
+    profile, version = profile_cache.get(user_id)
+    if profile is None:
+        profile = load_profile(user_id)
+        if profile is None:
+            abort(404)
+        profile_cache.set(user_id, profile, version)
 
     return render_template(
         'users/detail.html',
-        user = User.query.get_or_404(user_id),
-        minesweeper_achievements = minesweeper_achievements,
-        minesweeper_stats = minesweeper_stats
+        user = profile.user,
+        minesweeper_section = profile.minesweeper_section,
+        time_since_played = (
+            format_time_since(profile.last_played_at)
+            if profile.last_played_at else None)
     )
 
 
@@ -277,6 +560,10 @@ def edit_user(user_id):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('homepage'))
 
+    if curr_user.is_guest():
+        flash('Please sign up to edit your profile.', 'danger')
+        return redirect(url_for('signup'))
+
     form = UserEditForm(obj=curr_user)
 
     if form.validate_on_submit():
@@ -285,6 +572,10 @@ def edit_user(user_id):
         db.session.add(curr_user)
         db.session.commit()
 
+        # Leaderboards show display names
+        invalidate_leaderboards()
+        profile_cache.invalidate([user_id])
+
         return redirect(url_for('show_user_profile', user_id = user_id))
 
     return render_template('/users/edit.html', form=form)
@@ -292,7 +583,8 @@ def edit_user(user_id):
 
 @app.post('/users/<int:user_id>/delete')
 def delete_user(user_id):
-    """Delete user.
+    """Delete user. The user is hidden at once, and their rows are purged
+    in the background.
 
     Redirect to signup page.
     """
@@ -310,9 +602,13 @@ def delete_user(user_id):
 
     if form.validate_on_submit():
         logout_user()
-        User.query.filter(User.id == user_id).delete()
+        curr_user.mark_deleted()
+        notify_users_removed([user_id])
         db.session.commit()
 
+        profile_cache.invalidate([user_id])
+        account_purger.enqueue(user_id)
+
         flash('User successfully deleted. See you again!', 'success')
         return redirect(url_for('signup'))
     else:
@@ -337,91 +633,339 @@ def show_minesweeper_game():
 ###### Minesweeper game API ######
 
 @app.get('/api/minesweeper/scores')
+@require_api_user
 def get_minesweeper_scores():
-    """ Get minesweeper scores from database. Top 20 for each difficulty. """
+    """ Get minesweeper scores. Top 20 for each difficulty, served from the
+    worker's leaderboard cache.
+    Optional mode query param: 'all' (default) ranks every score, 'best'
+    ranks each player's personal best.
+    Optional window query param: 'all' (default), or 'day' or 'week' to rank
+    each player's best score of the current UTC day or week (Monday to
+    Sunday), whatever the mode.
+    Responds 304 Not Modified if If-None-Match has the current ETag, also
+    when expired leaderboards are reloaded unchanged.
+    """
 
-    curr_user = get_current_user()
-    if not curr_user:
-        return jsonify(error="Please log in to access this endpoint."), 401
+    mode = request.args.get('mode', 'all')
+    if mode not in MINESWEEPER_LEADERBOARDS:
+        return jsonify(error=f"Invalid mode: {mode}."), 400
 
-    scores = {}
+    window = request.args.get('window', 'all')
+    if window == 'all':
+        cache = MINESWEEPER_LEADERBOARDS[mode]
+    elif window in MINESWEEPER_PERIOD_LEADERBOARDS:
+        cache = MINESWEEPER_PERIOD_LEADERBOARDS[window]
+    else:
+        return jsonify(error=f"Invalid window: {window}."), 400
+
+    levels = list(MINESWEEPER_LEVELS)
+
+    # Answered from the cache version alone, without a query or encoding,
+    # unless the leaderboards expired and must be reloaded first
+    scores = None
+    etag = cache.check_etag(levels, request.if_none_match)
+    if not etag:
+        scores, etag = cache.get_many_with_etag(levels, request.if_none_match)
+
+    if scores is None:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(scores=scores)
+
+    response.set_etag(etag)
+    # Revalidate on every load
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+
+    return response
+
+
+@app.get('/api/minesweeper/leaderboard/stream')
+@require_api_user
+def stream_minesweeper_leaderboard():
+    """ Stream live leaderboard updates as server-sent events.
+    Sends a 'leaderboard' event with the level, score and rank of every new
+    score that enters a top 20.
+    """
 
-    for level in MINESWEEPER_LEVELS:
-        scores_for_level = MinesweeperScore.get_scores_for_level(level, 20)
-        scores[level] = [score.serialize() for score in scores_for_level]
+    return app.response_class(
+        leaderboard_hub.stream(),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop proxies from buffering the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@app.get('/api/minesweeper/scores/<level>')
+@require_api_user
+def get_minesweeper_scores_page(level):
+    """ Get a page of minesweeper scores for a level, in leaderboard order.
+    Optional query params: limit (page size) and cursor (the next_cursor of
+    the previous page).
+    Sends back the scores and the cursor of the next page (null on the last
+    page) in JSON response.
+    """
+
+    if level not in MINESWEEPER_LEVELS:
+        return jsonify(error=f"Invalid level: {level}."), 400
+
+    max_page_size = app.config['MINESWEEPER_SCORES_MAX_PAGE_SIZE']
+    limit = request.args.get(
+        'limit', app.config['MINESWEEPER_SCORES_PAGE_SIZE'], type=int)
+    if not 1 <= limit <= max_page_size:
+        return jsonify(
+            error=f"limit must be between 1 and {max_page_size}."
+        ), 400
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_score_cursor(cursor)
+        except ValueError:
+            return jsonify(error="Invalid cursor."), 400
+
+    # Fetch one extra score to tell whether there is a next page
+    rows = MinesweeperScore.get_scores_page(level, limit + 1, after)
+    scores = [row._asdict() for row in rows[:limit]]
+    next_cursor = encode_score_cursor(scores[-1]) if len(rows) > limit else None
+
+    return jsonify(scores=scores, next_cursor=next_cursor)
+
+
+@app.get('/api/minesweeper/rank')
+@require_api_user
+def get_minesweeper_rank():
+    """ Get the current user's personal best on a level and its rank among
+    every player's personal best.
+    Expects a level query param.
+    Sends back the personal best (null if the user has no score on the level),
+    rank and total number of ranked players in JSON response.
+    """
 
-    return jsonify(scores=scores)
+    user_id = get_current_user().id
+
+    level = request.args.get('level')
+    if level not in MINESWEEPER_LEVELS:
+        return jsonify(error=f"Invalid level: {level}."), 400
+
+    best, rank, total = MinesweeperPersonalBest.get_rank(user_id, level)
+
+    return jsonify(
+        best=best.serialize() if best else None,
+        rank=rank,
+        total=total
+    )
 
 
 @app.post('/api/minesweeper/scores')
 @csrf.exempt
+@require_api_user
 def submit_minesweeper_score():
     """ Submit minesweeper score to database.
     Expects JSON format data with fields for time and level.
     """
 
-    curr_user = get_current_user()
-    if not curr_user:
-        return jsonify(error="Please log in to access this endpoint."), 401
+    user_id = get_current_user().id
+
+    score = request.json
+    error = validate_score(score)
+    if error:
+        return jsonify(error=error), 400
+
+    if app.config['MINESWEEPER_WRITE_BEHIND']:
+        minesweeper_buffer.add_score(
+            user_id,
+            score['time'],
+            score['level'],
+            datetime.utcnow().isoformat()
+        )
+        return (jsonify(queued=True), 202)
 
     new_score = MinesweeperScore(
-        user_id = curr_user.id,
-        time = request.json['time'],
-        level = request.json['level']
+        user_id = user_id,
+        time = score['time'],
+        level = score['level']
     )
     db.session.add(new_score)
+    db.session.flush()
+    MinesweeperPersonalBest.add_scores([new_score])
+    MinesweeperPeriodBest.add_scores([new_score])
+    notify_leaderboard_entries([new_score])
     db.session.commit()
 
     serialized = new_score.serialize()
+    add_scores([serialized])
 
     return (jsonify(score=serialized), 201)
 
 
 @app.post('/api/minesweeper/stats')
 @csrf.exempt
+@require_api_user
 def submit_minesweeper_stats():
     """ Submit minesweeper stats to database.
     Calculates achievements and sends back in JSON response.
     """
 
-    curr_user = get_current_user()
-    if not curr_user:
-        return jsonify(error="Please log in to access this endpoint."), 401
+    user_id = get_current_user().id
 
     data = request.json
-    curr_stat = MinesweeperStat.query.get(curr_user.id)
+    error = validate_game_stats(data)
+    if error:
+        return jsonify(error=error), 400
 
-    if not curr_stat:
-        curr_stat = MinesweeperStat(user_id = curr_user.id)
-        db.session.add(curr_stat)
-        db.session.commit()
+    if app.config['MINESWEEPER_WRITE_BEHIND']:
+        # Achievements are awarded when the buffer is flushed
+        minesweeper_buffer.add_stats(user_id, data)
+        return (jsonify(queued=True, new_achievements=[]), 202)
 
-    curr_stat.games_played += data['games_played']
-    curr_stat.games_won += data['games_won']
-    curr_stat.beginner_games_won += data['beginner_games_won']
-    curr_stat.intermediate_games_won += data['intermediate_games_won']
-    curr_stat.expert_games_won += data['expert_games_won']
-    curr_stat.time_played += data['time_played']
-    curr_stat.cells_revealed += data['cells_revealed']
-    curr_stat.win_streak = (
-        (curr_stat.win_streak + 1)
-        if data['games_won'] else
-        0
-    )
-    curr_stat.last_played_at = data['last_played_at']
+    curr_stat, new_achievements = add_minesweeper_game_stats(
+        user_id, [parse_game_stats(data)])
+
+    # Serialize before committing, which would expire the loaded stats
+    serialized_stats = curr_stat.serialize()
+    serialized = [a.serialize() for a in new_achievements]
 
-    db.session.add(curr_stat)
     db.session.commit()
+    profile_cache.invalidate([user_id])
 
-    new_achievements = calc_minesweeper_achievements(curr_user, data)
-    curr_user.minesweeper_achievements.extend(new_achievements)
+    return jsonify(
+        stats=serialized_stats,
+        new_achievements=serialized
+    )
+
+
+@app.post('/api/minesweeper/games')
+@csrf.exempt
+@require_api_user
+def submit_minesweeper_game():
+    """ Submit a finished minesweeper game.
+    Expects JSON format data with fields for level, time, won, cells_revealed
+    and finished_at. Records the score (for a win), updates stats and awards
+    achievements in one transaction.
+    Sends back the stats, new achievements, score and its leaderboard rank in
+    JSON response.
+    """
+
+    user_id = get_current_user().id
+
+    result = request.json
+    error = validate_game_result(result)
+    if error:
+        return jsonify(error=error), 400
+
+    if app.config['MINESWEEPER_WRITE_BEHIND']:
+        # Scores and achievements are recorded when the buffer is flushed
+        minesweeper_buffer.add_game(
+            user_id, result, datetime.utcnow().isoformat())
+        return (jsonify(queued=True, new_achievements=[]), 202)
+
+    stats, new_achievements, new_scores = record_minesweeper_games(
+        user_id, [result])
+
+    serialized_stats = stats.serialize()
+    serialized = [a.serialize() for a in new_achievements]
+    serialized_score = None
+    rank = None
+
+    if new_scores:
+        serialized_score = new_scores[0].serialize()
+        rank = calc_leaderboard_rank(new_scores[0])
 
     db.session.commit()
+    profile_cache.invalidate([user_id])
+
+    if serialized_score:
+        add_scores([serialized_score])
+
+    return (jsonify(
+        stats=serialized_stats,
+        new_achievements=serialized,
+        score=serialized_score,
+        rank=rank
+    ), 201)
+
+
+@app.post('/api/minesweeper/games/batch')
+@csrf.exempt
+@require_api_user
+def submit_minesweeper_games():
+    """ Submit several finished minesweeper games at once.
+    Expects JSON format data with a list of games, in the order they were
+    played, each with fields for level, time, won, cells_revealed and
+    finished_at. All games are recorded in one transaction.
+    Sends back the combined stats and new achievements in JSON response.
+    """
 
+    user_id = get_current_user().id
+
+    results = (request.json or {}).get('games')
+
+    if not isinstance(results, list) or not results:
+        return jsonify(error="Expected a non-empty list of games."), 400
+
+    if len(results) > MAX_GAMES_PER_BATCH:
+        return jsonify(
+            error=f"At most {MAX_GAMES_PER_BATCH} games can be submitted at once."
+        ), 400
+
+    for result in results:
+        error = validate_game_result(result)
+        if error:
+            return jsonify(error=error), 400
+
+    if app.config['MINESWEEPER_WRITE_BEHIND']:
+        submitted_at = datetime.utcnow().isoformat()
+        for result in results:
+            minesweeper_buffer.add_game(user_id, result, submitted_at)
+        return (jsonify(queued=True, new_achievements=[]), 202)
+
+    stats, new_achievements, new_scores = record_minesweeper_games(
+        user_id, results)
+
+    serialized_stats = stats.serialize()
     serialized = [a.serialize() for a in new_achievements]
-    return jsonify(
-        stats=curr_stat.serialize(),
+    entering_scores = serialize_entering_scores(new_scores)
+
+    db.session.commit()
+    profile_cache.invalidate([user_id])
+
+    add_scores(entering_scores)
+
+    return (jsonify(
+        stats=serialized_stats,
         new_achievements=serialized
+    ), 201)
+
+
+###### Admin API ######
+
+@app.get('/api/admin/metrics')
+@require_api_user
+def get_metrics():
+    """ Get this worker's cache, password hashing, rate limiting and account
+    purge metrics (admin only) """
+
+    if not get_current_user().is_admin():
+        return jsonify(error="Unauthorized access."), 403
+
+    return jsonify(
+        pid=os.getpid(),
+        profile_cache=profile_cache.metrics(),
+        password_hashing=password_hasher.metrics(),
+        rate_limits={
+            "login_ip": login_ip_limiter.metrics(),
+            "login_username": login_username_limiter.metrics(),
+            "signup_ip": signup_ip_limiter.metrics(),
+            "guest_ip": guest_ip_limiter.metrics()
+        },
+        account_purge=account_purger.metrics(),
+        minesweeper_leaderboard_caches=leaderboard_metrics(),
+        minesweeper_leaderboard_stream=leaderboard_hub.metrics()
     )
 
 
@@ -0,0 +1,76 @@
+""" Throughput benchmark for replaying minesweeper_games events
+
+Times fold_minesweeper_games, the per-game loop of a stats rebuild, over
+synthetic events shaped like rows of minesweeper_games. One user's games are
+generated up front and replayed repeatedly, as a rebuild replays one user at a
+time, so memory stays bounded for tens of millions of events.
+
+Only the in-memory fold is timed: streaming the games from the database and
+writing the rebuilt stats and snapshots are not, so a real rebuild is slower.
+
+Usage:
+    python bench_minesweeper_projection.py [--events N] [--games-per-user N]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from minesweeper import MINESWEEPER_LEVEL_CODES
+from minesweeper_projection import PROJECTED_FIELDS, fold_minesweeper_games
+
+
+def make_user_games(user_id, first_game_id, qty, rng):
+    """ Generate <qty> random games for a user, as minesweeper_games rows """
+
+    level_codes = list(MINESWEEPER_LEVEL_CODES.values())
+    finished_at = datetime(2026, 1, 1)
+
+    games = []
+    for game_id in range(first_game_id, first_game_id + qty):
+        finished_at += timedelta(minutes = 5)
+        games.append((
+            game_id,
+            user_id,
+            rng.choice(level_codes),
+            rng.random() < 0.3,
+            rng.randint(1, 999),
+            rng.randint(1, 480),
+            finished_at
+        ))
+
+    return games
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--events', type = int, default = 20_000_000)
+    parser.add_argument('--games-per-user', type = int, default = 1000)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Reuse one user's games, so generation does not dominate the run time
+    games = make_user_games(1, 1, args.games_per_user, rng)
+
+    elapsed = 0.0
+    replayed = 0
+
+    while replayed < args.events:
+        user_games = games[:args.events - replayed]
+        stats = dict.fromkeys(PROJECTED_FIELDS, 0)
+        stats['last_played_at'] = None
+
+        start = time.perf_counter()
+        fold_minesweeper_games(stats, user_games)
+        elapsed += time.perf_counter() - start
+
+        replayed += len(user_games)
+
+    print(f'Replayed {replayed:,} events in {elapsed:.2f}s '
+          f'({replayed / elapsed:,.0f} events/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+""" Flask CLI commands for David's Games """
+
+import gzip
+import os
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import exists, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from models import (
+    db, User, MinesweeperAchievement, UserMinesweeperAchievement,
+    MinesweeperPeriodBest, DAY, WEEK, calc_period_start)
+from minesweeper import select_achievement_candidates
+from minesweeper_projection import (
+    rebuild_minesweeper_stats, snapshot_minesweeper_stats)
+from minesweeper_retention import (
+    archive_minesweeper_scores, select_leaderboard_score_ids)
+from account_purge import purge_user
+from leaderboard_events import notify_users_removed, notify_profiles_changed
+
+minesweeper_cli = AppGroup('minesweeper', help = 'Minesweeper maintenance.')
+users_cli = AppGroup('users', help = 'User maintenance.')
+
+
+@minesweeper_cli.command('recompute-achievements')
+@click.option('--dry-run', is_flag = True,
+              help = 'Report achievements that would be awarded, but do not '
+                     'award them.')
+@click.option('--batch-size', default = 50000, show_default = True,
+              help = 'Number of user ids to process per transaction.')
+@click.option('--start-after', default = 0, show_default = True,
+              help = 'Resume after this user id.')
+def recompute_achievements(dry_run, batch_size, start_after):
+    """ Award every missing minesweeper achievement to every user.
+
+    Users are processed in ranges of ids, each with a single
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING that is committed on its own,
+    so an interrupted run can be resumed with --start-after.
+    """
+
+    achievement_ids = dict(
+        db.session.query(MinesweeperAchievement.title, MinesweeperAchievement.id)
+    )
+    titles = {id: title for title, id in achievement_ids.items()}
+    max_user_id = db.session.query(func.max(User.id)).scalar() or 0
+
+    totals = {}
+    first_user_id = start_after + 1
+
+    while first_user_id <= max_user_id:
+        last_user_id = first_user_id + batch_size - 1
+        candidates = select_achievement_candidates(
+            achievement_ids, first_user_id, last_user_id)
+
+        if candidates is None:
+            break
+
+        candidates = candidates.subquery('candidates')
+
+        if dry_run:
+            is_owned = exists().where(
+                UserMinesweeperAchievement.user_id == candidates.c.user_id,
+                UserMinesweeperAchievement.achievement_id
+                    == candidates.c.achievement_id
+            )
+            counts = (
+                select(candidates.c.achievement_id, func.count())
+                .where(~is_owned)
+                .group_by(candidates.c.achievement_id)
+            )
+        else:
+            inserted = (
+                insert(UserMinesweeperAchievement)
+                .from_select(
+                    ['user_id', 'achievement_id'],
+                    select(candidates.c.user_id, candidates.c.achievement_id)
+                )
+                .on_conflict_do_nothing()
+                .returning(UserMinesweeperAchievement.achievement_id)
+                .cte('inserted')
+            )
+            counts = (
+                select(inserted.c.achievement_id, func.count())
+                .group_by(inserted.c.achievement_id)
+            )
+
+        for achievement_id, count in db.session.execute(counts):
+            totals[achievement_id] = totals.get(achievement_id, 0) + count
+
+        db.session.commit()
+        click.echo(f'Processed users up to id {last_user_id}')
+
+        first_user_id = last_user_id + 1
+
+    action = 'Would award' if dry_run else 'Awarded'
+    for achievement_id, count in sorted(totals.items()):
+        click.echo(f'+{count} {titles[achievement_id]}')
+    click.echo(f'{action} {sum(totals.values())} achievements.')
+
+
+@minesweeper_cli.command('snapshot-stats')
+@click.option('--batch-size', default = 50000, show_default = True,
+              help = 'Number of user ids to process per transaction.')
+def take_stats_snapshots(batch_size):
+    """ Take a first snapshot of the minesweeper stats of every user who has
+    none, so their stats can be rebuilt from the games logged afterwards.
+    """
+
+    max_user_id = db.session.query(func.max(User.id)).scalar() or 0
+
+    total = 0
+    first_user_id = 1
+
+    while first_user_id <= max_user_id:
+        last_user_id = first_user_id + batch_size - 1
+
+        total += snapshot_minesweeper_stats(first_user_id, last_user_id)
+        db.session.commit()
+
+        first_user_id = last_user_id + 1
+
+    click.echo(f'Took {total} snapshots.')
+
+
+@minesweeper_cli.command('rebuild-stats')
+@click.option('--user-id', type = int,
+              help = 'Only rebuild the stats of this user.')
+@click.option('--batch-size', default = 1000, show_default = True,
+              help = 'Number of user ids to process per transaction.')
+@click.option('--start-after', default = 0, show_default = True,
+              help = 'Resume after this user id.')
+def rebuild_stats(user_id, batch_size, start_after):
+    """ Rebuild minesweeper stats from each user's latest snapshot and the
+    games logged after it, and snapshot the rebuilt stats.
+
+    Users whose stats were created since the log existed have an empty
+    snapshot. Users with stats from before it are skipped until they have a
+    snapshot; see snapshot-stats.
+    """
+
+    if user_id is not None:
+        first_user_id = max_user_id = user_id
+    else:
+        first_user_id = start_after + 1
+        max_user_id = db.session.query(func.max(User.id)).scalar() or 0
+
+    total_users = 0
+    total_games = 0
+
+    while first_user_id <= max_user_id:
+        last_user_id = min(first_user_id + batch_size - 1, max_user_id)
+
+        user_ids, games = rebuild_minesweeper_stats(
+            first_user_id, last_user_id)
+        # Workers may have the old stats cached in profiles
+        notify_profiles_changed(user_ids)
+        db.session.commit()
+
+        total_users += len(user_ids)
+        total_games += games
+        click.echo(f'Processed users up to id {last_user_id}')
+
+        first_user_id = last_user_id + 1
+
+    click.echo(f'Rebuilt stats of {total_users} users from {total_games} games.')
+
+
+@minesweeper_cli.command('prune-period-bests')
+@click.option('--days', default = 7, show_default = True,
+              help = 'Number of past days of daily bests to keep.')
+@click.option('--weeks', default = 4, show_default = True,
+              help = 'Number of past weeks of weekly bests to keep.')
+def prune_period_bests(days, weeks):
+    """ Delete the daily and weekly minesweeper bests of expired windows,
+    keeping the current day and week and the given number before them.
+    """
+
+    today = datetime.utcnow()
+    cutoffs = {
+        DAY: calc_period_start(DAY, today) - timedelta(days = days),
+        WEEK: calc_period_start(WEEK, today) - timedelta(weeks = weeks)
+    }
+
+    for period, before in cutoffs.items():
+        deleted = MinesweeperPeriodBest.prune(period, before)
+        db.session.commit()
+        click.echo(f'Deleted {deleted} {period} bests before {before}.')
+
+
+@minesweeper_cli.command('compact-scores')
+@click.option('--older-than', default = 90, show_default = True,
+              help = 'Archive scores submitted more than this many days ago.')
+@click.option('--archive', 'archive_path', type = click.Path(dir_okay = False),
+              help = 'Gzipped JSON lines file to append the archived scores '
+                     'to. Defaults to minesweeper_scores_<date>.jsonl.gz.')
+@click.option('--batch-size', default = 5000, show_default = True,
+              help = 'Number of scores to delete per transaction.')
+def compact_scores(older_than, archive_path, batch_size):
+    """ Move old minesweeper scores that are not on a leaderboard or a
+    personal or period best out of minesweeper_scores, into a compressed
+    archive file.
+
+    Scores are deleted in batches of ascending ids, each committed once it is
+    written to the archive, so locks are held briefly and an interrupted run
+    can simply be started again.
+    """
+
+    now = datetime.utcnow()
+    submitted_before = now - timedelta(days = older_than)
+    if archive_path is None:
+        archive_path = f'minesweeper_scores_{now:%Y%m%d}.jsonl.gz'
+
+    keep_ids = select_leaderboard_score_ids()
+    db.session.commit()
+
+    total_scores = 0
+    total_bytes = 0
+    last_id = 0
+    archive_size = (
+        os.path.getsize(archive_path) if os.path.exists(archive_path) else 0)
+
+    with gzip.open(archive_path, 'at', encoding = 'utf-8') as archive:
+        while True:
+            scores, row_bytes, last_id = archive_minesweeper_scores(
+                archive, submitted_before, keep_ids, last_id, batch_size)
+            db.session.commit()
+
+            if not scores:
+                break
+
+            total_scores += scores
+            total_bytes += row_bytes
+            click.echo(f'Archived scores up to id {last_id}')
+
+    archive_size = os.path.getsize(archive_path) - archive_size
+
+    click.echo(f'Archived {total_scores} scores to {archive_path} '
+               f'({archive_size} bytes compressed).')
+    click.echo(f'Freed {total_bytes} bytes of row data from '
+               f'minesweeper_scores.')
+
+
+@users_cli.command('purge-guests')
+@click.option('--batch-size', default = 1000, show_default = True,
+              help = 'Number of guests to mark, or rows to delete, per '
+                     'transaction.')
+def purge_guests(batch_size):
+    """ Delete expired guest accounts, with their scores, stats and
+    achievements.
+
+    Expired guests are marked deleted in batches, which hides them from
+    every worker, then purged like deleted users (see account_purge.py),
+    including guests marked by an earlier run that did not finish. Run it
+    periodically, e.g. from a scheduled machine.
+    """
+
+    while True:
+        marked = User.mark_expired_guests_deleted(batch_size)
+        notify_users_removed(marked)
+        db.session.commit()
+
+        if not marked:
+            break
+
+        click.echo(f'Marked guests up to id {max(marked)} deleted')
+
+    user_ids = db.session.scalars(select(User.id)
+        .where(User.guest_expires_at.isnot(None),
+               User.deleted_at.isnot(None))
+        .order_by(User.id)).all()
+    db.session.commit()
+
+    total_rows = sum(purge_user(user_id, batch_size) for user_id in user_ids)
+
+    click.echo(f'Purged {len(user_ids)} expired guests ({total_rows} rows).')
+
+
+@users_cli.command('purge-deleted')
+@click.option('--batch-size', default = 1000, show_default = True,
+              help = 'Number of rows to delete per transaction.')
+def purge_deleted(batch_size):
+    """ Purge the users who deleted their account and were not purged in the
+    background, e.g. because the worker exited first. """
+
+    user_ids = (db.session.query(User.id)
+        .filter(User.deleted_at.isnot(None))
+        .order_by(User.id)
+        .all())
+    db.session.commit()
+
+    total_rows = 0
+
+    for (user_id,) in user_ids:
+        rows = purge_user(user_id, batch_size)
+        total_rows += rows
+        click.echo(f'Purged user {user_id} ({rows} rows)')
+
+    # Workers may still have their scores or profiles cached
+    notify_users_removed([user_id for (user_id,) in user_ids])
+    db.session.commit()
+
+    click.echo(f'Purged {len(user_ids)} deleted users ({total_rows} rows).')
@@ -0,0 +1,17 @@
+""" Gunicorn config for David's Games
+
+Gevent workers serve each request in a greenlet, so idle live leaderboard
+streams do not tie up a worker each. Requests share the worker's database
+pool (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW connections), which streams
+do not hold on to, so worker_connections can be far larger.
+"""
+
+worker_class = 'gevent'
+worker_connections = 2000
+
+
+def post_fork(server, worker):
+    """ Make psycopg2 yield to other greenlets while waiting on Postgres """
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
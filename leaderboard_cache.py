@@ -0,0 +1,400 @@
+""" Per-worker cache of the minesweeper leaderboards
+
+Each worker keeps the top scores of every level in memory, both across all
+scores and with one entry (the personal best) per player, so
+GET /api/minesweeper/scores is served without querying the database. A new
+score only changes a leaderboard if it beats the last cached score, so a single
+comparison decides whether a cached leaderboard is updated in place. Scores
+written by other workers are picked up once a cached leaderboard is older than
+<ttl> seconds.
+
+The daily and weekly leaderboards are cached the same way, holding only the
+current period: once a new day or week starts they are emptied and reloaded
+from the period bests rollup.
+
+The ETag of the cached leaderboards is a digest of their content, computed
+once per change to the cache, so conditional requests can be answered without
+a query, and every worker caching the same scores gives the same ETag.
+"""
+
+import hashlib
+import json
+import threading
+from bisect import insort
+from datetime import datetime
+from time import monotonic
+
+from models import (MinesweeperScore, MinesweeperPersonalBest,
+                    MinesweeperPeriodBest, DAY, WEEK, calc_period_start)
+
+LEADERBOARD_SIZE = 20
+
+
+def leaderboard_key(serialized_score):
+    """ Sort key of a serialized score, matching
+    MinesweeperScore.get_scores_for_level """
+
+    return (
+        serialized_score['time'],
+        serialized_score['submitted_at'],
+        serialized_score['id']
+    )
+
+
+def digest_leaderboards(period_start, leaderboards):
+    """ Return a digest of the serialized <leaderboards> (a list of lists of
+    scores) of the period starting on <period_start>, to use as an ETag """
+
+    content = json.dumps(
+        [str(period_start), leaderboards], default = str, sort_keys = True)
+
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class LeaderboardCache:
+    """ Top minesweeper scores of each level, with hit/miss counters.
+
+    <load> queries the leaderboards of a list of levels, like
+    MinesweeperScore.get_leaderboards. If <per_user> is set, a leaderboard
+    holds at most one score per user.
+
+    If <period> (DAY or WEEK) is set, only scores submitted in the current
+    period are kept, and <load> also takes the period and its start date
+    first, like MinesweeperPeriodBest.get_leaderboards.
+    """
+
+    def __init__(self, load = MinesweeperScore.get_leaderboards,
+                 per_user = False, size = LEADERBOARD_SIZE, ttl = 60,
+                 period = None):
+        self.load = load
+        self.per_user = per_user
+        self.period = period
+        self.period_start = None
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # level -> (serialized scores, time loaded)
+        self.leaderboards = {}
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.not_modified = 0
+        # Bumped by every change to the cached leaderboards
+        self.version = 0
+        # The ETag last computed, and the version and levels it is for
+        self.etag = None
+        self.etag_key = None
+
+
+    def init_app(self, app):
+        """ Configure the cache from <app> config """
+
+        self.ttl = app.config['MINESWEEPER_LEADERBOARD_CACHE_TTL']
+
+
+    def _etag(self, levels):
+        """ Return the ETag of the cached leaderboards of <levels>, computed
+        once per version. Call with <lock> held, with <levels> cached. """
+
+        key = (self.version, tuple(levels))
+
+        if self.etag_key != key:
+            self.etag = digest_leaderboards(
+                self.period_start,
+                [self.leaderboards[level][0] for level in levels])
+            self.etag_key = key
+
+        return self.etag
+
+
+    def _roll_over(self):
+        """ Drop the cached leaderboards of a period that has ended. Call with
+        <lock> held. """
+
+        if self.period is None:
+            return
+
+        period_start = calc_period_start(self.period, datetime.utcnow())
+        if period_start != self.period_start:
+            self.leaderboards.clear()
+            self.period_start = period_start
+            self.version += 1
+
+
+    def _load(self, levels):
+        """ Query the leaderboards of <levels>, returning them with the start
+        of the period they were loaded for """
+
+        with self.lock:
+            self._roll_over()
+            period_start = self.period_start
+
+        if self.period is None:
+            return self.load(levels, self.size), period_start
+
+        return (
+            self.load(self.period, period_start, levels, self.size),
+            period_start
+        )
+
+
+    def _is_fresh(self, level, now):
+        """ Return true if <level> is cached and has not expired. Call with
+        <lock> held. """
+
+        cached = self.leaderboards.get(level)
+        return cached is not None and now - cached[1] < self.ttl
+
+
+    def check_etag(self, levels, if_none_match):
+        """ Return the current ETag if every one of <levels> is cached and has
+        not expired and <if_none_match> (a werkzeug ETags) contains it,
+        otherwise None """
+
+        now = monotonic()
+
+        with self.lock:
+            self._roll_over()
+            if not all(self._is_fresh(level, now) for level in levels):
+                return None
+
+            etag = self._etag(levels)
+            if not if_none_match.contains(etag):
+                return None
+
+            self.not_modified += 1
+            return etag
+
+
+    def get_many_with_etag(self, levels, if_none_match = None):
+        """ Return a tuple of a dictionary of level to the serialized top
+        scores for each of <levels>, and the ETag they were served with.
+        If any level is not cached or has expired, they are all loaded with a
+        single query.
+
+        The scores are None if <if_none_match> (a werkzeug ETags) contains
+        the ETag, as it does when the leaderboards were reloaded unchanged.
+        """
+
+        scores, etag = self._get_many_with_etag(levels)
+
+        if if_none_match is not None and if_none_match.contains(etag):
+            with self.lock:
+                self.not_modified += 1
+            return (None, etag)
+
+        return (scores, etag)
+
+
+    def _get_many_with_etag(self, levels):
+        """ Return a tuple of a dictionary of level to the serialized top
+        scores for each of <levels>, and the ETag they were served with """
+
+        now = monotonic()
+
+        with self.lock:
+            self._roll_over()
+            missing = [
+                level for level in levels if not self._is_fresh(level, now)]
+            self.hits += len(levels) - len(missing)
+            self.misses += len(missing)
+
+            if not missing:
+                return ({
+                    level: list(self.leaderboards[level][0])
+                    for level in levels
+                }, self._etag(levels))
+
+        # Reload every level, since the cached ones may be dropped meanwhile
+        loaded, period_start = self._load(levels)
+
+        with self.lock:
+            self._roll_over()
+            if period_start != self.period_start:
+                # Loaded for a period that ended meanwhile, so serve it as is
+                scores = {
+                    level: [row._asdict() for row in rows]
+                    for level, rows in loaded.items()
+                }
+                return (scores, digest_leaderboards(
+                    period_start, [scores[level] for level in levels]))
+
+            for level, rows in loaded.items():
+                scores = [row._asdict() for row in rows]
+                cached = self.leaderboards.get(level)
+                if cached is None or cached[0] != scores:
+                    self.version += 1
+                self.leaderboards[level] = (scores, now)
+
+            return ({
+                level: list(self.leaderboards[level][0]) for level in levels
+            }, self._etag(levels))
+
+
+    def get_many(self, levels):
+        """ Return a dictionary of level to the serialized top scores for each
+        of <levels> """
+
+        return self.get_many_with_etag(levels)[0]
+
+
+    def get(self, level):
+        """ Return the serialized top scores for <level> """
+
+        return self.get_many([level])[level]
+
+
+    def _could_enter(self, level, time, submitted_at):
+        """ Return true if a score could change the cached leaderboard for
+        <level>. Call with <lock> held. """
+
+        cached = self.leaderboards.get(level)
+
+        if cached is None:
+            return False
+
+        if (self.period is not None and
+                calc_period_start(self.period, submitted_at)
+                != self.period_start):
+            return False
+
+        scores = cached[0]
+        if len(scores) < self.size:
+            return True
+
+        last = scores[-1]
+        return (time, submitted_at) < (last['time'], last['submitted_at'])
+
+
+    def could_enter(self, level, time, submitted_at):
+        """ Return true if a score could change the cached leaderboard for
+        <level> """
+
+        with self.lock:
+            self._roll_over()
+            return self._could_enter(level, time, submitted_at)
+
+
+    def add(self, serialized_scores):
+        """ Update the cached leaderboards in place with committed scores """
+
+        with self.lock:
+            self._roll_over()
+            for serialized_score in serialized_scores:
+                level = serialized_score['level']
+                if not self._could_enter(level, serialized_score['time'],
+                                         serialized_score['submitted_at']):
+                    continue
+
+                scores = self.leaderboards[level][0]
+
+                if self.per_user:
+                    previous = next(
+                        (s for s in scores
+                         if s['user_id'] == serialized_score['user_id']),
+                        None
+                    )
+                    if previous is not None:
+                        if (leaderboard_key(previous)
+                                <= leaderboard_key(serialized_score)):
+                            continue
+                        scores.remove(previous)
+
+                insort(scores, serialized_score, key = leaderboard_key)
+                del scores[self.size:]
+                self.updates += 1
+                self.version += 1
+
+
+    def invalidate(self):
+        """ Drop every cached leaderboard, e.g. after scores are deleted or
+        display names change """
+
+        with self.lock:
+            self.leaderboards.clear()
+            self.version += 1
+
+
+    def metrics(self):
+        """ Return the cache counters """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "updates": self.updates,
+                "not_modified": self.not_modified,
+                "version": self.version,
+                "cached_levels": sorted(self.leaderboards)
+            }
+
+
+minesweeper_leaderboard = LeaderboardCache()
+minesweeper_best_leaderboard = LeaderboardCache(
+    load = MinesweeperPersonalBest.get_leaderboards,
+    per_user = True
+)
+
+# Leaderboard caches by the mode requested from GET /api/minesweeper/scores
+MINESWEEPER_LEADERBOARDS = {
+    'all': minesweeper_leaderboard,
+    'best': minesweeper_best_leaderboard
+}
+
+# Best score of each player in the current day and week, by the window
+# requested from GET /api/minesweeper/scores
+MINESWEEPER_PERIOD_LEADERBOARDS = {
+    period: LeaderboardCache(
+        load = MinesweeperPeriodBest.get_leaderboards,
+        per_user = True,
+        period = period
+    )
+    for period in (DAY, WEEK)
+}
+
+
+def all_leaderboards():
+    """ Return every leaderboard cache, by mode or window """
+
+    return {**MINESWEEPER_LEADERBOARDS, **MINESWEEPER_PERIOD_LEADERBOARDS}
+
+
+def init_leaderboards(app):
+    """ Configure every leaderboard cache from <app> config """
+
+    for cache in all_leaderboards().values():
+        cache.init_app(app)
+
+
+def serialize_entering_scores(scores):
+    """ Serialize the MinesweeperScores in <scores> that could enter any
+    cached leaderboard, to be passed to add_scores() once they are committed
+    """
+
+    return [
+        score.serialize() for score in scores
+        if any(cache.could_enter(score.level, score.time, score.submitted_at)
+               for cache in all_leaderboards().values())
+    ]
+
+
+def add_scores(serialized_scores):
+    """ Update every cached leaderboard with committed scores """
+
+    for cache in all_leaderboards().values():
+        cache.add(serialized_scores)
+
+
+def invalidate_leaderboards():
+    """ Drop every cached leaderboard """
+
+    for cache in all_leaderboards().values():
+        cache.invalidate()
+
+
+def leaderboard_metrics():
+    """ Return the counters of every leaderboard cache, by mode or window """
+
+    return {
+        name: cache.metrics() for name, cache in all_leaderboards().items()
+    }
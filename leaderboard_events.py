@@ -0,0 +1,256 @@
+""" Live minesweeper leaderboard updates, streamed as server-sent events
+
+When a committed score enters the top LEADERBOARD_SIZE of its level, a delta
+(level, score, rank) is sent on a Postgres NOTIFY channel from the transaction
+that inserted it, so it is only delivered if the score is committed. Every
+worker with connected clients LISTENs on the channel, encodes each delta once,
+and fans the encoded message out to its subscribers.
+
+Each subscriber is an idle generator waiting on a queue, so with gevent workers
+(see gunicorn.conf.py) thousands of connections cost a greenlet each rather
+than a worker each.
+
+The same channel tells every worker when users are deleted or purged, so each
+drops its cached leaderboards and the users' cached profiles, and when users'
+stats are rebuilt, so each drops their cached profiles. Workers listen
+from their first request, whether or not they have streaming clients.
+"""
+
+import os
+import queue
+import threading
+import time
+from select import select as select_io
+
+from flask import json
+from sqlalchemy import func, literal, select, tuple_
+
+from models import db, User, MinesweeperScore
+from leaderboard_cache import LEADERBOARD_SIZE, invalidate_leaderboards
+from profile_cache import profile_cache
+
+CHANNEL = 'minesweeper_leaderboard'
+# User ids per removal or change notification, keeping payloads well under
+# Postgres' 8000 byte limit
+MAX_USERS_PER_NOTIFY = 500
+
+HEARTBEAT = b': keep-alive\n\n'
+# Reconnection delay for EventSource clients, in milliseconds
+RETRY = b'retry: 5000\n\n'
+
+
+def calc_leaderboard_rank(score, size = LEADERBOARD_SIZE):
+    """ Return the 1-based leaderboard rank of a MinesweeperScore on its
+    level, or None if it is not in the top <size>.
+
+    Counts at most <size> better scores on the leaderboard index, so the cost
+    does not grow with the number of scores. Scores of deleted users are left
+    out, as they are from the leaderboards.
+    """
+
+    better = (
+        select(literal(1))
+        .select_from(MinesweeperScore)
+        .join(User, User.id == MinesweeperScore.user_id)
+        .where(User.deleted_at.is_(None))
+        .where(MinesweeperScore.level == score.level)
+        .where(tuple_(MinesweeperScore.time, MinesweeperScore.submitted_at)
+               < tuple_(score.time, score.submitted_at))
+        .limit(size)
+        .subquery()
+    )
+    better_count = db.session.execute(
+        select(func.count()).select_from(better)).scalar()
+
+    return better_count + 1 if better_count < size else None
+
+
+def notify_leaderboard_entries(scores):
+    """ Send a delta for each new MinesweeperScore in <scores> that enters
+    its leaderboard, on commit of the current transaction """
+
+    for score in scores:
+        rank = calc_leaderboard_rank(score)
+        if rank is None:
+            continue
+
+        payload = json.dumps({
+            "level": score.level,
+            "score": score.serialize(),
+            "rank": rank
+        })
+        db.session.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+def notify_users_removed(user_ids):
+    """ Tell every worker to drop its cached leaderboards and the cached
+    profiles of <user_ids>, which were deleted or purged, on commit of the
+    current transaction """
+
+    notify_users(user_ids, 'removed_user_ids')
+
+
+def notify_profiles_changed(user_ids):
+    """ Tell every worker to drop the cached profiles of <user_ids>, whose
+    stats changed, on commit of the current transaction """
+
+    notify_users(user_ids, 'changed_user_ids')
+
+
+def notify_users(user_ids, key):
+    """ Send <user_ids> under <key> on the channel, in notifications of up to
+    MAX_USERS_PER_NOTIFY ids """
+
+    for i in range(0, len(user_ids), MAX_USERS_PER_NOTIFY):
+        payload = json.dumps({key: user_ids[i:i + MAX_USERS_PER_NOTIFY]})
+        db.session.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+class LeaderboardHub:
+    """ Per-worker fan-out of leaderboard deltas to streaming clients """
+
+    def __init__(self):
+        self.app = None
+        self.pid = None
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.removals = 0
+        # Set while the listener is LISTENing
+        self.listening = threading.Event()
+
+
+    def init_app(self, app):
+        """ Configure the hub from <app> config """
+
+        self.app = app
+        self.heartbeat_interval = (
+            app.config['MINESWEEPER_LEADERBOARD_STREAM_HEARTBEAT'])
+        self.max_queued = app.config['MINESWEEPER_LEADERBOARD_STREAM_MAX_QUEUED']
+
+
+    def start(self):
+        """ Start listening for deltas in this process, if not started yet.
+
+        Runs again if the process has forked since the hub was started.
+        """
+
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.subscribers = set()
+
+        thread = threading.Thread(target = self._listen, daemon = True)
+        thread.start()
+
+
+    def _listen(self):
+        """ LISTEN for deltas on a dedicated connection and publish them,
+        reconnecting after errors """
+
+        while True:
+            try:
+                with self.app.app_context():
+                    connection = db.engine.raw_connection()
+                # Owned by this thread for good, so keep it out of the pool
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+
+                try:
+                    dbapi_connection.autocommit = True
+                    dbapi_connection.cursor().execute(f'LISTEN {CHANNEL}')
+                    self.listening.set()
+
+                    while True:
+                        select_io([dbapi_connection], [], [], 60)
+                        dbapi_connection.poll()
+                        while dbapi_connection.notifies:
+                            notify = dbapi_connection.notifies.pop(0)
+                            self.dispatch(notify.payload)
+                finally:
+                    self.listening.clear()
+                    connection.close()
+            except Exception:
+                self.app.logger.exception('Leaderboard listener failed')
+                time.sleep(5)
+
+
+    def dispatch(self, payload):
+        """ Drop the caches of removed or changed users, or publish a
+        delta """
+
+        data = json.loads(payload)
+
+        if 'removed_user_ids' in data:
+            invalidate_leaderboards()
+            profile_cache.invalidate(data['removed_user_ids'])
+            with self.lock:
+                self.removals += 1
+        elif 'changed_user_ids' in data:
+            profile_cache.invalidate(data['changed_user_ids'])
+        else:
+            self.publish(payload)
+
+
+    def publish(self, data):
+        """ Encode a delta once and queue it for every subscriber. Subscribers
+        too slow to keep up are disconnected. """
+
+        message = f'event: leaderboard\ndata: {data}\n\n'.encode()
+
+        with self.lock:
+            self.published += 1
+
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    self.subscribers.discard(subscriber)
+                    self.dropped += 1
+
+
+    def stream(self):
+        """ Generate the event stream of one client """
+
+        self.start()
+
+        subscriber = queue.Queue(maxsize = self.max_queued)
+        with self.lock:
+            self.subscribers.add(subscriber)
+
+        try:
+            yield RETRY
+
+            while True:
+                try:
+                    yield subscriber.get(timeout = self.heartbeat_interval)
+                except queue.Empty:
+                    with self.lock:
+                        if subscriber not in self.subscribers:
+                            # Dropped as too slow; the client reconnects
+                            return
+                    yield HEARTBEAT
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
+
+
+    def metrics(self):
+        """ Return the hub counters """
+
+        with self.lock:
+            return {
+                "subscribers": len(self.subscribers),
+                "published": self.published,
+                "dropped": self.dropped,
+                "removals": self.removals
+            }
+
+
+leaderboard_hub = LeaderboardHub()
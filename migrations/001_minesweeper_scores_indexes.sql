@@ -0,0 +1,12 @@
+-- Indexes for the minesweeper leaderboards and for cascade deletes of users.
+-- New databases get them from db.create_all(); apply to existing ones with
+--   psql davids_games -f migrations/001_minesweeper_scores_indexes.sql
+-- CONCURRENTLY builds without blocking score submissions, so this must not be
+-- run inside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_minesweeper_scores_leaderboard
+    ON minesweeper_scores (level, time, submitted_at, id)
+    INCLUDE (user_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_minesweeper_scores_user_id
+    ON minesweeper_scores (user_id);
@@ -0,0 +1,30 @@
+-- Personal best of each user on each level, for the "best per player"
+-- leaderboard (GET /api/minesweeper/scores?mode=best). New databases get the
+-- table from db.create_all(); this creates it if needed and backfills it from
+-- existing scores:
+--   psql davids_games -f migrations/002_minesweeper_personal_bests.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS minesweeper_personal_bests (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    level VARCHAR(30) NOT NULL,
+    time INTEGER NOT NULL,
+    submitted_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    score_id INTEGER NOT NULL
+        REFERENCES minesweeper_scores (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, level)
+);
+
+CREATE INDEX IF NOT EXISTS ix_minesweeper_personal_bests_leaderboard
+    ON minesweeper_personal_bests (level, time, submitted_at, user_id);
+
+INSERT INTO minesweeper_personal_bests
+    (user_id, level, time, submitted_at, score_id)
+SELECT DISTINCT ON (user_id, level)
+    user_id, level, time, submitted_at, id
+FROM minesweeper_scores
+ORDER BY user_id, level, time, submitted_at, id
+ON CONFLICT DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,45 @@
+-- Best score of each user on each level in each UTC day and week (weeks start
+-- on Monday), for the time-windowed leaderboards
+-- (GET /api/minesweeper/scores?window=day|week). New databases get the table
+-- from db.create_all(); this creates it if needed and backfills the windows
+-- kept by flask minesweeper prune-period-bests with its default retention:
+--   psql davids_games -f migrations/003_minesweeper_period_bests.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS minesweeper_period_bests (
+    period VARCHAR(10) NOT NULL,
+    period_start DATE NOT NULL,
+    level VARCHAR(30) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    time INTEGER NOT NULL,
+    submitted_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    score_id INTEGER NOT NULL
+        REFERENCES minesweeper_scores (id) ON DELETE CASCADE,
+    PRIMARY KEY (period, period_start, level, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_minesweeper_period_bests_leaderboard
+    ON minesweeper_period_bests
+    (period, period_start, level, time, submitted_at, user_id);
+
+INSERT INTO minesweeper_period_bests
+    (period, period_start, level, user_id, time, submitted_at, score_id)
+SELECT DISTINCT ON (period, period_start, level, user_id)
+    period, period_start, level, user_id, time, submitted_at, id
+FROM (
+    SELECT 'day' AS period, date_trunc('day', submitted_at)::date AS period_start,
+        *
+    FROM minesweeper_scores
+    WHERE submitted_at >= date_trunc('day', now() AT TIME ZONE 'UTC')
+        - INTERVAL '7 days'
+    UNION ALL
+    SELECT 'week', date_trunc('week', submitted_at)::date, *
+    FROM minesweeper_scores
+    WHERE submitted_at >= date_trunc('week', now() AT TIME ZONE 'UTC')
+        - INTERVAL '4 weeks'
+) AS windowed
+ORDER BY period, period_start, level, user_id, time, submitted_at, id
+ON CONFLICT DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- Trigram index serving the substring searches of GET /users and
+-- GET /api/users. New databases get it from db.create_all() when pg_trgm can
+-- be created. If CREATE EXTENSION fails here (it needs the CREATE privilege on
+-- the database, or a superuser where pg_trgm is not trusted), searches still
+-- work without the index:
+--   psql davids_games -f migrations/004_users_display_name_trgm.sql
+-- CONCURRENTLY builds without blocking signups, so this must not be run inside
+-- a transaction.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_display_name_trgm
+    ON users USING gin (display_name gin_trgm_ops);
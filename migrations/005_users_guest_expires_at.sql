@@ -0,0 +1,20 @@
+-- Guest accounts: each guest login gets a temporary account of its own,
+-- deleted by `flask users purge-guests` once guest_expires_at has passed. New
+-- databases get the column from db.create_all(); this adds it:
+--   psql davids_games -f migrations/005_users_guest_expires_at.sql
+
+BEGIN;
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS guest_expires_at TIMESTAMP WITHOUT TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS ix_users_guest_expires_at
+    ON users (guest_expires_at)
+    WHERE guest_expires_at IS NOT NULL;
+
+-- The account every guest used to share is now an expired guest, so it is
+-- purged with its scores and can no longer be logged in to
+UPDATE users SET guest_expires_at = now() AT TIME ZONE 'UTC'
+WHERE username = 'guest';
+
+COMMIT;
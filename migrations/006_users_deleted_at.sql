@@ -0,0 +1,15 @@
+-- Deleted accounts: deleting an account sets deleted_at, which hides the user,
+-- and their rows are then purged in the background. New databases get the
+-- column from db.create_all(); this adds it:
+--   psql davids_games -f migrations/006_users_deleted_at.sql
+
+BEGIN;
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITHOUT TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS ix_users_deleted_at
+    ON users (deleted_at)
+    WHERE deleted_at IS NOT NULL;
+
+COMMIT;
@@ -1,6 +1,20 @@
+import base64
+import json
+import operator
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from sqlalchemy import exists, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+
 from models import (
-    User, MinesweeperAchievement, UserMinesweeperAchievement, MinesweeperStat
+    db, MinesweeperAchievement, UserMinesweeperAchievement, MinesweeperStat,
+    MinesweeperScore, MinesweeperGame, MinesweeperPersonalBest,
+    MinesweeperPeriodBest, MinesweeperStatSnapshot
 )
+from leaderboard_events import notify_leaderboard_entries
 
 MINESWEEPER_LEVELS = {
     'beginner': {
@@ -20,294 +34,622 @@ MINESWEEPER_LEVELS = {
     }
 }
 
-def calc_minesweeper_achievements(user, last_game_stats):
-    """ Calculate new achievements given stats for a user """
+# Compact codes stored in minesweeper_games.level
+MINESWEEPER_LEVEL_CODES = {
+    'beginner': 1,
+    'intermediate': 2,
+    'expert': 3
+}
 
-    user_achievements = user.minesweeper_achievements
-    user_stats = MinesweeperStat.query.get(user.id)
-    new_achievements = []
+MAX_GAMES_PER_BATCH = 100
 
-    new_achievements.extend(
-        calc_speed_achievements(user_achievements, last_game_stats)
-    )
+# Longest game accepted, in seconds
+MAX_GAME_TIME = 24 * 60 * 60
 
-    new_achievements.extend(
-        calc_time_achievements(user_achievements, user_stats)
-    )
+# Most cells a game can reveal, on the largest board
+MAX_CELLS_REVEALED = max(
+    level['rows'] * level['cols'] for level in MINESWEEPER_LEVELS.values())
 
-    new_achievements.extend(
-        calc_win_achievements(user_achievements, user_stats)
-    )
+PER_GAME = 'game'
+CUMULATIVE = 'cumulative'
 
-    new_achievements.extend(
-        calc_streak_achievements(user_achievements, user_stats)
-    )
+# Stats that only ever accumulate, by adding each game's value
+MINESWEEPER_COUNTER_FIELDS = (
+    'games_played',
+    'games_won',
+    'beginner_games_won',
+    'intermediate_games_won',
+    'expert_games_won',
+    'time_played',
+    'cells_revealed'
+)
+
+MINESWEEPER_STAT_FIELDS = (
+    'games_played',
+    'games_won',
+    'games_lost',
+    'beginner_games_won',
+    'intermediate_games_won',
+    'expert_games_won',
+    'time_played',
+    'cells_revealed',
+    'win_streak'
+)
+
+# A single achievement condition. Cumulative rules compare a field of the
+# user's MinesweeperStat against the threshold; per-game rules compare a field
+# of the last game's stats and additionally require that game to be a win
+# (on <level> if given, otherwise on any level).
+AchievementRule = namedtuple(
+    'AchievementRule',
+    ['title', 'field', 'comparator', 'threshold', 'scope', 'level'],
+    defaults = [CUMULATIVE, None]
+)
+
+MINESWEEPER_ACHIEVEMENT_RULES = (
+    # Speed achievements
+    AchievementRule('Speedy Beginner', 'time_played', operator.le, 20,
+                    PER_GAME, 'beginner'),
+    AchievementRule('Speedy Intermediate', 'time_played', operator.le, 80,
+                    PER_GAME, 'intermediate'),
+    AchievementRule('Speedy Expert', 'time_played', operator.le, 200,
+                    PER_GAME, 'expert'),
+    AchievementRule('Master Oogway', 'time_played', operator.ge, 600,
+                    PER_GAME),
+
+    # Time achievements
+    AchievementRule('Addicted', 'time_played', operator.ge, 3600),
+
+    # Win achievements
+    AchievementRule('Taste of Victory', 'games_won', operator.ge, 1),
+    AchievementRule('Love to Win', 'games_won', operator.ge, 50),
+    AchievementRule('First Steps', 'beginner_games_won', operator.ge, 1),
+    AchievementRule('Solid Progress', 'beginner_games_won', operator.ge, 5),
+    AchievementRule('Permanent Baby', 'beginner_games_won', operator.ge, 20),
+    AchievementRule('Mildly Average', 'intermediate_games_won', operator.ge, 1),
+    AchievementRule('Moderately Average', 'intermediate_games_won',
+                    operator.ge, 5),
+    AchievementRule('Fully Average', 'intermediate_games_won', operator.ge, 20),
+    AchievementRule('Pure Luck', 'expert_games_won', operator.ge, 1),
+    AchievementRule('Pure Skill', 'expert_games_won', operator.ge, 5),
+    AchievementRule('Nerd', 'expert_games_won', operator.ge, 20),
+
+    # Streak achievements
+    AchievementRule('On A Roll', 'win_streak', operator.ge, 5),
+    AchievementRule('Unstoppable', 'win_streak', operator.ge, 10),
+
+    # Loss achievements
+    AchievementRule('Just A Blip', 'games_lost', operator.ge, 1),
+    AchievementRule('Wounded Ego', 'games_lost', operator.ge, 50),
+
+    # Play achievements
+    AchievementRule('Welcome to Minesweeper', 'games_played', operator.ge, 1),
+    AchievementRule('Still Here?', 'games_played', operator.ge, 50),
+    AchievementRule('YOU are the Minesweeper', 'games_played', operator.ge, 100),
+)
+
+
+def snapshot_stats(user_stats):
+    """ Return a dictionary of MINESWEEPER_STAT_FIELDS values for a
+    MinesweeperStat, or all zeros if the user has no stats yet """
+
+    if user_stats is None:
+        return dict.fromkeys(MINESWEEPER_STAT_FIELDS, 0)
+
+    return {
+        field: getattr(user_stats, field) for field in MINESWEEPER_STAT_FIELDS
+    }
+
+
+def snapshot_stats_before(new_stats, counts, previous_win_streak):
+    """ Rebuild the stats snapshot from before an update, given the snapshot
+    after it and the values passed to and returned by
+    MinesweeperStat.add_games """
+
+    old_stats = dict(new_stats)
+
+    for field in MINESWEEPER_COUNTER_FIELDS:
+        old_stats[field] -= counts.get(field, 0)
+
+    old_stats['games_lost'] = old_stats['games_played'] - old_stats['games_won']
+    old_stats['win_streak'] = previous_win_streak or 0
+
+    return old_stats
+
+
+def apply_game_stats(stats, game_stats):
+    """ Return the stats snapshot that results from playing a game with
+    <game_stats> on top of the <stats> snapshot """
 
-    new_achievements.extend(
-        calc_loss_achievements(user_achievements, user_stats)
+    new_stats = dict(stats)
+
+    for field in MINESWEEPER_COUNTER_FIELDS:
+        new_stats[field] += game_stats[field]
+
+    new_stats['games_lost'] = new_stats['games_played'] - new_stats['games_won']
+    new_stats['win_streak'] = (
+        (new_stats['win_streak'] + 1)
+        if game_stats['games_won'] else
+        0
     )
 
-    new_achievements.extend(
-        calc_play_achievements(user_achievements, user_stats)
+    return new_stats
+
+
+def is_rule_met(rule, stats, last_game_stats):
+    """ Check whether an achievement rule is satisfied by a stats snapshot
+    and the stats of the last game played """
+
+    if rule.scope == PER_GAME:
+        won_field = f'{rule.level}_games_won' if rule.level else 'games_won'
+        if not last_game_stats[won_field]:
+            return False
+
+        return rule.comparator(last_game_stats[rule.field], rule.threshold)
+
+    return rule.comparator(stats[rule.field], rule.threshold)
+
+
+def build_threshold_index(rules):
+    """ Index cumulative '>=' rules by stat field.
+
+    Returns {field: (thresholds, titles)} with both lists sorted by threshold,
+    plus a list of the remaining rules, which must be checked every time.
+    """
+
+    index = {}
+    unindexed_rules = []
+
+    for rule in rules:
+        if rule.scope == CUMULATIVE and rule.comparator is operator.ge:
+            index.setdefault(rule.field, []).append(
+                (rule.threshold, rule.title))
+        else:
+            unindexed_rules.append(rule)
+
+    threshold_index = {
+        field: ([t for t, _ in sorted(entries)], [a for _, a in sorted(entries)])
+        for field, entries in index.items()
+    }
+
+    return threshold_index, unindexed_rules
+
+
+MINESWEEPER_THRESHOLD_INDEX, MINESWEEPER_UNINDEXED_RULES = (
+    build_threshold_index(MINESWEEPER_ACHIEVEMENT_RULES))
+
+# Per-game rule fields that can be recovered from winning games in
+# minesweeper_scores, mapped to the matching MinesweeperScore column
+MINESWEEPER_SCORE_FIELDS = {
+    'time_played': 'time'
+}
+
+MINESWEEPER_RULE_ORDER = {
+    rule.title: i for i, rule in enumerate(MINESWEEPER_ACHIEVEMENT_RULES)
+}
+
+
+def find_crossed_titles(old_stats, new_stats, last_game_stats):
+    """ Return titles of achievements whose condition became true between
+    the <old_stats> and <new_stats> snapshots, in catalog order.
+
+    Indexed thresholds are found by bisecting on each field that increased,
+    so only thresholds in (old, new] are visited.
+    """
+
+    titles = []
+
+    for field, (thresholds, field_titles) in (
+            MINESWEEPER_THRESHOLD_INDEX.items()):
+        old_value = old_stats[field]
+        new_value = new_stats[field]
+
+        if new_value <= old_value:
+            continue
+
+        lo = bisect_right(thresholds, old_value)
+        hi = bisect_right(thresholds, new_value)
+        titles.extend(field_titles[lo:hi])
+
+    titles.extend(
+        rule.title for rule in MINESWEEPER_UNINDEXED_RULES
+        if is_rule_met(rule, new_stats, last_game_stats)
     )
 
-    return new_achievements
+    return sorted(titles, key = MINESWEEPER_RULE_ORDER.get)
+
+
+def calc_minesweeper_achievements(user_id, old_stats, games):
+    """ Calculate new achievements for a user who played <games> (a list of
+    per-game stats, in the order they were played) starting from the
+    <old_stats> snapshot.
+
+    The games are replayed one at a time so that win streaks are tracked as
+    they were played. Only achievements whose thresholds were crossed by a
+    game (plus per-game achievements) are considered, so the work done depends
+    on what changed rather than on the size of the catalog. Those not already
+    owned are loaded in a single query. Rules whose achievement has not been
+    seeded are skipped.
+    """
 
+    titles = set()
+    stats = old_stats
+
+    for game_stats in games:
+        new_stats = apply_game_stats(stats, game_stats)
+        titles.update(find_crossed_titles(stats, new_stats, game_stats))
+        stats = new_stats
+
+    if not titles:
+        return []
+
+    is_owned = exists().where(
+        UserMinesweeperAchievement.achievement_id == MinesweeperAchievement.id,
+        UserMinesweeperAchievement.user_id == user_id
+    )
 
-def calc_speed_achievements(user_achievements, last_game_stats):
-    """ Calculate speed-related achievements """
+    achievements = (MinesweeperAchievement.query
+        .filter(MinesweeperAchievement.title.in_(titles))
+        .filter(~is_owned)
+        .all())
 
-    new_achievements = []
+    return sorted(
+        achievements, key = lambda a: MINESWEEPER_RULE_ORDER[a.title])
 
-    # Speedy Beginner achievement
-    if (last_game_stats['beginner_games_won']
-        and last_game_stats['time_played'] <= 20):
-        speed_beginner = MinesweeperAchievement.query.filter_by(
-            title = 'Speedy Beginner'
-        ).one()
 
-        if speed_beginner not in user_achievements:
-            new_achievements.append(speed_beginner)
+def award_minesweeper_achievements(user_id, achievements):
+    """ Give achievements to a user, ignoring any they already have """
 
-    # Speedy Intermediate achievement
-    if (last_game_stats['intermediate_games_won']
-        and last_game_stats['time_played'] <= 80):
-        speed_intermediate = MinesweeperAchievement.query.filter_by(
-            title = 'Speedy Intermediate'
-        ).one()
+    if not achievements:
+        return
 
-        if speed_intermediate not in user_achievements:
-            new_achievements.append(speed_intermediate)
+    db.session.execute(
+        insert(UserMinesweeperAchievement)
+        .values([
+            {"user_id": user_id, "achievement_id": achievement.id}
+            for achievement in achievements
+        ])
+        .on_conflict_do_nothing()
+    )
 
-    # Speedy Expert achievement
-    if (last_game_stats['expert_games_won']
-        and last_game_stats['time_played'] <= 200):
-        speed_expert = MinesweeperAchievement.query.filter_by(
-            title = 'Speedy Expert'
-        ).one()
 
-        if speed_expert not in user_achievements:
-            new_achievements.append(speed_expert)
+def game_result_stats(result):
+    """ Convert a game result (level, time, won, cells_revealed, finished_at)
+    into per-game stats, in the format sent to /api/minesweeper/stats """
 
-    # Master Oogway achievement
-    if (last_game_stats['games_won']
-        and last_game_stats['time_played'] >= 600):
-        speed_slow = MinesweeperAchievement.query.filter_by(
-            title = 'Master Oogway'
-        ).one()
+    won = 1 if result['won'] else 0
 
-        if speed_slow not in user_achievements:
-            new_achievements.append(speed_slow)
+    game_stats = {
+        "games_played": 1,
+        "games_won": won,
+        "time_played": result['time'],
+        "cells_revealed": result['cells_revealed'],
+        "last_played_at": parse_game_date(result['finished_at']),
+        "level": result['level']
+    }
 
-    return new_achievements
+    for level in MINESWEEPER_LEVELS:
+        game_stats[f'{level}_games_won'] = won if result['level'] == level else 0
 
+    return game_stats
 
-def calc_time_achievements(user_achievements, user_stats):
-    """ Calculate time-related achievements """
 
-    new_achievements = []
+def parse_game_date(value):
+    """ Parse a date string sent by the client, as an HTTP date (from
+    Date.toUTCString()) or in ISO format, into a naive UTC datetime. Returns
+    None if it is not a date. """
 
-    # Addicted achievement
-    if user_stats.time_played >= 3600:
-        time_hour = MinesweeperAchievement.query.filter_by(
-            title = 'Addicted'
-        ).one()
+    if not isinstance(value, str):
+        return None
 
-        if time_hour not in user_achievements:
-            new_achievements.append(time_hour)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            when = datetime.fromisoformat(value)
+        except ValueError:
+            return None
 
-    return new_achievements
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo = None)
 
+    return when
 
-def calc_win_achievements(user_achievements, user_stats):
-    """ Calculate win-related achievements """
 
-    new_achievements = []
+def validate_int(data, field, maximum):
+    """ Return an error message if data[field] is not an integer from 0 to
+    <maximum>, otherwise None """
 
-    # Taste of Victory achievement
-    if user_stats.games_won >= 1:
-        win_1 = MinesweeperAchievement.query.filter_by(
-            title = 'Taste of Victory'
-        ).one()
+    value = data.get(field)
+    if (not isinstance(value, int) or isinstance(value, bool)
+            or not 0 <= value <= maximum):
+        return f'{field} must be an integer from 0 to {maximum}.'
 
-        if win_1 not in user_achievements:
-            new_achievements.append(win_1)
+    return None
 
-    # Love to Win achievement
-    if user_stats.games_won >= 50:
-        win_50 = MinesweeperAchievement.query.filter_by(
-            title = 'Love to Win'
-        ).one()
 
-        if win_50 not in user_achievements:
-            new_achievements.append(win_50)
+def validate_score(score):
+    """ Return an error message if <score> (time and level) is not a valid
+    minesweeper score, otherwise None """
 
-    # First Steps achievement
-    if user_stats.beginner_games_won >= 1:
-        win_1_beginner = MinesweeperAchievement.query.filter_by(
-            title = 'First Steps'
-        ).one()
+    if not isinstance(score, dict):
+        return 'Score must be an object.'
 
-        if win_1_beginner not in user_achievements:
-            new_achievements.append(win_1_beginner)
+    if score.get('level') not in MINESWEEPER_LEVELS:
+        return f'Invalid level: {score.get("level")}.'
 
-    # Solid Progress achievement
-    if user_stats.beginner_games_won >= 5:
-        win_5_beginner = MinesweeperAchievement.query.filter_by(
-            title = 'Solid Progress'
-        ).one()
+    return validate_int(score, 'time', MAX_GAME_TIME)
 
-        if win_5_beginner not in user_achievements:
-            new_achievements.append(win_5_beginner)
 
-    # Permanent Baby achievement
-    if user_stats.beginner_games_won >= 20:
-        win_20_beginner = MinesweeperAchievement.query.filter_by(
-            title = 'Permanent Baby'
-        ).one()
+def validate_game_stats(game_stats):
+    """ Return an error message if <game_stats> are not valid stats of one
+    game, in the format sent to /api/minesweeper/stats, otherwise None """
 
-        if win_20_beginner not in user_achievements:
-            new_achievements.append(win_20_beginner)
+    if not isinstance(game_stats, dict):
+        return 'Game stats must be an object.'
 
-    # Mildly Average achievement
-    if user_stats.intermediate_games_won >= 1:
-        win_1_intermediate = MinesweeperAchievement.query.filter_by(
-            title = 'Mildly Average'
-        ).one()
+    level = game_stats.get('level')
+    if level not in MINESWEEPER_LEVELS:
+        return f'Invalid level: {level}.'
 
-        if win_1_intermediate not in user_achievements:
-            new_achievements.append(win_1_intermediate)
+    maximums = {
+        "time_played": MAX_GAME_TIME,
+        "cells_revealed": MAX_CELLS_REVEALED
+    }
 
-    # Moderately Average achievement
-    if user_stats.intermediate_games_won >= 5:
-        win_5_intermediate = MinesweeperAchievement.query.filter_by(
-            title = 'Moderately Average'
-        ).one()
+    for field in MINESWEEPER_COUNTER_FIELDS:
+        error = validate_int(game_stats, field, maximums.get(field, 1))
+        if error:
+            return error
 
-        if win_5_intermediate not in user_achievements:
-            new_achievements.append(win_5_intermediate)
+    if game_stats['games_won'] > game_stats['games_played']:
+        return 'games_won cannot be more than games_played.'
 
-    # Fully Average achievement
-    if user_stats.intermediate_games_won >= 20:
-        win_20_intermediate = MinesweeperAchievement.query.filter_by(
-            title = 'Fully Average'
-        ).one()
+    # A win counts once, towards the level played
+    level_games_won = sum(
+        game_stats[f'{other_level}_games_won']
+        for other_level in MINESWEEPER_LEVELS
+    )
+    if (level_games_won != game_stats['games_won']
+            or game_stats[f'{level}_games_won'] != game_stats['games_won']):
+        return f'{level}_games_won must equal games_won, and other levels 0.'
 
-        if win_20_intermediate not in user_achievements:
-            new_achievements.append(win_20_intermediate)
+    if parse_game_date(game_stats.get('last_played_at')) is None:
+        return 'last_played_at must be a date string.'
 
-    # Pure Luck achievement
-    if user_stats.expert_games_won >= 1:
-        win_1_expert = MinesweeperAchievement.query.filter_by(
-            title = 'Pure Luck'
-        ).one()
+    return None
 
-        if win_1_expert not in user_achievements:
-            new_achievements.append(win_1_expert)
 
-    # Pure Skill achievement
-    if user_stats.expert_games_won >= 5:
-        win_5_expert = MinesweeperAchievement.query.filter_by(
-            title = 'Pure Skill'
-        ).one()
+def parse_game_stats(game_stats):
+    """ Return a copy of valid <game_stats>, as sent to /api/minesweeper/stats,
+    with last_played_at parsed into a datetime """
 
-        if win_5_expert not in user_achievements:
-            new_achievements.append(win_5_expert)
+    return {
+        **game_stats,
+        "last_played_at": parse_game_date(game_stats['last_played_at'])
+    }
 
-    # Nerd achievement
-    if user_stats.expert_games_won >= 20:
-        win_20_expert = MinesweeperAchievement.query.filter_by(
-            title = 'Nerd'
-        ).one()
 
-        if win_20_expert not in user_achievements:
-            new_achievements.append(win_20_expert)
+def validate_game_result(result):
+    """ Return an error message if <result> is not a valid game result,
+    otherwise None """
 
-    return new_achievements
+    if not isinstance(result, dict):
+        return 'Game result must be an object.'
 
+    if result.get('level') not in MINESWEEPER_LEVELS:
+        return f'Invalid level: {result.get("level")}.'
 
-def calc_streak_achievements(user_achievements, user_stats):
-    """ Calculate streak-related achievements """
+    error = (validate_int(result, 'time', MAX_GAME_TIME) or
+             validate_int(result, 'cells_revealed', MAX_CELLS_REVEALED))
+    if error:
+        return error
 
-    new_achievements = []
+    if not isinstance(result.get('won'), bool):
+        return 'won must be true or false.'
 
-    # On A Roll
-    if user_stats.win_streak >= 5:
-        streak_5 = MinesweeperAchievement.query.filter_by(
-            title = 'On A Roll'
-        ).one()
+    if parse_game_date(result.get('finished_at')) is None:
+        return 'finished_at must be a date string.'
 
-        if streak_5 not in user_achievements:
-            new_achievements.append(streak_5)
+    return None
 
-    # Unstoppable
-    if user_stats.win_streak >= 10:
-        streak_10 = MinesweeperAchievement.query.filter_by(
-            title = 'Unstoppable'
-        ).one()
 
-        if streak_10 not in user_achievements:
-            new_achievements.append(streak_10)
+def game_event_row(user_id, game_stats):
+    """ Convert the per-game stats of one game into a row of
+    minesweeper_games """
 
-    return new_achievements
+    return {
+        "user_id": user_id,
+        "level": MINESWEEPER_LEVEL_CODES[game_stats['level']],
+        "won": bool(game_stats['games_won']),
+        "time": game_stats['time_played'],
+        "cells_revealed": game_stats['cells_revealed'],
+        "finished_at": game_stats['last_played_at']
+    }
 
 
-def calc_loss_achievements(user_achievements, user_stats):
-    """ Calculate loss-related achievements """
+def add_minesweeper_game_stats(user_id, games):
+    """ Apply the per-game stats of <games>, in the order they were played, to
+    a user's stats with a single upsert and award any new achievements, in the
+    current transaction. The games are also appended to minesweeper_games,
+    from which the stats can be rebuilt.
 
-    new_achievements = []
+    Returns a tuple of (stats, new achievements).
+    """
 
-    # Just A Blip achievement
-    if (user_stats.games_played - user_stats.games_won) >= 1:
-        loss_1 = MinesweeperAchievement.query.filter_by(
-            title = 'Just A Blip'
-        ).one()
+    counts = {
+        field: sum(game_stats[field] for game_stats in games)
+        for field in MINESWEEPER_COUNTER_FIELDS
+    }
 
-        if loss_1 not in user_achievements:
-            new_achievements.append(loss_1)
+    # Only the wins after the last loss count towards the win streak
+    reset_win_streak = not all(game_stats['games_won'] for game_stats in games)
+    win_streak = 0
+    for game_stats in reversed(games):
+        if not game_stats['games_won']:
+            break
+        win_streak += 1
+
+    stats, previous_win_streak = MinesweeperStat.add_games(
+        user_id,
+        counts,
+        win_streak = win_streak,
+        reset_win_streak = reset_win_streak,
+        last_played_at = games[-1]['last_played_at']
+    )
 
-    # Wounded Ego achievement
-    if (user_stats.games_played - user_stats.games_won) >= 50:
-        loss_50 = MinesweeperAchievement.query.filter_by(
-            title = 'Wounded Ego'
-        ).one()
+    # Logged after the upsert, which locks the user's stats row until commit,
+    # so a user's game ids increase in the order their stats are updated
+    db.session.execute(
+        insert(MinesweeperGame)
+        .values([game_event_row(user_id, game_stats) for game_stats in games])
+    )
 
-        if loss_50 not in user_achievements:
-            new_achievements.append(loss_50)
+    # Stats created now hold only logged games, so they can be rebuilt from
+    # zero; only stats from before the log need a snapshot of their own
+    if previous_win_streak is None:
+        db.session.execute(
+            insert(MinesweeperStatSnapshot)
+            .values(
+                user_id = user_id,
+                last_game_id = 0,
+                stats = {
+                    **{field: 0 for field in MINESWEEPER_COUNTER_FIELDS},
+                    "win_streak": 0,
+                    "last_played_at": None
+                }
+            )
+            .on_conflict_do_nothing()
+        )
+
+    old_stats = snapshot_stats_before(
+        snapshot_stats(stats), counts, previous_win_streak)
+    new_achievements = calc_minesweeper_achievements(user_id, old_stats, games)
+    award_minesweeper_achievements(user_id, new_achievements)
+
+    return stats, new_achievements
+
+
+def insert_minesweeper_scores(score_rows):
+    """ Insert scores (dictionaries of MinesweeperScore columns) with a single
+    multi-row INSERT, update personal and period bests, notify live leaderboards, and
+    return the new MinesweeperScore objects """
+
+    if not score_rows:
+        return []
+
+    new_scores = db.session.execute(
+        select(MinesweeperScore)
+        .from_statement(
+            insert(MinesweeperScore)
+            .values(score_rows)
+            .returning(*MinesweeperScore.__table__.columns)
+        )
+    ).scalars().all()
+
+    MinesweeperPersonalBest.add_scores(new_scores)
+    MinesweeperPeriodBest.add_scores(new_scores)
+    notify_leaderboard_entries(new_scores)
+
+    return new_scores
+
+
+def record_minesweeper_games(user_id, results):
+    """ Record a user's finished games in the current transaction.
+
+    <results> is a list of game results in the order they were played. Winning
+    games are added to minesweeper_scores with one multi-row INSERT, the stats
+    of all games are applied with one upsert, and achievements are evaluated
+    once for the whole list.
+
+    Scores are submitted now: finished_at comes from the client, so it is only
+    kept in the game log, and never orders or places a score on a leaderboard.
+
+    Returns a tuple of (stats, new achievements, new scores).
+    """
+
+    submitted_at = datetime.utcnow()
+
+    new_scores = insert_minesweeper_scores([
+        {
+            "user_id": user_id,
+            "time": result['time'],
+            "level": result['level'],
+            "submitted_at": submitted_at
+        }
+        for result in results if result['won']
+    ])
+
+    stats, new_achievements = add_minesweeper_game_stats(
+        user_id, [game_result_stats(result) for result in results])
+
+    return stats, new_achievements, new_scores
+
+
+def select_achievement_candidates(achievement_ids, first_user_id, last_user_id):
+    """ Build a set-based SELECT of (user_id, achievement_id) pairs for every
+    user with first_user_id <= id <= last_user_id who meets a rule.
+
+    <achievement_ids> maps achievement titles to ids; rules without an id are
+    left out. Cumulative rules are checked against minesweeper_stats and
+    per-game rules against the winning games kept in minesweeper_scores.
+    Returns None if no rule can be checked.
+    """
+
+    selects = []
+
+    for rule in MINESWEEPER_ACHIEVEMENT_RULES:
+        achievement_id = achievement_ids.get(rule.title)
+        if achievement_id is None:
+            continue
+
+        if rule.scope == CUMULATIVE:
+            model = MinesweeperStat
+            condition = rule.comparator(
+                getattr(MinesweeperStat, rule.field), rule.threshold)
+        elif rule.field in MINESWEEPER_SCORE_FIELDS:
+            model = MinesweeperScore
+            condition = rule.comparator(
+                getattr(MinesweeperScore, MINESWEEPER_SCORE_FIELDS[rule.field]),
+                rule.threshold)
+            if rule.level:
+                condition = condition & (MinesweeperScore.level == rule.level)
+        else:
+            continue
 
-    return new_achievements
+        selects.append(
+            select(
+                model.user_id,
+                literal(achievement_id).label('achievement_id')
+            )
+            .where(condition)
+            .where(model.user_id.between(first_user_id, last_user_id))
+            .distinct()
+        )
 
+    if not selects:
+        return None
 
-def calc_play_achievements(user_achievements, user_stats):
-    """ Calculate play-related achievements """
+    return union_all(*selects)
 
-    new_achievements = []
 
-    # Welcome to Minesweeper achievement
-    if user_stats.games_played >= 1:
-        play_1 = MinesweeperAchievement.query.filter_by(
-            title = 'Welcome to Minesweeper'
-        ).one()
+def encode_score_cursor(score):
+    """ Encode the leaderboard position (time, submitted_at, id) of a
+    serialized score as an opaque, URL-safe cursor token """
 
-        if play_1 not in user_achievements:
-            new_achievements.append(play_1)
+    key = [score['time'], score['submitted_at'].isoformat(), score['id']]
 
-    # Still Here? achievement
-    if user_stats.games_played >= 50:
-        play_50 = MinesweeperAchievement.query.filter_by(
-            title = 'Still Here?'
-        ).one()
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
 
-        if play_50 not in user_achievements:
-            new_achievements.append(play_50)
 
-    # YOU are the Minesweeper achievement
-    if user_stats.games_played >= 100:
-        play_100 = MinesweeperAchievement.query.filter_by(
-            title = 'YOU are the Minesweeper'
-        ).one()
+def decode_score_cursor(cursor):
+    """ Decode a cursor token into a (time, submitted_at, id) key.
+    Raises ValueError if the token is invalid. """
 
-        if play_100 not in user_achievements:
-            new_achievements.append(play_100)
+    try:
+        time, submitted_at, id = json.loads(base64.urlsafe_b64decode(cursor))
+        key = (int(time), datetime.fromisoformat(submitted_at), int(id))
+    except (TypeError, ValueError) as error:
+        raise ValueError('Invalid cursor.') from error
 
-    return new_achievements
\ No newline at end of file
+    return key
@@ -0,0 +1,240 @@
+""" Projection of minesweeper_stats from the minesweeper_games log
+
+minesweeper_stats is updated in place as games are recorded, and every game is
+also appended to minesweeper_games. The stats of a user can be rebuilt from
+that log, starting from the user's snapshot in minesweeper_stat_snapshots and
+replaying only the games logged after it. Each rebuild stores a new snapshot,
+so the next one starts from there.
+
+Users get an empty snapshot when their first games create their stats, so
+their stats are rebuilt from zero. Users with stats from before the log existed
+need a first snapshot of their current stats, taken by
+snapshot_minesweeper_stats, since their earlier games cannot be replayed.
+"""
+
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, MinesweeperGame, MinesweeperStat, MinesweeperStatSnapshot
+from minesweeper import MINESWEEPER_COUNTER_FIELDS, MINESWEEPER_LEVEL_CODES
+
+# MinesweeperStat columns derived from the games, other than last_played_at
+PROJECTED_FIELDS = MINESWEEPER_COUNTER_FIELDS + ('win_streak',)
+
+LEVEL_WIN_FIELDS = {
+    code: f'{level}_games_won' for level, code in MINESWEEPER_LEVEL_CODES.items()
+}
+
+REPLAY_BUFFER_ROWS = 10000
+
+
+def fold_minesweeper_games(stats, games):
+    """ Replay <games>, rows of minesweeper_games in the order they were
+    logged, on top of the projected <stats> (a dictionary of PROJECTED_FIELDS
+    and last_played_at).
+
+    Returns a tuple of (new stats, id of the last game replayed), with None as
+    the id if there were no games. Counters are kept in local variables, since
+    this loop runs once per logged game.
+    """
+
+    games_played = stats['games_played']
+    games_won = stats['games_won']
+    time_played = stats['time_played']
+    cells_revealed = stats['cells_revealed']
+    win_streak = stats['win_streak']
+    last_played_at = stats['last_played_at']
+
+    # Wins with an unknown level are counted under None and dropped
+    level_wins = {
+        code: stats[field] for code, field in LEVEL_WIN_FIELDS.items()
+    }
+    level_wins[None] = 0
+
+    last_game_id = None
+
+    for (last_game_id, _, level, won, time, cells, last_played_at) in games:
+        games_played += 1
+        time_played += time
+        cells_revealed += cells
+
+        if won:
+            games_won += 1
+            win_streak += 1
+            level_wins[level] += 1
+        else:
+            win_streak = 0
+
+    new_stats = {
+        "games_played": games_played,
+        "games_won": games_won,
+        "time_played": time_played,
+        "cells_revealed": cells_revealed,
+        "win_streak": win_streak,
+        "last_played_at": last_played_at
+    }
+    for code, field in LEVEL_WIN_FIELDS.items():
+        new_stats[field] = level_wins[code]
+
+    return new_stats, last_game_id
+
+
+def load_snapshot_stats(snapshot):
+    """ Return the projected stats stored in a MinesweeperStatSnapshot """
+
+    stats = dict(snapshot.stats)
+    if stats['last_played_at'] is not None:
+        stats['last_played_at'] = datetime.fromisoformat(stats['last_played_at'])
+
+    return stats
+
+
+def dump_snapshot_stats(stats):
+    """ Return projected stats in the JSON format of
+    MinesweeperStatSnapshot.stats """
+
+    dumped = dict(stats)
+    if dumped['last_played_at'] is not None:
+        dumped['last_played_at'] = dumped['last_played_at'].isoformat()
+
+    return dumped
+
+
+def lock_minesweeper_stats(first_user_id, last_user_id):
+    """ Lock the minesweeper_stats rows of users with ids in
+    [first_user_id, last_user_id] until the end of the transaction.
+
+    Recording a game updates the user's stats row before logging the game, so
+    once the lock is held every logged game of these users is committed, and
+    games recorded later wait for the transaction to end.
+    """
+
+    db.session.execute(
+        select(MinesweeperStat.user_id)
+        .where(MinesweeperStat.user_id.between(first_user_id, last_user_id))
+        .with_for_update()
+    )
+
+
+def snapshot_minesweeper_stats(first_user_id, last_user_id):
+    """ Take a first snapshot, from their current stats, of users with ids in
+    [first_user_id, last_user_id] who have stats but no snapshot, in the
+    current transaction.
+
+    Returns the number of snapshots taken.
+    """
+
+    lock_minesweeper_stats(first_user_id, last_user_id)
+
+    last_game_id = (
+        select(func.coalesce(func.max(MinesweeperGame.id), 0))
+        .where(MinesweeperGame.user_id == MinesweeperStat.user_id)
+        .scalar_subquery()
+    )
+    stats = func.jsonb_build_object(
+        *[arg for field in PROJECTED_FIELDS
+          for arg in (field, getattr(MinesweeperStat, field))],
+        'last_played_at', MinesweeperStat.last_played_at
+    )
+
+    result = db.session.execute(
+        insert(MinesweeperStatSnapshot)
+        .from_select(
+            ['user_id', 'last_game_id', 'stats'],
+            select(MinesweeperStat.user_id, last_game_id, stats)
+            .where(MinesweeperStat.user_id.between(first_user_id, last_user_id))
+        )
+        .on_conflict_do_nothing()
+    )
+
+    return result.rowcount
+
+
+def rebuild_minesweeper_stats(first_user_id, last_user_id):
+    """ Rebuild the stats of users with ids in [first_user_id, last_user_id]
+    who have a snapshot, and store a new snapshot for each, in the current
+    transaction.
+
+    The games logged after each user's snapshot are streamed from the database
+    in id order and replayed with fold_minesweeper_games.
+
+    Returns a tuple of (ids of the users rebuilt, games replayed).
+    """
+
+    lock_minesweeper_stats(first_user_id, last_user_id)
+
+    snapshots = {
+        snapshot.user_id: snapshot
+        for snapshot in MinesweeperStatSnapshot.query.filter(
+            MinesweeperStatSnapshot.user_id.between(first_user_id, last_user_id))
+    }
+
+    if not snapshots:
+        return [], 0
+
+    games = db.session.execute(
+        select(*MinesweeperGame.__table__.columns)
+        .join(
+            MinesweeperStatSnapshot,
+            MinesweeperStatSnapshot.user_id == MinesweeperGame.user_id
+        )
+        .where(MinesweeperGame.user_id.between(first_user_id, last_user_id))
+        .where(MinesweeperGame.id > MinesweeperStatSnapshot.last_game_id)
+        .order_by(MinesweeperGame.user_id, MinesweeperGame.id)
+        .execution_options(
+            stream_results = True,
+            max_row_buffer = REPLAY_BUFFER_ROWS
+        )
+    )
+
+    projections = {
+        user_id: (load_snapshot_stats(snapshot), snapshot.last_game_id)
+        for user_id, snapshot in snapshots.items()
+    }
+    games_replayed = 0
+
+    for user_id, user_games in groupby(games, key = itemgetter(1)):
+        user_games = list(user_games)
+        stats, _ = projections[user_id]
+        projections[user_id] = fold_minesweeper_games(stats, user_games)
+        games_replayed += len(user_games)
+
+    stat_rows = []
+    snapshot_rows = []
+
+    for user_id, (stats, last_game_id) in projections.items():
+        stat_rows.append({"user_id": user_id, **stats})
+        snapshot_rows.append({
+            "user_id": user_id,
+            "last_game_id": last_game_id,
+            "stats": dump_snapshot_stats(stats)
+        })
+
+    stmt = insert(MinesweeperStat)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements = [MinesweeperStat.user_id],
+            set_ = {field: stmt.excluded[field] for field in stat_rows[0]
+                    if field != 'user_id'}
+        ),
+        stat_rows
+    )
+
+    stmt = insert(MinesweeperStatSnapshot)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements = [MinesweeperStatSnapshot.user_id],
+            set_ = {
+                "last_game_id": stmt.excluded.last_game_id,
+                "stats": stmt.excluded.stats,
+                "taken_at": func.now()
+            }
+        ),
+        snapshot_rows
+    )
+
+    return list(projections), games_replayed
@@ -0,0 +1,87 @@
+""" Retention of old minesweeper scores
+
+Every winning game adds a row to minesweeper_scores, but only the top of each
+leaderboard and the personal and period bests are read back. Older scores that
+are none of these are moved out of the table by
+flask minesweeper compact-scores: each batch is deleted with
+DELETE ... RETURNING and the returned rows are appended to a gzipped JSON lines
+archive before the batch is committed, so a score is never deleted without
+having been archived.
+"""
+
+import json
+
+from sqlalchemy import delete, exists, func, literal_column, select
+
+from models import (
+    db, MinesweeperScore, MinesweeperPersonalBest, MinesweeperPeriodBest)
+from minesweeper import MINESWEEPER_LEVELS
+from leaderboard_cache import LEADERBOARD_SIZE
+
+ARCHIVED_COLUMNS = ('id', 'user_id', 'time', 'level', 'submitted_at')
+
+
+def select_leaderboard_score_ids():
+    """ Return the ids of the scores on the leaderboard of any level.
+
+    Archiving only removes scores ranked below these, so the set does not
+    change while scores are archived.
+    """
+
+    leaderboards = MinesweeperScore.get_leaderboards(
+        list(MINESWEEPER_LEVELS), LEADERBOARD_SIZE)
+
+    return [row.id for rows in leaderboards.values() for row in rows]
+
+
+def archive_minesweeper_scores(archive, submitted_before, keep_ids, after_id,
+                               batch_size):
+    """ Delete up to <batch_size> scores with ids above <after_id> submitted
+    before <submitted_before>, other than <keep_ids> and personal or period
+    bests, and write them to the text file <archive> as JSON lines.
+
+    Returns a tuple of (scores archived, bytes of row data deleted, id of the
+    last score archived or None). The caller commits once the archive is
+    flushed.
+    """
+
+    is_best = (
+        exists().where(MinesweeperPersonalBest.score_id == MinesweeperScore.id)
+        | exists().where(MinesweeperPeriodBest.score_id == MinesweeperScore.id)
+    )
+
+    batch = (
+        select(MinesweeperScore.id)
+        .where(MinesweeperScore.id > after_id)
+        .where(MinesweeperScore.submitted_at < submitted_before)
+        .where(MinesweeperScore.id.not_in(keep_ids))
+        .where(~is_best)
+        .order_by(MinesweeperScore.id)
+        .limit(batch_size)
+    )
+
+    rows = db.session.execute(
+        delete(MinesweeperScore)
+        .where(MinesweeperScore.id.in_(batch.scalar_subquery()))
+        .returning(
+            *[getattr(MinesweeperScore, column) for column in ARCHIVED_COLUMNS],
+            func.pg_column_size(literal_column('minesweeper_scores.*'))
+                .label('row_bytes')
+        )
+        .execution_options(synchronize_session = False)
+    ).all()
+
+    row_bytes = 0
+    last_id = None
+
+    for row in rows:
+        score = {column: getattr(row, column) for column in ARCHIVED_COLUMNS}
+        score['submitted_at'] = score['submitted_at'].isoformat()
+        archive.write(json.dumps(score) + '\n')
+
+        row_bytes += row.row_bytes
+        last_id = max(last_id or 0, row.id)
+
+    archive.flush()
+
+    return len(rows), row_bytes, last_id
@@ -1,20 +1,32 @@
 """ SQLAlchemy models for David's Games """
 
-from datetime import datetime
+import secrets
+from datetime import datetime, timedelta
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    DDL, column, event, exists, select, true, tuple_, values)
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.hybrid import hybrid_property
+
+from passwords import password_hasher
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 DEFAULT_USER_IMAGE_URL = '/static/images/default-pic.png'
 DEFAULT_USER_ROLE = 'user'
 
+# Guests never log in with a password; this matches no bcrypt hash
+GUEST_PASSWORD = '!'
+
 SECONDS_PER_MINUTE = 60
 SECONDS_PER_HOUR = 60 * SECONDS_PER_MINUTE
 SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
 
+DAY = 'day'
+WEEK = 'week'
+LEADERBOARD_PERIODS = (DAY, WEEK)
+
 
 def connect_db(app):
     """ Connect this database to provided Flask app """
@@ -24,11 +36,151 @@ def connect_db(app):
         db.init_app(app)
 
 
+def query_leaderboards(model, id_column, order_by, levels, qty,
+                       condition = None):
+    """ Query the top <qty> rows of a scores <model> for each of <levels> in
+    one statement, with a LATERAL subquery per level ordered by <order_by>
+    and limited to <qty>, joining the display names of their users. Rows of
+    deleted users are left out, and only rows matching <condition> are
+    ranked, if given.
+
+    Each level's subquery reads the model's leaderboard index in order and
+    stops after <qty> rows, however many rows the level has.
+
+    Return a dictionary of level to a list of rows with the keys of
+    MinesweeperScore.serialize, taking the id from <id_column>.
+    """
+
+    level_list = (values(column('level', db.String), name = 'level_list')
+        .data([(level,) for level in levels]))
+
+    top = (
+        select(
+            id_column.label('id'),
+            model.user_id,
+            model.time,
+            model.level,
+            model.submitted_at,
+            User.display_name.label('user_display_name')
+        )
+        .join(User, User.id == model.user_id)
+        .where(model.level == level_list.c.level)
+        .where(User.deleted_at.is_(None))
+    )
+
+    if condition is not None:
+        top = top.where(condition)
+
+    top = top.order_by(*order_by).limit(qty).lateral('top')
+
+    rows = db.session.execute(
+        select(top)
+        .select_from(level_list)
+        .join(top, true())
+        .order_by(top.c.level, *[top.c[c.name] for c in order_by])
+    )
+
+    leaderboards = {level: [] for level in levels}
+    for row in rows:
+        leaderboards[row.level].append(row)
+
+    return leaderboards
+
+
+def format_time_since(when):
+    """ Format the time since the naive UTC datetime <when> as __D, __H or
+    __M, whichever unit is the largest """
+
+    time_in_s = round((datetime.utcnow() - when).total_seconds())
+
+    days_since = time_in_s // SECONDS_PER_DAY
+    hours_since = (time_in_s % SECONDS_PER_DAY) // SECONDS_PER_HOUR
+    minutes_since = (time_in_s % SECONDS_PER_HOUR) // SECONDS_PER_MINUTE
+
+    if days_since:
+        return f'{days_since}D'
+
+    if hours_since:
+        return f'{hours_since}H'
+
+    return f'{minutes_since}M'
+
+
+def escape_like(text):
+    """ Escape the LIKE wildcards in <text>, with backslash as the escape
+    character """
+
+    return (text
+        .replace('\\', '\\\\')
+        .replace('%', '\\%')
+        .replace('_', '\\_'))
+
+
+def calc_period_start(period, when):
+    """ Return the UTC date on which the <period> (DAY or WEEK, starting on
+    Monday) containing the naive UTC datetime <when> starts """
+
+    if period == DAY:
+        return when.date()
+
+    return when.date() - timedelta(days = when.weekday())
+
+
+def upsert_best_scores(model, key_fields, rows):
+    """ Store score <rows> (dictionaries of <model> columns) in a table of
+    best scores keyed by <key_fields>, where they beat the stored best, with a
+    single conditional INSERT ... ON CONFLICT DO UPDATE ... WHERE """
+
+    # A row can only be upserted once per statement, so keep the best of the
+    # rows for each key
+    bests = {}
+    for row in rows:
+        key = tuple(row[field] for field in key_fields)
+        if (key not in bests or (row['time'], row['submitted_at'])
+                < (bests[key]['time'], bests[key]['submitted_at'])):
+            bests[key] = row
+
+    if not bests:
+        return
+
+    stmt = insert(model).values(list(bests.values()))
+
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements = key_fields,
+            set_ = {
+                "time": stmt.excluded.time,
+                "submitted_at": stmt.excluded.submitted_at,
+                "score_id": stmt.excluded.score_id
+            },
+            where = (tuple_(stmt.excluded.time, stmt.excluded.submitted_at)
+                     < tuple_(model.time, model.submitted_at))
+        )
+    )
+
+
 class User(db.Model):
     """ User table model """
 
     __tablename__ = 'users'
 
+    __table_args__ = (
+        # Finds expired guests without scanning registered users; see
+        # migrations/005_users_guest_expires_at.sql
+        db.Index(
+            'ix_users_guest_expires_at',
+            'guest_expires_at',
+            postgresql_where = db.text('guest_expires_at IS NOT NULL')
+        ),
+        # Finds deleted users left to purge; see
+        # migrations/006_users_deleted_at.sql
+        db.Index(
+            'ix_users_deleted_at',
+            'deleted_at',
+            postgresql_where = db.text('deleted_at IS NOT NULL')
+        ),
+    )
+
     ###### TABLE COLUMNS ######
 
     id = db.Column(
@@ -72,6 +224,15 @@ class User(db.Model):
     bio = db.Column(
         db.Text
     )
+    # Set on guest accounts, which are deleted once it has passed
+    guest_expires_at = db.Column(
+        db.DateTime
+    )
+    # Set when the user deletes their account, which hides it until it is
+    # purged with their scores and stats (see account_purge.py)
+    deleted_at = db.Column(
+        db.DateTime
+    )
 
     ###### INSTANCE METHODS ######
 
@@ -85,6 +246,41 @@ class User(db.Model):
         return self.role.name == 'admin'
 
 
+    def is_guest(self):
+        """ Return true if user is a temporary guest account """
+
+        return self.guest_expires_at is not None
+
+
+    def extend_guest(self, ttl):
+        """ Keep a guest account for <ttl> (a timedelta) from now """
+
+        self.guest_expires_at = datetime.utcnow() + ttl
+
+
+    def mark_deleted(self):
+        """ Hide user until their rows are purged. Their username, display
+        name and email are replaced, so they can be taken again at once. """
+
+        token = secrets.token_hex(6)
+
+        self.username = f'deleted_{token}'
+        self.display_name = f'deleted_{token}'
+        self.email = f'deleted_{token}@deleted.invalid'
+        self.deleted_at = datetime.utcnow()
+
+
+    def serialize(self):
+        """Serialize to dictionary"""
+
+        return {
+            "id": self.id,
+            "display_name": self.display_name,
+            "image_url": self.image_url,
+            "bio": self.bio
+        }
+
+
     ###### CLASS METHODS ######
 
     @classmethod
@@ -94,7 +290,7 @@ class User(db.Model):
         Returns user.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         new_user = User(
             username = username,
@@ -107,22 +303,117 @@ class User(db.Model):
         return new_user
 
 
+    @classmethod
+    def create_guest(cls, ttl):
+        """ Create a guest account, kept for <ttl> (a timedelta), with a
+        random username and display name.
+
+        Returns user.
+        """
+
+        token = secrets.token_hex(6)
+
+        guest = User(
+            username = f'guest_{token}',
+            password = GUEST_PASSWORD,
+            display_name = f'Guest {token}',
+            email = f'guest_{token}@guest.invalid',
+            guest_expires_at = datetime.utcnow() + ttl
+        )
+
+        db.session.add(guest)
+        return guest
+
+
+    @classmethod
+    def mark_expired_guests_deleted(cls, batch_size):
+        """ Mark up to <batch_size> guest accounts that have expired deleted,
+        to be purged like deleted users. Returns the ids marked. """
+
+        now = datetime.utcnow()
+
+        expired = (select(cls.id)
+            .where(cls.guest_expires_at < now, cls.deleted_at.is_(None))
+            .limit(batch_size)
+            .scalar_subquery())
+
+        # Expiry is checked again on each row, in case a guest was extended
+        # since the batch was selected
+        return db.session.execute(
+            db.update(cls)
+            .where(cls.id.in_(expired), cls.guest_expires_at < now)
+            .values(deleted_at = now)
+            .returning(cls.id)
+            .execution_options(synchronize_session = False)
+        ).scalars().all()
+
+
     @classmethod
     def authenticate(cls, username, password):
         """ Try to authenticate user with provided username.
 
-        Returns user on successful authentication, otherwise False.
+        Returns user on successful authentication, otherwise False. A hash
+        cheaper than the current cost is replaced, to be committed by the
+        caller.
          """
 
-        user = cls.query.filter_by(username = username).first()
+        user = (cls.query
+            .filter_by(
+                username = username, guest_expires_at = None,
+                deleted_at = None)
+            .first())
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if not user:
+            # As slow as a wrong password, so usernames cannot be probed
+            return password_hasher.check_unknown(password)
+
+        is_auth = password_hasher.check(user.password, password)
+        if is_auth:
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(password)
+            return user
 
         return False
 
+
+    @classmethod
+    def search(cls, query, qty, after = None):
+        """ Return up to <qty> users in display name order, after the display
+        name <after> if given, whose display names contain <query>
+        (case-insensitively) if given. Guests and deleted users are not
+        listed.
+
+        Pages are read in order from the unique index on display_name. Query
+        matches use the trigram index ix_users_display_name_trgm where pg_trgm
+        is available.
+        """
+
+        users = cls.query.filter(
+            cls.guest_expires_at.is_(None), cls.deleted_at.is_(None))
+
+        if query:
+            users = users.filter(cls.display_name.ilike(
+                f'%{escape_like(query)}%', escape = '\\'))
+
+        if after is not None:
+            users = users.filter(cls.display_name > after)
+
+        return users.order_by(cls.display_name).limit(qty).all()
+
+
+    @classmethod
+    def get_profile(cls, user_id):
+        """ Load a user with their minesweeper stats and achievements, in one
+        query. Returns None if there is no such user, or they are deleted. """
+
+        return (cls.query
+            .options(
+                db.joinedload(cls.minesweeper_stat),
+                db.joinedload(cls.minesweeper_achievements)
+            )
+            .filter(cls.id == user_id, cls.deleted_at.is_(None))
+            .one_or_none())
+
     ###### RELATIONSHIPS ######
 
     role = db.relationship('Role', backref = 'users')
@@ -138,6 +429,22 @@ class User(db.Model):
     )
 
 
+# Serves substring searches of display names (User.search). Creating pg_trgm
+# needs the right privileges, so without it searches are left unindexed; see
+# migrations/004_users_display_name_trgm.sql
+event.listen(User.__table__, 'after_create', DDL("""
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS ix_users_display_name_trgm
+        ON users USING gin (display_name gin_trgm_ops);
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is unavailable, user searches are not indexed';
+END
+$$
+"""))
+
+
 class Role(db.Model):
     """ Roles table model """
 
@@ -161,6 +468,16 @@ class MinesweeperScore(db.Model):
     """ Minesweeper scores table model """
 
     __tablename__ = 'minesweeper_scores'
+    __table_args__ = (
+        # Serves the leaderboard queries in order, without sorting; see
+        # migrations/001_minesweeper_scores_indexes.sql
+        db.Index(
+            'ix_minesweeper_scores_leaderboard',
+            'level', 'time', 'submitted_at', 'id',
+            postgresql_include = ['user_id']
+        ),
+        db.Index('ix_minesweeper_scores_user_id', 'user_id'),
+    )
 
     ###### TABLE COLUMNS ######
 
@@ -215,6 +532,278 @@ class MinesweeperScore(db.Model):
             .all())
 
 
+    @classmethod
+    def get_scores_page(cls, level, qty, after = None):
+        """ Query up to <qty> scores for a given <level> in leaderboard order,
+        starting after the (time, submitted_at, id) key <after> if given.
+
+        Seeks on the leaderboard index rather than skipping rows, so every
+        page costs the same. Return a list of rows with the same keys as
+        MinesweeperScore.serialize.
+        """
+
+        query = (
+            select(
+                cls.id,
+                cls.user_id,
+                cls.time,
+                cls.level,
+                cls.submitted_at,
+                User.display_name.label('user_display_name')
+            )
+            .join(User, User.id == cls.user_id)
+            .where(cls.level == level)
+            .where(User.deleted_at.is_(None))
+            .order_by(cls.time, cls.submitted_at, cls.id)
+            .limit(qty)
+        )
+
+        if after is not None:
+            query = query.where(
+                tuple_(cls.time, cls.submitted_at, cls.id) > tuple_(*after))
+
+        return db.session.execute(query).all()
+
+
+    @classmethod
+    def get_leaderboards(cls, levels, qty):
+        """ Query the top <qty> scores for each of <levels> in one statement.
+
+        Return a dictionary of level to a list of rows, with the same keys as
+        MinesweeperScore.serialize.
+        """
+
+        return query_leaderboards(
+            cls, cls.id, (cls.time, cls.submitted_at, cls.id), levels, qty)
+
+
+class MinesweeperPersonalBest(db.Model):
+    """ Minesweeper personal bests table model. Holds each user's best score
+    for each level, for leaderboards with one entry per player. """
+
+    __tablename__ = 'minesweeper_personal_bests'
+    __table_args__ = (
+        db.Index(
+            'ix_minesweeper_personal_bests_leaderboard',
+            'level', 'time', 'submitted_at', 'user_id'
+        ),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key = True
+    )
+    level = db.Column(
+        db.String(30),
+        primary_key = True
+    )
+    time = db.Column(
+        db.Integer,
+        nullable = False
+    )
+    submitted_at = db.Column(
+        db.DateTime,
+        nullable = False
+    )
+    score_id = db.Column(
+        db.Integer,
+        db.ForeignKey('minesweeper_scores.id', ondelete='CASCADE'),
+        nullable = False
+    )
+
+    ###### INSTANCE METHODS ######
+
+    def serialize(self):
+        """Serialize to dictionary"""
+
+        return {
+            "user_id": self.user_id,
+            "level": self.level,
+            "time": self.time,
+            "submitted_at": self.submitted_at,
+            "score_id": self.score_id
+        }
+
+
+    ###### CLASS METHODS ######
+
+    @classmethod
+    def add_scores(cls, scores):
+        """ Record MinesweeperScores as personal bests where they beat the
+        stored best for their user and level """
+
+        upsert_best_scores(cls, ['user_id', 'level'], [
+            {
+                "user_id": score.user_id,
+                "level": score.level,
+                "time": score.time,
+                "submitted_at": score.submitted_at,
+                "score_id": score.id
+            }
+            for score in scores
+        ])
+
+
+    @classmethod
+    def get_rank(cls, user_id, level):
+        """ Find a user's personal best on <level>, its 1-based rank among
+        every player's personal best, and the number of ranked players.
+
+        Both counts are index-only scans of the leaderboard index, the rank
+        only reading the entries that are strictly better. Deleted users are
+        left out with an anti-join against the few ids in ix_users_deleted_at,
+        rather than looking up the user of every entry.
+        Returns a tuple of (personal best, rank, total), with None as the
+        personal best and rank if the user has no score on <level>.
+        """
+
+        best = cls.query.get((user_id, level))
+
+        is_deleted = exists().where(
+            User.id == cls.user_id, User.deleted_at.isnot(None))
+
+        total = (select(db.func.count())
+            .where(cls.level == level)
+            .where(~is_deleted)
+            .scalar_subquery())
+
+        if best is None:
+            return None, None, db.session.execute(select(total)).scalar()
+
+        better = (select(db.func.count())
+            .where(cls.level == level)
+            .where(tuple_(cls.time, cls.submitted_at)
+                   < tuple_(best.time, best.submitted_at))
+            .where(~is_deleted)
+            .scalar_subquery())
+
+        better_count, total_count = db.session.execute(
+            select(better, total)).one()
+
+        return best, better_count + 1, total_count
+
+
+    @classmethod
+    def get_leaderboards(cls, levels, qty):
+        """ Query the <qty> best players for each of <levels> in one
+        statement, by their personal best.
+
+        Return a dictionary of level to a list of rows, with the same keys as
+        MinesweeperScore.serialize.
+        """
+
+        return query_leaderboards(
+            cls,
+            cls.score_id,
+            (cls.time, cls.submitted_at, cls.user_id),
+            levels,
+            qty
+        )
+
+
+class MinesweeperPeriodBest(db.Model):
+    """ Minesweeper period bests table model. A rollup of each user's best
+    score for each level in each day and week, for time-windowed leaderboards.
+    Rows of past periods are deleted by flask minesweeper prune-period-bests.
+    """
+
+    __tablename__ = 'minesweeper_period_bests'
+    __table_args__ = (
+        db.Index(
+            'ix_minesweeper_period_bests_leaderboard',
+            'period', 'period_start', 'level', 'time', 'submitted_at',
+            'user_id'
+        ),
+    )
+
+    period = db.Column(
+        db.String(10),
+        primary_key = True
+    )
+    period_start = db.Column(
+        db.Date,
+        primary_key = True
+    )
+    level = db.Column(
+        db.String(30),
+        primary_key = True
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key = True
+    )
+    time = db.Column(
+        db.Integer,
+        nullable = False
+    )
+    submitted_at = db.Column(
+        db.DateTime,
+        nullable = False
+    )
+    score_id = db.Column(
+        db.Integer,
+        db.ForeignKey('minesweeper_scores.id', ondelete='CASCADE'),
+        nullable = False
+    )
+
+    ###### CLASS METHODS ######
+
+    @classmethod
+    def add_scores(cls, scores):
+        """ Record MinesweeperScores as the best of their user and level in
+        the day and week they were submitted, where they beat the stored best
+        """
+
+        upsert_best_scores(
+            cls,
+            ['period', 'period_start', 'level', 'user_id'],
+            [
+                {
+                    "period": period,
+                    "period_start": calc_period_start(period, score.submitted_at),
+                    "level": score.level,
+                    "user_id": score.user_id,
+                    "time": score.time,
+                    "submitted_at": score.submitted_at,
+                    "score_id": score.id
+                }
+                for score in scores
+                for period in LEADERBOARD_PERIODS
+            ]
+        )
+
+
+    @classmethod
+    def get_leaderboards(cls, period, period_start, levels, qty):
+        """ Query the <qty> best players for each of <levels> in the <period>
+        starting on <period_start>, in one statement.
+
+        Return a dictionary of level to a list of rows, with the same keys as
+        MinesweeperScore.serialize.
+        """
+
+        return query_leaderboards(
+            cls,
+            cls.score_id,
+            (cls.time, cls.submitted_at, cls.user_id),
+            levels,
+            qty,
+            (cls.period == period) & (cls.period_start == period_start)
+        )
+
+
+    @classmethod
+    def prune(cls, period, before):
+        """ Delete the rows of <period> windows starting before the date
+        <before>. Returns the number of rows deleted. """
+
+        return (cls.query
+            .filter(cls.period == period, cls.period_start < before)
+            .delete(synchronize_session = False))
+
+
 class MinesweeperStat(db.Model):
     """ Minesweeper stats table model """
 
@@ -294,21 +883,14 @@ class MinesweeperStat(db.Model):
         """ Calculate time since last played and return in format
         __D __H __M """
 
-        time_in_s = round((datetime.utcnow() - self.last_played_at).total_seconds())
+        return format_time_since(self.last_played_at)
 
-        formatted_time = ''
 
-        days_since = time_in_s // SECONDS_PER_DAY
-        hours_since = (time_in_s % SECONDS_PER_DAY) // SECONDS_PER_HOUR
-        minutes_since = (time_in_s % SECONDS_PER_HOUR) // SECONDS_PER_MINUTE
+    @hybrid_property
+    def games_lost(self):
+        """ Number of games played that were not won """
 
-        if days_since:
-            return f'{days_since}D'
-
-        if hours_since:
-            return f'{hours_since}H'
-
-        return f'{minutes_since}M'
+        return self.games_played - self.games_won
 
 
     @property
@@ -331,6 +913,133 @@ class MinesweeperStat(db.Model):
         return formatted_time
 
 
+    ###### CLASS METHODS ######
+
+    @classmethod
+    def add_games(cls, user_id, counts, win_streak, reset_win_streak,
+                  last_played_at):
+        """ Atomically add played games to a user's stats, creating the row
+        if needed, in a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+
+        <counts> maps counter columns to the amounts to add. <win_streak> is
+        the number of wins to add to the streak, which is first reset to 0 if
+        <reset_win_streak> is set (i.e. a game was lost).
+
+        Returns a tuple of the updated stats and the win streak from before the
+        update (None if the row was created).
+        """
+
+        # Locks the row until commit, so the streak read is the one the
+        # upsert updates, even if another transaction updated it meanwhile
+        previous_win_streak = db.session.execute(
+            select(cls.win_streak)
+            .where(cls.user_id == user_id)
+            .with_for_update()
+        ).scalar()
+
+        stmt = insert(cls).values(
+            user_id = user_id,
+            win_streak = win_streak,
+            last_played_at = last_played_at,
+            **counts
+        )
+
+        updates = {
+            field: getattr(cls, field) + getattr(stmt.excluded, field)
+            for field in counts
+        }
+        updates['win_streak'] = (
+            stmt.excluded.win_streak
+            if reset_win_streak else
+            cls.win_streak + stmt.excluded.win_streak
+        )
+        updates['last_played_at'] = stmt.excluded.last_played_at
+
+        stmt = (stmt
+            .on_conflict_do_update(index_elements = [cls.user_id], set_ = updates)
+            .returning(*cls.__table__.columns))
+
+        stats = db.session.execute(
+            select(cls)
+            .from_statement(stmt)
+            .execution_options(populate_existing = True)
+        ).scalar_one()
+
+        return stats, previous_win_streak
+
+
+class MinesweeperGame(db.Model):
+    """ Minesweeper games table model. An append-only log with one row per
+    finished game, from which minesweeper_stats can be rebuilt. """
+
+    __tablename__ = 'minesweeper_games'
+    __table_args__ = (
+        db.Index('ix_minesweeper_games_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key = True,
+        autoincrement = True
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable = False
+    )
+    # Code from MINESWEEPER_LEVEL_CODES, or null for a lost game submitted to
+    # /api/minesweeper/stats before it required the level played
+    level = db.Column(
+        db.SmallInteger
+    )
+    won = db.Column(
+        db.Boolean,
+        nullable = False
+    )
+    time = db.Column(
+        db.Integer,
+        nullable = False
+    )
+    cells_revealed = db.Column(
+        db.SmallInteger,
+        nullable = False
+    )
+    finished_at = db.Column(
+        db.DateTime,
+        nullable = False
+    )
+
+
+class MinesweeperStatSnapshot(db.Model):
+    """ Minesweeper stats snapshots table model. Holds a user's stats as of
+    the game with id <last_game_id>, so rebuilding the stats only replays the
+    games logged after it. """
+
+    __tablename__ = 'minesweeper_stat_snapshots'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key = True
+    )
+    last_game_id = db.Column(
+        db.BigInteger,
+        nullable = False,
+        default = 0
+    )
+    # MinesweeperStat columns other than user_id, with last_played_at in ISO
+    # format
+    stats = db.Column(
+        JSONB,
+        nullable = False
+    )
+    taken_at = db.Column(
+        db.DateTime,
+        nullable = False,
+        default = db.func.now()
+    )
+
+
 class MinesweeperAchievement(db.Model):
     """ Minesweeper achievements table model """
 
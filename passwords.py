@@ -0,0 +1,257 @@
+""" Password hashing in a pool of worker threads
+
+bcrypt is slow on purpose, so hashing a password inline would hold the worker
+serving the request, and under gevent every other request it serves, for the
+length of the hash. Instead, hashes are computed by a small pool of native
+threads running at a lower priority: bcrypt releases the GIL while hashing, so
+a burst of logins queues up for the pool rather than starving game API
+requests. In the gevent workers, threading is monkey-patched, so the pool is
+gevent's ThreadPoolExecutor, which still runs native threads and only blocks
+the waiting greenlet.
+
+The bcrypt cost factor is measured on the first hash, to take about
+PASSWORD_HASH_TARGET_MS per hash on the machine it runs on, so processes that
+never hash a password, like CLI commands, do not pay for it. Stored hashes with
+a lower cost are replaced on the user's next successful login.
+
+At most PASSWORD_HASH_MAX_IN_FLIGHT hashes wait for or run in the pool of each
+worker; beyond that, PasswordHasherBusy is raised at once so the request can be
+refused cheaply instead of queueing behind a credential stuffing attack.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import log2
+from time import monotonic, perf_counter
+
+import bcrypt
+
+# Bounds of the measured cost factor, and the cost of hashes stored before it
+# was measured (Flask-Bcrypt's default)
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+DEFAULT_ROUNDS = 12
+
+# Niceness of the hashing threads
+HASHING_NICENESS = 10
+
+
+class PasswordHasherBusy(Exception):
+    """ Raised when too many hashes are already waiting for the pool """
+
+
+def run_at_low_priority(fn, *args):
+    """ Run fn(*args) with the CPU priority of the calling thread lowered.
+    On Linux niceness belongs to each thread, so the worker's other threads
+    keep theirs. """
+
+    if os.getpriority(os.PRIO_PROCESS, 0) < HASHING_NICENESS:
+        os.setpriority(os.PRIO_PROCESS, 0, HASHING_NICENESS)
+
+    return fn(*args)
+
+
+def is_gevent_patched():
+    """ Return true if gevent has monkey-patched threading, as in the gevent
+    workers, where threads started through it are greenlets """
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    return monkey.is_module_patched('threading')
+
+
+def hash_password(password, rounds):
+    """ Hash <password> with bcrypt at cost <rounds> """
+
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def check_password(hashed, password):
+    """ Return true if <password> matches the bcrypt hash <hashed> """
+
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+def get_rounds(hashed):
+    """ Return the cost factor of a bcrypt hash ('$2b$<rounds>$...') """
+
+    return int(hashed.split('$')[2])
+
+
+def calibrate_rounds(target_ms):
+    """ Return the cost factor whose hashes take closest to <target_ms> on
+    this machine, timing a single hash at MIN_ROUNDS.
+
+    Each extra round doubles the time of a hash.
+    """
+
+    start = perf_counter()
+    hash_password('calibration', MIN_ROUNDS)
+    elapsed_ms = (perf_counter() - start) * 1000
+
+    rounds = MIN_ROUNDS + round(log2(target_ms / elapsed_ms))
+
+    return max(MIN_ROUNDS, min(MAX_ROUNDS, rounds))
+
+
+class PasswordHasher:
+    """ Hashes and checks passwords in a pool of <workers> threads, with
+    queue depth counters, refusing hashes beyond <max_in_flight>. With no
+    workers, hashes inline. """
+
+    def __init__(self, workers = 1, rounds = DEFAULT_ROUNDS,
+                 max_in_flight = 4, target_ms = 250):
+        self.workers = workers
+        # Measured on first use when None
+        self.rounds = rounds
+        self.target_ms = target_ms
+        # Held while measuring the cost factor or making the dummy hash, so
+        # each is done once
+        self.setup_lock = threading.Lock()
+        self.max_in_flight = max_in_flight
+        # Hash of a random password at the current cost, checked for unknown
+        # users
+        self.dummy_hash = None
+        self.pool = None
+        self.pid = None
+        self.lock = threading.Lock()
+        # Hashes submitted and not finished, waiting or running
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = 0
+
+
+    def init_app(self, app):
+        """ Configure the hasher from <app> config. The cost factor is
+        measured on first use unless PASSWORD_HASH_ROUNDS is set. """
+
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_in_flight = app.config['PASSWORD_HASH_MAX_IN_FLIGHT']
+        self.target_ms = app.config['PASSWORD_HASH_TARGET_MS']
+        self.rounds = app.config['PASSWORD_HASH_ROUNDS'] or None
+
+
+    def _get_pool(self):
+        """ Return the thread pool, starting it if needed. Started again in
+        a process forked since, as threads are not copied by fork. Call with
+        <lock> held. """
+
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+
+            if is_gevent_patched():
+                from gevent.threadpool import ThreadPoolExecutor as Executor
+            else:
+                Executor = ThreadPoolExecutor
+
+            self.pool = Executor(
+                self.workers, thread_name_prefix = 'password-hash')
+
+        return self.pool
+
+
+    def _run(self, fn, *args):
+        """ Run fn(*args) in the pool and wait for its result. Raises
+        PasswordHasherBusy if <max_in_flight> hashes are already in flight. """
+
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+
+            pool = self._get_pool() if self.workers else None
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        start = monotonic()
+        try:
+            if pool is None:
+                return fn(*args)
+            return pool.submit(run_at_low_priority, fn, *args).result()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.wait_time += monotonic() - start
+
+
+    def current_rounds(self):
+        """ Return the cost factor, measuring it in the pool on first use """
+
+        if self.rounds is None:
+            with self.setup_lock:
+                if self.rounds is None:
+                    self.rounds = self._run(calibrate_rounds, self.target_ms)
+
+        return self.rounds
+
+
+    def hash(self, password):
+        """ Return the bcrypt hash of <password> at the current cost """
+
+        return self._run(hash_password, password, self.current_rounds())
+
+
+    def check(self, hashed, password):
+        """ Return true if <password> matches the bcrypt hash <hashed> """
+
+        return self._run(check_password, hashed, password)
+
+
+    def check_unknown(self, password):
+        """ Spend as long as check() for a user who does not exist, so
+        response times do not tell which usernames exist. Returns false. """
+
+        self._run(check_password, self.get_dummy_hash(), password)
+        return False
+
+
+    def get_dummy_hash(self):
+        """ Return the hash of a random password at the current cost, made in
+        the pool once per cost factor """
+
+        rounds = self.current_rounds()
+
+        if self.dummy_hash is None or get_rounds(self.dummy_hash) != rounds:
+            with self.setup_lock:
+                if (self.dummy_hash is None or
+                        get_rounds(self.dummy_hash) != rounds):
+                    self.dummy_hash = self._run(
+                        hash_password, os.urandom(16).hex(), rounds)
+
+        return self.dummy_hash
+
+
+    def needs_rehash(self, hashed):
+        """ Return true if <hashed> is cheaper than the current cost """
+
+        return get_rounds(hashed) < self.current_rounds()
+
+
+    def metrics(self):
+        """ Return the pool counters. <queued> is the number of hashes waiting
+        for a free worker. """
+
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "peak_in_flight": self.peak_in_flight,
+                "max_in_flight": self.max_in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "average_wait_ms": (
+                    round(self.wait_time / self.completed * 1000, 1)
+                    if self.completed else 0)
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,139 @@
+""" Per-worker cache of rendered user profiles
+
+The profile page of a user is made of their details and a minesweeper section
+(stats and achievements) that only changes when they play or edit their
+profile. Each worker keeps the most recently viewed profiles, with the
+minesweeper section already rendered, so viewing a cached profile does not
+query or render it again.
+
+Entries are dropped by the worker that changes a profile, once the change is
+committed. Changes made through other workers show up once the entry is older
+than <ttl> seconds.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+from time import monotonic
+
+from flask import render_template
+from markupsafe import Markup
+
+from models import User
+
+# The profile user's details, the rendered minesweeper section (None if they
+# have not played), and when they last played
+CachedProfile = namedtuple(
+    'CachedProfile', ['user', 'minesweeper_section', 'last_played_at'])
+
+
+class ProfileCache:
+    """ Least recently used profiles, up to <size>, with hit/miss counters """
+
+    def __init__(self, size = 1000, ttl = 60):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # user id -> (CachedProfile, time cached), least recently used first
+        self.profiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped by every invalidation, so a profile loaded before one is not
+        # cached after it
+        self.version = 0
+
+
+    def init_app(self, app):
+        """ Configure the cache from <app> config """
+
+        self.size = app.config['PROFILE_CACHE_SIZE']
+        self.ttl = app.config['PROFILE_CACHE_TTL']
+
+
+    def get(self, user_id):
+        """ Return a tuple of the CachedProfile of <user_id> (None if it is not
+        cached or has expired) and the cache version, to pass to set() """
+
+        with self.lock:
+            cached = self.profiles.get(user_id)
+
+            if cached is None or monotonic() - cached[1] >= self.ttl:
+                self.misses += 1
+                return None, self.version
+
+            self.profiles.move_to_end(user_id)
+            self.hits += 1
+            return cached[0], self.version
+
+
+    def set(self, user_id, profile, version):
+        """ Cache the CachedProfile of <user_id>, loaded at cache <version>,
+        unless a profile was invalidated since. Evicts the least recently used
+        profile if the cache is full. """
+
+        with self.lock:
+            if version != self.version:
+                return
+
+            self.profiles[user_id] = (profile, monotonic())
+            self.profiles.move_to_end(user_id)
+
+            while len(self.profiles) > self.size:
+                self.profiles.popitem(last = False)
+
+
+    def invalidate(self, user_ids):
+        """ Drop the cached profiles of <user_ids> after their stats,
+        achievements or details change """
+
+        with self.lock:
+            self.version += 1
+            for user_id in user_ids:
+                if self.profiles.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+
+    def metrics(self):
+        """ Return the cache counters """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "cached_profiles": len(self.profiles)
+            }
+
+
+profile_cache = ProfileCache()
+
+
+def load_profile(user_id):
+    """ Load the profile of <user_id> with one query and render its
+    minesweeper section. Returns a CachedProfile, or None if there is no such
+    user. """
+
+    user = User.get_profile(user_id)
+    if user is None:
+        return None
+
+    details = {
+        "id": user.id,
+        "username": user.username,
+        "display_name": user.display_name,
+        "image_url": user.image_url,
+        "bio": user.bio
+    }
+
+    if not user.minesweeper_stat:
+        return CachedProfile(details, None, None)
+
+    stats = user.minesweeper_stat[0]
+    section = render_template(
+        'users/minesweeper_section.html',
+        minesweeper_stats = stats,
+        minesweeper_achievements = sorted(
+            user.minesweeper_achievements, key = lambda a: a.id)
+    )
+
+    return CachedProfile(details, Markup(section), stats.last_played_at)
@@ -0,0 +1,86 @@
+""" Per-worker token bucket rate limiting
+
+Each key (e.g. a client IP or a username) has a bucket of <burst> tokens,
+refilled at <rate> tokens per second. A request takes a token, and is refused
+if the bucket is empty. Buckets are kept in memory, so each worker limits the
+requests it serves; with W workers a client gets at most W times the rate.
+
+At most <max_keys> buckets are kept, in least recently used order: a new key
+evicts the bucket used longest ago, so rotating keys cannot grow the buckets or
+escape being limited.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TokenBucketLimiter:
+    """ Token buckets of up to <burst> tokens, refilled at <rate> per second,
+    for the <max_keys> most recently used keys """
+
+    def __init__(self, rate, burst, max_keys = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> (tokens, time last updated), least recently used first
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+
+    @classmethod
+    def per_minute(cls, limit):
+        """ Build a limiter allowing bursts of <limit> requests per key, and
+        <limit> requests per minute after that """
+
+        return cls(limit / 60, limit)
+
+
+    def allow(self, key):
+        """ Take a token from the bucket of <key>, returning false if it is
+        empty """
+
+        now = monotonic()
+
+        with self.lock:
+            if key in self.buckets:
+                self.buckets.move_to_end(key)
+                tokens, updated = self.buckets[key]
+            else:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last = False)
+                    self.evicted += 1
+                tokens, updated = self.burst, now
+
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                self.limited += 1
+                return False
+
+            self.buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+            return True
+
+
+    def reset(self):
+        """ Refill every bucket """
+
+        with self.lock:
+            self.buckets.clear()
+
+
+    def metrics(self):
+        """ Return the limiter counters """
+
+        with self.lock:
+            return {
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "evicted": self.evicted,
+                "tracked_keys": len(self.buckets)
+            }
@@ -30,8 +30,7 @@ const DAVIDS_GAMES_BASE_API_URL = 'https://davids-games.fly.dev' // deployment
  * generateBoardData
  * checkForWin
  * endGame
- * sendScore
- * sendGameStats
+ * sendGameResult
  * revealCells
  * toggleFlag
  * revealNeighbourCells
@@ -167,52 +166,33 @@ class Game {
     this.gameOver = true;
 
     if (win) {
-      this.sendScore();
       showSuspendScreen('YOU WIN!');
     } else {
       showSuspendScreen('GAME OVER');
     }
 
-    this.sendGameStats(win);
+    this.sendGameResult(win);
   }
 
 
   /**
-   * sendScore: Send game score to server API
-   */
-  async sendScore() {
-    const scoreData = {
-      time: this.scoreTime,
-      level: this.level
-    }
-
-    const response = await axios.post(
-      `${DAVIDS_GAMES_BASE_API_URL}/api/minesweeper/scores`,
-      scoreData
-    );
-  }
-
-
-  /**
-   * sendGameStats: Send game stats to server API
+   * sendGameResult: Send game result to server API, which records the score
+   * and stats together, then display any new achievements
    *
    * win: Boolean representing whether the user won
    */
-  async sendGameStats(win) {
-    const gameData = {
-      games_played: 1,
-      games_won: win ? 1 : 0,
-      beginner_games_won: (this.level === 'beginner' && win) ? 1 : 0,
-      intermediate_games_won: (this.level === 'intermediate' && win) ? 1 : 0,
-      expert_games_won: (this.level === 'expert' && win) ? 1 : 0,
-      time_played: this.scoreTime,
+  async sendGameResult(win) {
+    const gameResult = {
+      level: this.level,
+      time: this.scoreTime,
+      won: win,
       cells_revealed: this.numRevealed,
-      last_played_at: (new Date()).toUTCString()
+      finished_at: (new Date()).toUTCString()
     }
 
     const response = await axios.post(
-      `${DAVIDS_GAMES_BASE_API_URL}/api/minesweeper/stats`,
-      gameData
+      `${DAVIDS_GAMES_BASE_API_URL}/api/minesweeper/games`,
+      gameResult
     );
 
     // Remove all previous toasts
@@ -53,6 +53,9 @@ const $toastContainer = $('.toast-container');
 
 let levelIndex = 0;
 let game;
+// Scores shown on the leaderboard, by level, and their live update stream
+let leaderboardScores = null;
+let leaderboardEvents = null;
 
 
 /** Create game board */
@@ -370,29 +373,60 @@ function generateLeaderboardListItem(score, rank) {
 }
 
 
+/** Render the leaderboard for a level from leaderboardScores */
+function renderLeaderboardLevel(level) {
+  $(`#${level}-scores`).empty();
+  for (let i = 0; i < NUM_SCORES_ON_LEADERBOARD; i++) {
+    $(`#${level}-scores`).append(
+      generateLeaderboardListItem(leaderboardScores[level][i], i)
+    );
+  }
+}
+
+
 /** Get scores to display on leaderboard */
 async function fillLeaderboard() {
   const response = await axios.get(
     `${DAVIDS_GAMES_BASE_API_URL}/api/minesweeper/scores`
   );
 
-  const scores = response.data.scores;
+  leaderboardScores = response.data.scores;
 
-  for (let level in scores) {
-    $(`#${level}-scores`).empty();
-    for (let i = 0; i < NUM_SCORES_ON_LEADERBOARD; i++) {
-      $(`#${level}-scores`).append(
-        generateLeaderboardListItem(scores[level][i], i)
-      );
-    }
+  for (let level in leaderboardScores) {
+    renderLeaderboardLevel(level);
   }
 }
 
 
+/** Insert a score pushed by the server into the leaderboard at its rank */
+function handleLeaderboardEvent(evt) {
+  const { level, score, rank } = JSON.parse(evt.data);
+  if (!leaderboardScores || !leaderboardScores[level]) return;
+
+  leaderboardScores[level].splice(rank - 1, 0, score);
+  leaderboardScores[level].length = Math.min(
+    leaderboardScores[level].length, NUM_SCORES_ON_LEADERBOARD
+  );
+  renderLeaderboardLevel(level);
+}
+
+
+/** Listen for live leaderboard updates, once the leaderboard is opened */
+function subscribeToLeaderboard() {
+  if (leaderboardEvents) return;
+
+  leaderboardEvents = new EventSource(
+    `${DAVIDS_GAMES_BASE_API_URL}/api/minesweeper/leaderboard/stream`
+  );
+  leaderboardEvents.addEventListener('leaderboard', handleLeaderboardEvent);
+}
+
+
 /** Show and hide leaderboard */
 function toggleLeaderboard(evt) {
   if ($leaderboardScreen.is(':hidden')) {
     fillLeaderboard();
+    subscribeToLeaderboard();
     $leaderboardScreen.show();
   } else {
     $leaderboardScreen.hide();
@@ -0,0 +1,73 @@
+'use strict';
+
+const $userIndex = $('#user-index');
+const $userIndexEnd = $('#user-index-end');
+
+// Read with attr(), since data() would turn numeric display names to numbers
+const userSearch = $userIndex.attr('data-search') || undefined;
+let nextCursor = $userIndex.attr('data-next-cursor') || null;
+let isLoadingUsers = false;
+
+
+/** Build the card of a user, as rendered in users/index.html */
+function generateUserCard(user) {
+  const $card = $(`
+    <div class="card user-index-card">
+      <a class="card-body user-index-link row">
+        <div class='col-4 d-flex align-items-center justify-content-center h-100'>
+          <img class="card-img-top" alt="...">
+        </div>
+        <div class='col-8 d-flex flex-column justify-content-center h-100'>
+          <p class="user-card-title mt-1"></p>
+        </div>
+      </a>
+    </div>
+  `);
+
+  $card.find('a').attr('href', `/users/${user.id}`);
+  $card.find('img').attr('src', user.image_url);
+  $card.find('.user-card-title').text(user.display_name);
+  if (user.bio) {
+    $card.find('.user-card-title').after(
+      $('<p class="user-card-text my-1">').text(user.bio)
+    );
+  }
+
+  return $card;
+}
+
+
+/** Append the next page of users from the API, if there is one */
+async function loadMoreUsers() {
+  if (!nextCursor || isLoadingUsers) return;
+
+  isLoadingUsers = true;
+  try {
+    const response = await axios.get('/api/users', {
+      params: {
+        q: userSearch,
+        cursor: nextCursor
+      }
+    });
+
+    $userIndex.append(response.data.users.map(generateUserCard));
+    nextCursor = response.data.next_cursor;
+  } finally {
+    isLoadingUsers = false;
+  }
+
+  // Observe again, so the next page loads if the end is still in view
+  usersObserver.unobserve($userIndexEnd[0]);
+  if (nextCursor) usersObserver.observe($userIndexEnd[0]);
+}
+
+
+/** Load more users as the end of the list scrolls into view */
+const usersObserver = new IntersectionObserver(
+  entries => {
+    if (entries.some(entry => entry.isIntersecting)) loadMoreUsers();
+  },
+  { rootMargin: '400px' }
+);
+
+if (nextCursor) usersObserver.observe($userIndexEnd[0]);
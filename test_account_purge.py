@@ -0,0 +1,207 @@
+""" Deleted account purge tests """
+
+import os
+from datetime import datetime
+from unittest import TestCase
+from models import (db, User, Role, MinesweeperScore, MinesweeperPersonalBest,
+                    MinesweeperPeriodBest, MinesweeperGame, MinesweeperStat,
+                    connect_db, DEFAULT_USER_ROLE)
+from minesweeper import insert_minesweeper_scores
+from account_purge import AccountPurger, purge_user
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+
+class AccountPurgeTestCase(TestCase):
+    """ Test purging the rows of deleted users """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        with app.app_context():
+            User.query.delete()
+
+            users = [
+                User.signup(
+                    username = f'user{i}',
+                    password = 'password',
+                    display_name = f'user{i}',
+                    email = f'user{i}@email.com'
+                )
+                for i in [1, 2]
+            ]
+            db.session.flush()
+
+            now = datetime.utcnow()
+            insert_minesweeper_scores([
+                {
+                    "user_id": user.id,
+                    "time": time,
+                    "level": 'beginner',
+                    "submitted_at": now
+                }
+                for user in users
+                for time in range(10, 15)
+            ])
+
+            for user in users:
+                db.session.add(MinesweeperStat(user_id = user.id))
+                db.session.add_all([
+                    MinesweeperGame(
+                        user_id = user.id,
+                        won = False,
+                        time = 1,
+                        cells_revealed = 1,
+                        finished_at = now
+                    )
+                    for _ in range(3)
+                ])
+
+            db.session.commit()
+
+            self.u1_id, self.u2_id = [user.id for user in users]
+
+        self.runner = app.test_cli_runner()
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        with app.app_context():
+            db.session.rollback()
+
+
+    def delete_user(self, user_id):
+        """ Mark <user_id> deleted, as the delete route does """
+
+        with app.app_context():
+            User.query.get(user_id).mark_deleted()
+            db.session.commit()
+
+
+    def count_rows(self, user_id):
+        """ Count the rows left of <user_id>, by model """
+
+        counts = {
+            model.__name__: model.query.filter_by(user_id = user_id).count()
+            for model in [MinesweeperScore, MinesweeperPersonalBest,
+                          MinesweeperPeriodBest, MinesweeperGame,
+                          MinesweeperStat]
+        }
+        counts['User'] = User.query.filter_by(id = user_id).count()
+
+        return counts
+
+
+    def test_deleted_user_hidden(self):
+        """ Test that a deleted user is left off leaderboards and searches
+        before they are purged """
+
+        self.delete_user(self.u1_id)
+
+        with app.app_context():
+            leaderboard = MinesweeperScore.get_leaderboards(['beginner'], 20)
+            self.assertEqual(
+                {row.user_id for row in leaderboard['beginner']},
+                {self.u2_id})
+            self.assertEqual(
+                [u.id for u in User.search(None, 10)], [self.u2_id])
+            self.assertIsNone(User.get_profile(self.u1_id))
+            self.assertFalse(User.authenticate('user1', 'password'))
+
+
+    def test_deleted_user_names_freed(self):
+        """ Test that a deleted user's username, display name and email can
+        be signed up with again before they are purged """
+
+        self.delete_user(self.u1_id)
+
+        with app.app_context():
+            User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+            db.session.commit()
+
+            self.assertNotEqual(
+                User.query.filter_by(username = 'user1').one().id, self.u1_id)
+            self.assertIsNotNone(User.query.get(self.u1_id).deleted_at)
+
+
+    def test_purge_user(self):
+        """ Test that a deleted user's rows are deleted in batches, leaving
+        other users' rows """
+
+        self.delete_user(self.u1_id)
+
+        with app.app_context():
+            # 5 scores, 1 personal best, 2 period bests, 3 games, 1 stats
+            # row and the user
+            self.assertEqual(purge_user(self.u1_id, batch_size = 2), 13)
+
+            self.assertEqual(set(self.count_rows(self.u1_id).values()), {0})
+            self.assertEqual(self.count_rows(self.u2_id), {
+                "MinesweeperScore": 5,
+                "MinesweeperPersonalBest": 1,
+                "MinesweeperPeriodBest": 2,
+                "MinesweeperGame": 3,
+                "MinesweeperStat": 1,
+                "User": 1
+            })
+
+
+    def test_purge_user_not_deleted(self):
+        """ Test that a user who is not deleted is not purged """
+
+        with app.app_context():
+            self.assertEqual(purge_user(self.u1_id, batch_size = 2), 0)
+            self.assertEqual(self.count_rows(self.u1_id)['User'], 1)
+
+
+    def test_account_purger(self):
+        """ Test that queued users are purged in the background """
+
+        self.delete_user(self.u1_id)
+
+        purger = AccountPurger()
+        purger.init_app(app)
+        purger.enqueue(self.u1_id)
+        purger.wait()
+
+        with app.app_context():
+            self.assertEqual(self.count_rows(self.u1_id)['User'], 0)
+
+        self.assertEqual(purger.metrics(), {
+            "queued": 0,
+            "purged": 1,
+            "rows_deleted": 13,
+            "failed": 0
+        })
+
+
+    def test_purge_deleted_command(self):
+        """ Test that the command purges every deleted user """
+
+        self.delete_user(self.u1_id)
+
+        result = self.runner.invoke(args = ['users', 'purge-deleted'])
+
+        self.assertIn('Purged 1 deleted users (13 rows).', result.output)
+        with app.app_context():
+            self.assertEqual(self.count_rows(self.u1_id)['User'], 0)
+            self.assertEqual(self.count_rows(self.u2_id)['User'], 1)
@@ -11,6 +11,7 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['RATE_LIMITS_ENABLED'] = False
 
 connect_db(app)
 with app.app_context():
@@ -0,0 +1,196 @@
+""" Minesweeper leaderboard cache tests """
+
+import os
+from datetime import date, datetime
+from unittest import TestCase
+from models import (db, User, Role, MinesweeperScore, connect_db,
+                    calc_period_start, DAY, DEFAULT_USER_ROLE)
+from leaderboard_cache import LeaderboardCache
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+
+def make_serialized_score(id, time, level = 'beginner', user_id = 1):
+    """ Build a serialized score, as returned by MinesweeperScore.serialize """
+
+    return {
+        "id": id,
+        "user_id": user_id,
+        "time": time,
+        "level": level,
+        "submitted_at": datetime(2026, 10, 18),
+        "user_display_name": "user1"
+    }
+
+
+class LeaderboardCacheTestCase(TestCase):
+    """ Test caching and in-place updates of minesweeper leaderboards """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        with app.app_context():
+            User.query.delete()
+
+            u1 = User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+            db.session.flush()
+
+            db.session.add_all([
+                MinesweeperScore(
+                    user_id = u1.id,
+                    time = time,
+                    level = 'beginner',
+                    submitted_at = datetime(2026, 10, 1)
+                )
+                for time in [30, 10, 20]
+            ])
+            db.session.commit()
+
+        self.cache = LeaderboardCache(size = 3, ttl = 3600)
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        with app.app_context():
+            db.session.rollback()
+
+
+    def test_hit_and_miss(self):
+        """ Test that only the first read of a level queries the database """
+
+        with app.app_context():
+            first = self.cache.get('beginner')
+            MinesweeperScore.query.delete()
+            db.session.commit()
+            second = self.cache.get('beginner')
+
+        self.assertEqual([s['time'] for s in first], [10, 20, 30])
+        self.assertEqual(second, first)
+        self.assertEqual(self.cache.metrics()['hits'], 1)
+        self.assertEqual(self.cache.metrics()['misses'], 1)
+
+
+    def test_add_entering_score(self):
+        """ Test that a score beating the last cached score is inserted in
+        place """
+
+        with app.app_context():
+            self.cache.get('beginner')
+
+        self.cache.add([make_serialized_score(100, 15)])
+
+        with app.app_context():
+            self.assertEqual(
+                [s['time'] for s in self.cache.get('beginner')], [10, 15, 20])
+        self.assertEqual(self.cache.metrics()['updates'], 1)
+
+
+    def test_add_slower_score(self):
+        """ Test that a score slower than a full leaderboard is ignored """
+
+        with app.app_context():
+            self.cache.get('beginner')
+
+        self.assertFalse(
+            self.cache.could_enter('beginner', 30, datetime(2026, 10, 18)))
+        self.cache.add([make_serialized_score(100, 30)])
+
+        self.assertEqual(self.cache.metrics()['updates'], 0)
+
+
+    def test_etag_shared_by_workers(self):
+        """ Test that caches holding the same scores give the same ETag, which
+        changes with the scores """
+
+        with app.app_context():
+            _, etag = self.cache.get_many_with_etag(['beginner'])
+            other_worker = LeaderboardCache(size = 3, ttl = 3600)
+            _, other_etag = other_worker.get_many_with_etag(['beginner'])
+
+        self.assertEqual(etag, other_etag)
+
+        self.cache.add([make_serialized_score(100, 15)])
+
+        with app.app_context():
+            self.assertNotEqual(
+                self.cache.get_many_with_etag(['beginner'])[1], etag)
+
+
+    def test_add_uncached_level(self):
+        """ Test that scores for a level that is not cached are ignored """
+
+        self.cache.add([make_serialized_score(100, 15, 'expert')])
+
+        self.assertEqual(self.cache.metrics()['cached_levels'], [])
+
+
+    def test_add_per_user(self):
+        """ Test that a per-user leaderboard keeps only each user's best """
+
+        cache = LeaderboardCache(
+            load = lambda levels, qty: {level: [] for level in levels},
+            per_user = True,
+            size = 3
+        )
+        cache.get('beginner')
+
+        cache.add([
+            make_serialized_score(1, 30),
+            make_serialized_score(2, 20, user_id = 2),
+            make_serialized_score(3, 25),
+            make_serialized_score(4, 40),
+        ])
+
+        self.assertEqual(
+            [(s['user_id'], s['time']) for s in cache.get('beginner')],
+            [(2, 20), (1, 25)]
+        )
+
+
+    def test_period_roll_over(self):
+        """ Test that a period leaderboard only keeps scores of the current
+        period, and is reloaded once the period ends """
+
+        loads = []
+        cache = LeaderboardCache(
+            load = lambda period, start, levels, qty: (
+                loads.append(start) or {level: [] for level in levels}),
+            per_user = True,
+            size = 3,
+            period = DAY
+        )
+        cache.get('beginner')
+
+        old_score = make_serialized_score(1, 10)
+        old_score['submitted_at'] = datetime(2000, 1, 1)
+        new_score = make_serialized_score(2, 20)
+        new_score['submitted_at'] = datetime.utcnow()
+        cache.add([old_score, new_score])
+
+        self.assertEqual([s['id'] for s in cache.get('beginner')], [2])
+
+        # As if the cache had been filled on a previous day
+        cache.period_start = date(2000, 1, 1)
+
+        self.assertEqual(cache.get('beginner'), [])
+        today = calc_period_start(DAY, datetime.utcnow())
+        self.assertEqual(loads, [today, today])
@@ -0,0 +1,144 @@
+""" Live minesweeper leaderboard stream tests """
+
+import os
+import time
+from unittest import TestCase
+from models import (db, User, Role, MinesweeperScore, connect_db,
+                    DEFAULT_USER_ROLE)
+from leaderboard_events import (LeaderboardHub, RETRY, HEARTBEAT,
+                                notify_users_removed)
+from leaderboard_cache import minesweeper_leaderboard
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['RATE_LIMITS_ENABLED'] = False
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+
+class LeaderboardHubTestCase(TestCase):
+    """ Test fan-out of leaderboard deltas to streaming clients """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        app.config['MINESWEEPER_LEADERBOARD_STREAM_HEARTBEAT'] = 0.1
+        app.config['MINESWEEPER_LEADERBOARD_STREAM_MAX_QUEUED'] = 2
+
+        self.hub = LeaderboardHub()
+        self.hub.init_app(app)
+
+        with app.app_context():
+            User.query.delete()
+
+            u1 = User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+
+            db.session.commit()
+            self.u1_id = u1.id
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        with app.app_context():
+            db.session.rollback()
+
+
+    def test_fan_out(self):
+        """ Test that one published delta reaches every subscriber """
+
+        streams = [self.hub.stream(), self.hub.stream()]
+        for stream in streams:
+            self.assertEqual(next(stream), RETRY)
+
+        self.hub.publish('{"rank": 1}')
+
+        for stream in streams:
+            self.assertEqual(
+                next(stream), b'event: leaderboard\ndata: {"rank": 1}\n\n')
+            self.assertEqual(next(stream), HEARTBEAT)
+            stream.close()
+
+        self.assertEqual(self.hub.metrics()['subscribers'], 0)
+
+
+    def test_slow_subscriber_dropped(self):
+        """ Test that a subscriber with a full queue is disconnected """
+
+        stream = self.hub.stream()
+        next(stream)
+
+        for rank in range(3):
+            self.hub.publish(f'{{"rank": {rank}}}')
+
+        self.assertEqual(len(list(stream)), 2)
+        self.assertEqual(self.hub.metrics()['dropped'], 1)
+
+
+    def test_committed_score_streamed(self):
+        """ Test that a committed top score is streamed from the database """
+
+        stream = self.hub.stream()
+        next(stream)
+        self.assertTrue(self.hub.listening.wait(timeout = 5))
+
+        with app.app_context():
+            MinesweeperScore.query.delete()
+            db.session.commit()
+
+        with app.test_client() as c:
+            c.post('/login', data={"username": "user1", "password": "password"})
+            c.post('/api/minesweeper/scores',
+                   json={"time": 12, "level": "intermediate"})
+
+        # Skip keep-alives, giving up after 5 seconds
+        for _, message in zip(range(50), stream):
+            if message != HEARTBEAT:
+                break
+
+        self.assertIn(b'"rank": 1', message)
+        self.assertIn(b'"level": "intermediate"', message)
+        stream.close()
+
+
+    def test_removed_users_invalidated(self):
+        """ Test that a committed user removal drops the cached leaderboards
+        without being streamed """
+
+        stream = self.hub.stream()
+        next(stream)
+        self.assertTrue(self.hub.listening.wait(timeout = 5))
+
+        version = minesweeper_leaderboard.metrics()['version']
+
+        with app.app_context():
+            notify_users_removed([self.u1_id])
+            db.session.commit()
+
+        # Give up after 5 seconds
+        for _ in range(50):
+            if self.hub.metrics()['removals']:
+                break
+            time.sleep(0.1)
+
+        self.assertEqual(self.hub.metrics()['removals'], 1)
+        self.assertGreater(
+            minesweeper_leaderboard.metrics()['version'], version)
+        self.assertEqual(next(stream), HEARTBEAT)
+        stream.close()
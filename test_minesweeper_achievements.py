@@ -0,0 +1,294 @@
+""" Minesweeper achievement calculation tests """
+
+import os
+from unittest import TestCase
+from models import (
+    db, User, Role, MinesweeperStat, MinesweeperScore, MinesweeperAchievement,
+    UserMinesweeperAchievement, connect_db, DEFAULT_USER_ROLE)
+from minesweeper import (
+    calc_minesweeper_achievements, find_crossed_titles, MINESWEEPER_STAT_FIELDS)
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+
+def make_game_stats(level, won, time):
+    """ Build the stats for a single game, as sent by the minesweeper client """
+
+    return {
+        "games_played": 1,
+        "games_won": 1 if won else 0,
+        "beginner_games_won": 1 if won and level == 'beginner' else 0,
+        "intermediate_games_won": 1 if won and level == 'intermediate' else 0,
+        "expert_games_won": 1 if won and level == 'expert' else 0,
+        "time_played": time,
+        "cells_revealed": 71,
+    }
+
+
+def make_user_stats(user_id, **stats):
+    """ Build an unsaved MinesweeperStat, with unspecified stats set to 0 """
+
+    fields = [f for f in MINESWEEPER_STAT_FIELDS if f != 'games_lost']
+
+    return MinesweeperStat(
+        user_id = user_id,
+        **{field: stats.get(field, 0) for field in fields}
+    )
+
+
+def make_snapshot(**stats):
+    """ Build a stats snapshot, with unspecified stats set to 0 """
+
+    snapshot = dict.fromkeys(MINESWEEPER_STAT_FIELDS, 0)
+    snapshot.update(stats)
+    snapshot['games_lost'] = snapshot['games_played'] - snapshot['games_won']
+    return snapshot
+
+
+class MinesweeperAchievementBaseTestCase(TestCase):
+    """ Base test case with a user and a few seeded achievements """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        with app.app_context():
+            User.query.delete()
+            MinesweeperStat.query.delete()
+            MinesweeperAchievement.query.delete()
+
+            u1 = User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+
+            for title in ['Welcome to Minesweeper', 'Taste of Victory',
+                          'First Steps', 'Speedy Beginner', 'Just A Blip',
+                          'On A Roll']:
+                db.session.add(MinesweeperAchievement(
+                    title = title,
+                    description = 'For testing only',
+                    color = 'rgb(0, 0, 0)'
+                ))
+
+            db.session.commit()
+            self.u1_id = u1.id
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        with app.app_context():
+            db.session.rollback()
+
+
+class MinesweeperAchievementCalcTestCase(MinesweeperAchievementBaseTestCase):
+    """ Test calculation of new minesweeper achievements """
+
+    def test_first_win(self):
+        """ Test achievements for a fast first beginner win """
+
+        with app.app_context():
+            new_achievements = calc_minesweeper_achievements(
+                self.u1_id,
+                make_snapshot(),
+                [make_game_stats('beginner', True, 15)]
+            )
+
+            self.assertEqual(
+                [a.title for a in new_achievements],
+                ['Speedy Beginner', 'Taste of Victory', 'First Steps',
+                 'Welcome to Minesweeper']
+            )
+
+
+    def test_owned_achievements_skipped(self):
+        """ Test that achievements already owned are not awarded again """
+
+        with app.app_context():
+            u1 = User.query.get(self.u1_id)
+            u1.minesweeper_achievements.append(
+                MinesweeperAchievement.query.filter_by(
+                    title = 'Speedy Beginner').one()
+            )
+            db.session.commit()
+
+            new_achievements = calc_minesweeper_achievements(
+                self.u1_id,
+                make_snapshot(
+                    games_played = 1,
+                    games_won = 1,
+                    beginner_games_won = 1,
+                    win_streak = 1
+                ),
+                [make_game_stats('beginner', True, 15)]
+            )
+
+            self.assertEqual(new_achievements, [])
+
+
+    def test_unseeded_achievements_skipped(self):
+        """ Test that earned achievements missing from the database are
+        skipped instead of raising """
+
+        with app.app_context():
+            new_achievements = calc_minesweeper_achievements(
+                self.u1_id,
+                make_snapshot(games_played = 99),
+                [make_game_stats('expert', False, 30)]
+            )
+
+            self.assertEqual(new_achievements, [])
+
+
+    def test_games_replayed_in_order(self):
+        """ Test that a win streak reached in the middle of several games is
+        detected even though the last game breaks it """
+
+        with app.app_context():
+            new_achievements = calc_minesweeper_achievements(
+                self.u1_id,
+                make_snapshot(games_played = 3, games_won = 3, win_streak = 3),
+                [
+                    make_game_stats('expert', True, 300),
+                    make_game_stats('expert', True, 300),
+                    make_game_stats('expert', False, 30),
+                ]
+            )
+
+            self.assertEqual(
+                [a.title for a in new_achievements],
+                ['On A Roll', 'Just A Blip']
+            )
+
+
+class MinesweeperCrossedThresholdTestCase(TestCase):
+    """ Test finding the achievement thresholds crossed by an update """
+
+    def test_only_crossed_thresholds(self):
+        """ Test that thresholds already passed before the update are not
+        returned again """
+
+        titles = find_crossed_titles(
+            make_snapshot(games_played = 49, games_won = 4,
+                          expert_games_won = 4, win_streak = 4),
+            make_snapshot(games_played = 50, games_won = 5,
+                          expert_games_won = 5, win_streak = 5),
+            make_game_stats('expert', True, 300)
+        )
+
+        self.assertEqual(
+            titles, ['Pure Skill', 'On A Roll', 'Still Here?'])
+
+
+    def test_multiple_thresholds_crossed(self):
+        """ Test that every threshold in (old, new] is returned """
+
+        titles = find_crossed_titles(
+            make_snapshot(time_played = 0),
+            make_snapshot(games_played = 1, time_played = 4000),
+            make_game_stats('expert', False, 4000)
+        )
+
+        self.assertEqual(
+            titles, ['Addicted', 'Just A Blip', 'Welcome to Minesweeper'])
+
+
+    def test_streak_reset(self):
+        """ Test that a broken win streak crosses no thresholds """
+
+        titles = find_crossed_titles(
+            make_snapshot(games_played = 9, games_won = 9, win_streak = 9),
+            make_snapshot(games_played = 10, games_won = 9, win_streak = 0),
+            make_game_stats('beginner', False, 10)
+        )
+
+        self.assertEqual(titles, ['Just A Blip'])
+
+
+class RecomputeAchievementsCommandTestCase(MinesweeperAchievementBaseTestCase):
+    """ Test the minesweeper recompute-achievements CLI command """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        super().setUp()
+
+        with app.app_context():
+            db.session.add_all([
+                make_user_stats(
+                    self.u1_id,
+                    games_played = 3,
+                    games_won = 2,
+                    beginner_games_won = 2,
+                    win_streak = 0
+                ),
+                MinesweeperScore(
+                    user_id = self.u1_id,
+                    time = 18,
+                    level = 'beginner'
+                ),
+            ])
+            db.session.commit()
+
+        self.runner = app.test_cli_runner()
+
+
+    def test_dry_run(self):
+        """ Test that a dry run reports but does not award achievements """
+
+        result = self.runner.invoke(
+            args = ['minesweeper', 'recompute-achievements', '--dry-run'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('+1 Speedy Beginner', result.output)
+        self.assertIn('Would award 5 achievements.', result.output)
+
+        with app.app_context():
+            self.assertEqual(UserMinesweeperAchievement.query.count(), 0)
+
+
+    def test_recompute(self):
+        """ Test that missing achievements are awarded exactly once """
+
+        with app.app_context():
+            u1 = User.query.get(self.u1_id)
+            u1.minesweeper_achievements.append(
+                MinesweeperAchievement.query.filter_by(
+                    title = 'First Steps').one()
+            )
+            db.session.commit()
+
+        result = self.runner.invoke(
+            args = ['minesweeper', 'recompute-achievements',
+                    '--batch-size', '1'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Awarded 4 achievements.', result.output)
+
+        with app.app_context():
+            self.assertEqual(
+                sorted(a.title for a in
+                       User.query.get(self.u1_id).minesweeper_achievements),
+                ['First Steps', 'Just A Blip', 'Speedy Beginner',
+                 'Taste of Victory', 'Welcome to Minesweeper']
+            )
+
+        result = self.runner.invoke(
+            args = ['minesweeper', 'recompute-achievements'])
+
+        self.assertIn('Awarded 0 achievements.', result.output)
@@ -1,10 +1,11 @@
 """ Minesweeper API tests """
 
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import TestCase
-from models import (db, User, Role, MinesweeperScore, connect_db,
-                    DEFAULT_USER_ROLE)
+from models import (db, User, Role, MinesweeperScore, MinesweeperPeriodBest,
+                    MinesweeperStat, connect_db, DEFAULT_USER_ROLE)
+from leaderboard_cache import minesweeper_leaderboard, invalidate_leaderboards
 from app import app
 
 os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
@@ -13,6 +14,7 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['RATE_LIMITS_ENABLED'] = False
 
 connect_db(app)
 with app.app_context():
@@ -47,6 +49,9 @@ class MinesweeperAPITestCase(TestCase):
             self.u1_id = u1.id
             self.client = app.test_client()
 
+        # Deleting users deleted their scores
+        invalidate_leaderboards()
+
 
     def tearDown(self):
         """ Tear down after each test """
@@ -84,6 +89,95 @@ class MinesweeperAPITestCase(TestCase):
             self.assertEqual(len(u1.minesweeper_scores), 1)
 
 
+    def test_invalid_submissions(self):
+        """ Test POST of malformed scores and stats, which are refused before
+        they are recorded or buffered """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            for score in [{"level": "expert"},
+                          {"time": "100", "level": "expert"},
+                          {"time": 100, "level": "impossible"}]:
+                resp = c.post('/api/minesweeper/scores', json=score)
+                self.assertEqual(resp.status_code, 400)
+
+            resp = c.post('/api/minesweeper/stats', json={"games_played": 1})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(MinesweeperScore.query.count(), 0)
+
+
+    def test_submissions_by_deleted_user(self):
+        """ Test that a deleted user's other sessions cannot submit scores or
+        games, before or after the user is purged """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            User.query.get(self.u1_id).deleted_at = datetime.utcnow()
+            db.session.commit()
+
+            resp = c.post(
+                '/api/minesweeper/scores',
+                json={
+                    "time": 100,
+                    "level": "expert"
+                }
+            )
+            self.assertEqual(resp.status_code, 401)
+
+            # The 401 cleared the user from the session
+            with c.session_transaction() as sess:
+                sess['curr_user'] = self.u1_id
+            User.query.filter_by(id = self.u1_id).delete()
+            db.session.commit()
+
+            resp = c.post(
+                '/api/minesweeper/games',
+                json={
+                    "level": "beginner",
+                    "time": 10,
+                    "won": True,
+                    "cells_revealed": 71,
+                    "finished_at": "2024-01-01T00:00:00"
+                }
+            )
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(MinesweeperScore.query.count(), 0)
+
+
+    def test_reads_by_deleted_user(self):
+        """ Test that a deleted user's other sessions cannot list users,
+        scores or stream the leaderboard """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            User.query.get(self.u1_id).deleted_at = datetime.utcnow()
+            db.session.commit()
+
+            for url in ['/api/users', '/api/minesweeper/scores',
+                        '/api/minesweeper/scores/beginner',
+                        '/api/minesweeper/leaderboard/stream']:
+                with c.session_transaction() as sess:
+                    sess['curr_user'] = self.u1_id
+
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, 401, url)
+
+
     def test_score_retrieval(self):
         """ Test GET to /api/minesweeper/scores """
 
@@ -102,52 +196,473 @@ class MinesweeperAPITestCase(TestCase):
             self.assertIsInstance(top_scores['expert'], list)
 
 
-    # TODO: Finish test and refactor achievements checking logic for when
-    #       achievement doesn't exist in DB yet
-
-    # def test_stat_submission(self):
-    #     """ Test POST to /api/minesweeper/stats """
-
-    #     with self.client as c:
-    #         d = {
-    #             "username": "user1",
-    #             "password": "password",
-    #         }
-    #         c.post('/login', data=d, follow_redirects=True)
-
-    #         resp = c.post(
-    #             '/api/minesweeper/stats',
-    #             json={
-    #                 "games_played": 1,
-    #                 "games_won": 1,
-    #                 "beginner_games_won": 0,
-    #                 "intermediate_games_won": 0,
-    #                 "expert_games_won": 1,
-    #                 "time_played": 100,
-    #                 "cells_revealed": 381,
-    #                 "last_played_at": datetime.now()
-    #             }
-    #         )
-    #         stats = resp.json['stats']
-    #         new_achievements = resp.json['new_achievements']
-
-    #         self.assertIsInstance(stats['last_played_at'], datetime)
-    #         stats_copy = stats.copy()
-    #         stats_copy.pop('last_played_at')
-
-    #         self.assertEqual(stats,
-    #             {
-    #                 "games_played": 1,
-    #                 "games_won": 1,
-    #                 "beginner_games_won": 0,
-    #                 "intermediate_games_won": 0,
-    #                 "expert_games_won": 1,
-    #                 "time_played": 100,
-    #                 "cells_revealed": 381
-    #             }
-    #         )
-
-    #         self.assertIsInstance(new_achievements, list)
+    def test_score_retrieval_cached(self):
+        """ Test that submitted scores update the cached leaderboards """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            c.get('/api/minesweeper/scores')
+            c.post(
+                '/api/minesweeper/games',
+                json={
+                    "level": "beginner",
+                    "time": 25,
+                    "won": True,
+                    "cells_revealed": 71,
+                    "finished_at": "Sun, 18 Oct 2026 10:00:00 GMT"
+                }
+            )
+
+            misses = minesweeper_leaderboard.metrics()['misses']
+            resp = c.get('/api/minesweeper/scores')
+
+            self.assertEqual(
+                [s['time'] for s in resp.json['scores']['beginner']], [25])
+            self.assertEqual(
+                minesweeper_leaderboard.metrics()['misses'], misses)
+
+
+    def test_score_retrieval_not_modified(self):
+        """ Test conditional GET to /api/minesweeper/scores """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            resp = c.get('/api/minesweeper/scores')
+            etag = resp.headers['ETag']
+
+            resp = c.get('/api/minesweeper/scores',
+                         headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+            self.assertEqual(resp.headers['ETag'], etag)
+
+            # Reloaded after expiring, with the same scores
+            minesweeper_leaderboard.invalidate()
+            not_modified = minesweeper_leaderboard.metrics()['not_modified']
+
+            resp = c.get('/api/minesweeper/scores',
+                         headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['ETag'], etag)
+            self.assertEqual(
+                minesweeper_leaderboard.metrics()['not_modified'],
+                not_modified + 1)
+
+            c.post('/api/minesweeper/scores',
+                   json={"time": 100, "level": "expert"})
+
+            resp = c.get('/api/minesweeper/scores',
+                         headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+            self.assertEqual(len(resp.json['scores']['expert']), 1)
+
+
+    def test_score_retrieval_best_mode(self):
+        """ Test GET to /api/minesweeper/scores?mode=best """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            c.get('/api/minesweeper/scores?mode=best')
+
+            for time in [40, 25, 30]:
+                c.post('/api/minesweeper/scores',
+                       json={"time": time, "level": "beginner"})
+
+            resp = c.get('/api/minesweeper/scores?mode=best')
+            self.assertEqual(
+                [(s['user_id'], s['time'])
+                 for s in resp.json['scores']['beginner']],
+                [(self.u1_id, 25)]
+            )
+
+            resp = c.get('/api/minesweeper/scores?mode=fastest')
+            self.assertEqual(resp.status_code, 400)
+
+
+    def test_score_retrieval_window(self):
+        """ Test GET to /api/minesweeper/scores?window=day|week """
+
+        with app.app_context():
+            # Best of a past week, left out of both windows
+            MinesweeperPeriodBest.add_scores([
+                MinesweeperScore.query.get(self.add_old_score(10))])
+            db.session.commit()
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            c.get('/api/minesweeper/scores?window=day')
+
+            for time in [40, 25, 30]:
+                c.post('/api/minesweeper/scores',
+                       json={"time": time, "level": "beginner"})
+
+            for window in ['day', 'week']:
+                resp = c.get(f'/api/minesweeper/scores?window={window}')
+                self.assertEqual(
+                    [(s['user_id'], s['time'])
+                     for s in resp.json['scores']['beginner']],
+                    [(self.u1_id, 25)]
+                )
+
+            resp = c.get('/api/minesweeper/scores?window=month')
+            self.assertEqual(resp.status_code, 400)
+
+
+    def add_old_score(self, time):
+        """ Add a beginner score submitted 30 days ago, returning its id """
+
+        score = MinesweeperScore(
+            user_id = self.u1_id,
+            time = time,
+            level = 'beginner',
+            submitted_at = datetime.utcnow() - timedelta(days = 30)
+        )
+        db.session.add(score)
+        db.session.flush()
+        return score.id
+
+
+    def test_scores_page_retrieval(self):
+        """ Test paging through GET /api/minesweeper/scores/<level> """
+
+        with app.app_context():
+            for time in [50, 10, 40, 20, 30]:
+                db.session.add(MinesweeperScore(
+                    user_id = self.u1_id,
+                    time = time,
+                    level = 'expert'
+                ))
+            db.session.commit()
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            times = []
+            url = '/api/minesweeper/scores/expert?limit=2'
+            resp = c.get(url)
+
+            while True:
+                self.assertEqual(resp.status_code, 200)
+                times.extend(s['time'] for s in resp.json['scores'])
+                if not resp.json['next_cursor']:
+                    break
+                resp = c.get(f"{url}&cursor={resp.json['next_cursor']}")
+
+            self.assertEqual(times, [10, 20, 30, 40, 50])
+
+            resp = c.get('/api/minesweeper/scores/expert?cursor=bogus')
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.get('/api/minesweeper/scores/expert?limit=1000')
+            self.assertEqual(resp.status_code, 400)
+
+
+    def test_rank_retrieval(self):
+        """ Test GET to /api/minesweeper/rank """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            resp = c.get('/api/minesweeper/rank?level=beginner')
+            self.assertEqual(resp.json['best'], None)
+            self.assertEqual(resp.json['rank'], None)
+
+            c.post('/api/minesweeper/scores',
+                   json={"time": 42, "level": "beginner"})
+
+            resp = c.get('/api/minesweeper/rank?level=beginner')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['best']['time'], 42)
+            self.assertEqual(resp.json['rank'], 1)
+            self.assertEqual(resp.json['total'], 1)
+
+            resp = c.get('/api/minesweeper/rank?level=impossible')
+            self.assertEqual(resp.status_code, 400)
+
+
+    def test_metrics_admin_only(self):
+        """ Test GET to /api/admin/metrics by a non-admin user """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            resp = c.get('/api/admin/metrics')
+
+            self.assertEqual(resp.status_code, 403)
+
+
+    def test_stat_submission(self):
+        """ Test POST to /api/minesweeper/stats """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            resp = c.post(
+                '/api/minesweeper/stats',
+                json={
+                    "games_played": 1,
+                    "games_won": 1,
+                    "beginner_games_won": 0,
+                    "intermediate_games_won": 0,
+                    "expert_games_won": 1,
+                    "time_played": 100,
+                    "cells_revealed": 381,
+                    "last_played_at": "Sun, 18 Oct 2026 10:00:00 GMT",
+                    "level": "expert"
+                }
+            )
+            stats = resp.json['stats']
+            new_achievements = resp.json['new_achievements']
+
+            stats.pop('last_played_at')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(stats,
+                {
+                    "user_id": self.u1_id,
+                    "games_played": 1,
+                    "games_won": 1,
+                    "beginner_games_won": 0,
+                    "intermediate_games_won": 0,
+                    "expert_games_won": 1,
+                    "time_played": 100,
+                    "cells_revealed": 381,
+                    "win_streak": 1
+                }
+            )
+            self.assertIsInstance(new_achievements, list)
+
+
+    def test_invalid_stat_submission(self):
+        """ Test POST to /api/minesweeper/stats with inconsistent stats """
+
+        stats = {
+            "games_played": 1,
+            "games_won": 1,
+            "beginner_games_won": 0,
+            "intermediate_games_won": 0,
+            "expert_games_won": 1,
+            "time_played": 100,
+            "cells_revealed": 381,
+            "last_played_at": "2026-10-18T12:00:00+02:00",
+            "level": "expert"
+        }
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            for invalid in [
+                {**stats, "games_played": 0},
+                {**stats, "beginner_games_won": 1},
+                {**stats, "expert_games_won": 0},
+                {**stats, "level": "beginner"},
+                {key: value for key, value in stats.items() if key != 'level'},
+            ]:
+                resp = c.post('/api/minesweeper/stats', json=invalid)
+
+                self.assertEqual(resp.status_code, 400)
+
+            resp = c.post('/api/minesweeper/stats', json=stats)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['stats']['games_played'], 1)
+            self.assertEqual(
+                MinesweeperStat.query.get(self.u1_id).last_played_at,
+                datetime(2026, 10, 18, 10))
+
+
+    def test_game_submission(self):
+        """ Test POST to /api/minesweeper/games """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            game = {
+                "level": "expert",
+                "time": 150,
+                "won": True,
+                "cells_revealed": 381,
+                "finished_at": "Sun, 18 Oct 2026 10:00:00 GMT"
+            }
+
+            resp = c.post('/api/minesweeper/games', json=game)
+
+            self.assertEqual(resp.status_code, 201)
+            self.assertEqual(resp.json['score']['time'], 150)
+            self.assertEqual(resp.json['score']['user_display_name'], 'user1')
+            self.assertEqual(resp.json['rank'], 1)
+            self.assertEqual(resp.json['stats']['games_won'], 1)
+            self.assertIsInstance(resp.json['new_achievements'], list)
+
+            resp = c.post('/api/minesweeper/games', json={**game, "time": 200})
+
+            self.assertEqual(resp.json['rank'], 2)
+            self.assertEqual(resp.json['stats']['win_streak'], 2)
+
+            resp = c.post('/api/minesweeper/games', json={**game, "won": False})
+
+            self.assertIsNone(resp.json['score'])
+            self.assertIsNone(resp.json['rank'])
+            self.assertEqual(resp.json['stats']['games_played'], 3)
+            self.assertEqual(resp.json['stats']['win_streak'], 0)
+            self.assertEqual(MinesweeperScore.query.count(), 2)
+
+
+    def test_games_batch_submission(self):
+        """ Test POST to /api/minesweeper/games/batch """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            game = {
+                "level": "beginner",
+                "time": 30,
+                "won": True,
+                "cells_revealed": 71,
+                "finished_at": "Sun, 18 Oct 2026 10:00:00 GMT"
+            }
+
+            resp = c.post(
+                '/api/minesweeper/games/batch',
+                json={
+                    "games": [
+                        game,
+                        {**game, "won": False, "cells_revealed": 10},
+                        {**game, "level": "expert", "time": 200},
+                    ]
+                }
+            )
+            stats = resp.json['stats']
+            stats.pop('last_played_at')
+
+            self.assertEqual(resp.status_code, 201)
+            self.assertEqual(stats,
+                {
+                    "user_id": self.u1_id,
+                    "games_played": 3,
+                    "games_won": 2,
+                    "beginner_games_won": 1,
+                    "intermediate_games_won": 0,
+                    "expert_games_won": 1,
+                    "time_played": 260,
+                    "cells_revealed": 152,
+                    "win_streak": 1
+                }
+            )
+            self.assertIsInstance(resp.json['new_achievements'], list)
+            self.assertEqual(MinesweeperScore.query.count(), 2)
+
+
+    def test_invalid_games_batch_submission(self):
+        """ Test POST to /api/minesweeper/games/batch with an invalid game """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            resp = c.post(
+                '/api/minesweeper/games/batch',
+                json={
+                    "games": [{
+                        "level": "impossible",
+                        "time": 30,
+                        "won": True,
+                        "cells_revealed": 71,
+                        "finished_at": "Sun, 18 Oct 2026 10:00:00 GMT"
+                    }]
+                }
+            )
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(MinesweeperScore.query.count(), 0)
+
+
+    def test_game_submission_server_time(self):
+        """ Test that a game's score is submitted at server time, whatever
+        finished_at says, and that unparseable dates and out of range counts
+        are refused """
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            game = {
+                "level": "beginner",
+                "time": 30,
+                "won": True,
+                "cells_revealed": 71,
+                "finished_at": "Mon, 01 Jan 2001 00:00:00 GMT"
+            }
+
+            resp = c.post('/api/minesweeper/games', json=game)
+
+            self.assertEqual(resp.status_code, 201)
+            score = MinesweeperScore.query.one()
+            self.assertLess(
+                abs(datetime.utcnow() - score.submitted_at),
+                timedelta(minutes = 1))
+
+            for invalid in [{"finished_at": "yesterday"},
+                            {"cells_revealed": 40000},
+                            {"time": 10 ** 10}]:
+                resp = c.post('/api/minesweeper/games',
+                              json={**game, **invalid})
+                self.assertEqual(resp.status_code, 400)
 
 
     # TODO: Test login_required routes with flask-login
@@ -1,11 +1,16 @@
 """ Minesweeper model tests """
 
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import date, datetime, timedelta
 from unittest import TestCase
 from models import (
     db, User, Role, MinesweeperScore, MinesweeperStat, MinesweeperAchievement,
-    UserMinesweeperAchievement, connect_db, DEFAULT_USER_ROLE)
+    UserMinesweeperAchievement, MinesweeperPersonalBest, MinesweeperPeriodBest,
+    connect_db, calc_period_start, DAY, WEEK, DEFAULT_USER_ROLE)
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
 from app import app
 
@@ -201,6 +206,69 @@ class MinesweeperScoreTestCase(MinesweeperModelTestCase):
             )
 
 
+    def test_leaderboard_query_uses_index(self):
+        """ Test that the leaderboards query read each level's top scores
+        from an index in order, stopping at the limit, instead of sorting
+        the level """
+
+        with app.app_context():
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, many):
+                statements.append((statement, parameters))
+
+            # The test table is too small for the planner to prefer an index
+            # on its own
+            db.session.execute(text('SET LOCAL enable_seqscan = off'))
+            db.session.execute(text('SET LOCAL enable_bitmapscan = off'))
+
+            engine = db.session.get_bind()
+            event.listen(engine, 'before_cursor_execute', record)
+            try:
+                MinesweeperScore.get_leaderboards(['beginner', 'expert'], 20)
+            finally:
+                event.remove(engine, 'before_cursor_execute', record)
+
+            self.assertEqual(len(statements), 1)
+            statement, parameters = statements[0]
+
+            plan = '\n'.join(
+                line for (line,) in db.session.connection().exec_driver_sql(
+                    f'EXPLAIN {statement}', parameters))
+
+            self.assertIn('ix_minesweeper_scores_leaderboard', plan)
+            self.assertNotIn('WindowAgg', plan)
+            # Only the rows returned are sorted, by level, above the limit
+            self.assertIn('Limit', plan)
+            self.assertNotIn('Sort', plan[plan.index('Limit'):])
+
+
+    def test_get_leaderboards(self):
+        """ Test get_leaderboards class method """
+
+        with app.app_context():
+            for time, level in [(100, 'expert'), (20, 'beginner'),
+                                (19, 'beginner'), (30, 'beginner')]:
+                db.session.add(MinesweeperScore(
+                    user_id = self.u1_id,
+                    time = time,
+                    level = level
+                ))
+            db.session.commit()
+
+            leaderboards = MinesweeperScore.get_leaderboards(
+                ['beginner', 'intermediate', 'expert'], 2)
+
+            self.assertEqual(
+                [row.time for row in leaderboards['beginner']], [19, 20])
+            self.assertEqual(leaderboards['intermediate'], [])
+
+            # Same shape as serialize, without loading ORM objects
+            score = MinesweeperScore.query.filter_by(level = 'expert').one()
+            self.assertEqual(
+                leaderboards['expert'][0]._asdict(), score.serialize())
+
+
     def test_serialize(self):
         """ Test serialize instance method """
 
@@ -230,6 +298,279 @@ class MinesweeperScoreTestCase(MinesweeperModelTestCase):
             )
 
 
+class MinesweeperPersonalBestTestCase(MinesweeperModelTestCase):
+    """ Test minesweeper personal best model class """
+
+    def add_scores(self, times, level = 'beginner'):
+        """ Add and flush scores with <times>, returning them """
+
+        scores = [
+            MinesweeperScore(
+                user_id = self.u1_id,
+                time = time,
+                level = level,
+                submitted_at = datetime(2026, 10, 18)
+            )
+            for time in times
+        ]
+        db.session.add_all(scores)
+        db.session.flush()
+        return scores
+
+
+    def test_add_scores(self):
+        """ Test that only a score beating the stored best replaces it """
+
+        with app.app_context():
+            MinesweeperPersonalBest.add_scores(self.add_scores([30, 20]))
+            MinesweeperPersonalBest.add_scores(self.add_scores([25]))
+            db.session.commit()
+
+            best = MinesweeperPersonalBest.query.get((self.u1_id, 'beginner'))
+            self.assertEqual(best.time, 20)
+
+            (faster,) = self.add_scores([10])
+            MinesweeperPersonalBest.add_scores([faster])
+            db.session.commit()
+
+            best = MinesweeperPersonalBest.query.get((self.u1_id, 'beginner'))
+            self.assertEqual(best.time, 10)
+            self.assertEqual(best.score_id, faster.id)
+
+
+    def test_get_leaderboards(self):
+        """ Test that each player appears once per level """
+
+        with app.app_context():
+            u2 = User.signup(
+                username = 'user2',
+                password = 'password',
+                display_name = 'user2',
+                email = 'user2@email.com'
+            )
+            db.session.flush()
+
+            scores = self.add_scores([15, 12, 40])
+            scores.append(MinesweeperScore(
+                user_id = u2.id,
+                time = 14,
+                level = 'beginner',
+                submitted_at = datetime(2026, 10, 18)
+            ))
+            db.session.add(scores[-1])
+            db.session.flush()
+
+            MinesweeperPersonalBest.add_scores(scores)
+            db.session.commit()
+
+            leaderboards = MinesweeperPersonalBest.get_leaderboards(
+                ['beginner', 'expert'], 20)
+
+            self.assertEqual(
+                [(row.user_display_name, row.time)
+                 for row in leaderboards['beginner']],
+                [('user1', 12), ('user2', 14)]
+            )
+            self.assertEqual(leaderboards['expert'], [])
+
+
+    def test_get_rank(self):
+        """ Test get_rank class method """
+
+        with app.app_context():
+            u2 = User.signup(
+                username = 'user2',
+                password = 'password',
+                display_name = 'user2',
+                email = 'user2@email.com'
+            )
+            db.session.flush()
+
+            scores = self.add_scores([15, 30])
+            scores.append(MinesweeperScore(
+                user_id = u2.id,
+                time = 12,
+                level = 'beginner',
+                submitted_at = datetime(2026, 10, 18)
+            ))
+            db.session.add(scores[-1])
+            db.session.flush()
+
+            MinesweeperPersonalBest.add_scores(scores)
+            db.session.commit()
+
+            best, rank, total = MinesweeperPersonalBest.get_rank(
+                self.u1_id, 'beginner')
+            self.assertEqual((best.time, rank, total), (15, 2, 2))
+
+            self.assertEqual(
+                MinesweeperPersonalBest.get_rank(self.u1_id, 'expert'),
+                (None, None, 0)
+            )
+
+            # Deleted users are not ranked
+            User.query.get(u2.id).deleted_at = datetime.utcnow()
+            db.session.commit()
+
+            best, rank, total = MinesweeperPersonalBest.get_rank(
+                self.u1_id, 'beginner')
+            self.assertEqual((best.time, rank, total), (15, 1, 1))
+
+
+    def test_rank_count_uses_index_only_scan(self):
+        """ Test that the counts get_rank runs only read the leaderboard
+        index """
+
+        with app.app_context():
+            MinesweeperPersonalBest.add_scores(self.add_scores([15]))
+            db.session.commit()
+
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, many):
+                statements.append((statement, parameters))
+
+            # The test table is too small for the planner to prefer an index
+            # on its own
+            db.session.execute(text('SET LOCAL enable_seqscan = off'))
+            db.session.execute(text('SET LOCAL enable_bitmapscan = off'))
+
+            engine = db.session.get_bind()
+            event.listen(engine, 'before_cursor_execute', record)
+            try:
+                MinesweeperPersonalBest.get_rank(self.u1_id, 'beginner')
+            finally:
+                event.remove(engine, 'before_cursor_execute', record)
+
+            # Loading the personal best, then both counts
+            statement, parameters = statements[-1]
+            self.assertIn('count(*)', statement)
+
+            plan = '\n'.join(
+                line for (line,) in db.session.connection().exec_driver_sql(
+                    f'EXPLAIN {statement}', parameters))
+
+            self.assertEqual(plan.count(
+                'Index Only Scan using ix_minesweeper_personal_bests_leaderboard'),
+                2)
+
+
+class MinesweeperPeriodBestTestCase(MinesweeperModelTestCase):
+    """ Test minesweeper period best model class """
+
+    def add_score(self, time, submitted_at):
+        """ Add and flush a beginner score, returning it """
+
+        score = MinesweeperScore(
+            user_id = self.u1_id,
+            time = time,
+            level = 'beginner',
+            submitted_at = submitted_at
+        )
+        db.session.add(score)
+        db.session.flush()
+        return score
+
+
+    def test_calc_period_start(self):
+        """ Test that days start at midnight and weeks on Monday """
+
+        sunday = datetime(2026, 10, 18, 23, 59)
+        monday = datetime(2026, 10, 19, 0, 1)
+
+        self.assertEqual(calc_period_start(DAY, sunday), date(2026, 10, 18))
+        self.assertEqual(calc_period_start(WEEK, sunday), date(2026, 10, 12))
+        self.assertEqual(calc_period_start(DAY, monday), date(2026, 10, 19))
+        self.assertEqual(calc_period_start(WEEK, monday), date(2026, 10, 19))
+
+
+    def test_add_scores(self):
+        """ Test that each day and week keeps its own best """
+
+        with app.app_context():
+            MinesweeperPeriodBest.add_scores([
+                self.add_score(30, datetime(2026, 10, 17)),
+                self.add_score(20, datetime(2026, 10, 18)),
+                self.add_score(25, datetime(2026, 10, 18)),
+                self.add_score(40, datetime(2026, 10, 19)),
+            ])
+            db.session.commit()
+
+            bests = (MinesweeperPeriodBest.query
+                .order_by(MinesweeperPeriodBest.period,
+                          MinesweeperPeriodBest.period_start)
+                .all())
+
+            self.assertEqual(
+                [(b.period, b.period_start, b.time) for b in bests],
+                [
+                    (DAY, date(2026, 10, 17), 30),
+                    (DAY, date(2026, 10, 18), 20),
+                    (DAY, date(2026, 10, 19), 40),
+                    (WEEK, date(2026, 10, 12), 20),
+                    (WEEK, date(2026, 10, 19), 40),
+                ]
+            )
+
+
+    def test_get_leaderboards(self):
+        """ Test that only the requested window is ranked """
+
+        with app.app_context():
+            MinesweeperPeriodBest.add_scores([
+                self.add_score(10, datetime(2026, 10, 17)),
+                self.add_score(20, datetime(2026, 10, 18)),
+            ])
+            db.session.commit()
+
+            leaderboards = MinesweeperPeriodBest.get_leaderboards(
+                DAY, date(2026, 10, 18), ['beginner', 'expert'], 20)
+
+            self.assertEqual(
+                [row.time for row in leaderboards['beginner']], [20])
+            self.assertEqual(leaderboards['expert'], [])
+
+
+    def test_prune(self):
+        """ Test that only windows starting before the cutoff are deleted """
+
+        with app.app_context():
+            MinesweeperPeriodBest.add_scores([
+                self.add_score(10, datetime(2026, 10, 17)),
+                self.add_score(20, datetime(2026, 10, 18)),
+            ])
+
+            self.assertEqual(
+                MinesweeperPeriodBest.prune(DAY, date(2026, 10, 18)), 1)
+            self.assertEqual(
+                MinesweeperPeriodBest.prune(WEEK, date(2026, 10, 12)), 0)
+            db.session.commit()
+
+            self.assertEqual(MinesweeperPeriodBest.query.count(), 2)
+
+
+    def test_prune_command(self):
+        """ Test that prune-period-bests keeps the retained windows """
+
+        with app.app_context():
+            MinesweeperPeriodBest.add_scores([
+                self.add_score(10, datetime.utcnow() - timedelta(days = 60)),
+                self.add_score(20, datetime.utcnow()),
+            ])
+            db.session.commit()
+
+        result = app.test_cli_runner().invoke(
+            args = ['minesweeper', 'prune-period-bests', '--days', '1'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Deleted 1 day bests', result.output)
+        self.assertIn('Deleted 1 week bests', result.output)
+
+        with app.app_context():
+            self.assertEqual(
+                [b.time for b in MinesweeperPeriodBest.query.all()], [20, 20])
+
+
 class MinesweeperStatTestCase(MinesweeperModelTestCase):
     """ Test minesweeper stat model class """
 
@@ -422,6 +763,93 @@ class MinesweeperStatTestCase(MinesweeperModelTestCase):
             )
 
 
+    def test_add_games(self):
+        """ Test add_games class method """
+
+        with app.app_context():
+            counts = {
+                "games_played": 1,
+                "games_won": 1,
+                "beginner_games_won": 1,
+                "time_played": 10,
+                "cells_revealed": 71
+            }
+
+            stat, previous_win_streak = MinesweeperStat.add_games(
+                self.u1_id, counts, 1, False, datetime.utcnow())
+            db.session.commit()
+
+            self.assertEqual(stat.games_played, 1)
+            self.assertEqual(stat.win_streak, 1)
+            self.assertIsNone(previous_win_streak)
+
+            stat, previous_win_streak = MinesweeperStat.add_games(
+                self.u1_id, counts, 1, False, datetime.utcnow())
+            db.session.commit()
+
+            self.assertEqual(stat.games_won, 2)
+            self.assertEqual(stat.time_played, 20)
+            self.assertEqual(stat.win_streak, 2)
+            self.assertEqual(previous_win_streak, 1)
+
+            stat, previous_win_streak = MinesweeperStat.add_games(
+                self.u1_id,
+                {"games_played": 1, "time_played": 5},
+                0,
+                True,
+                datetime.utcnow()
+            )
+            db.session.commit()
+
+            stat_db = MinesweeperStat.query.get(self.u1_id)
+
+            self.assertEqual(MinesweeperStat.query.count(), 1)
+            self.assertEqual(stat_db.games_played, 3)
+            self.assertEqual(stat_db.games_won, 2)
+            self.assertEqual(stat_db.games_lost, 1)
+            self.assertEqual(stat_db.time_played, 25)
+            self.assertEqual(stat_db.win_streak, 0)
+            self.assertEqual(previous_win_streak, 2)
+
+
+    def test_add_games_concurrent_update(self):
+        """ Test that add_games returns the streak committed by a transaction
+        it waited for, not the one from when it started """
+
+        counts = {"games_played": 1, "games_won": 1, "beginner_games_won": 1}
+        results = []
+
+        def add_win():
+            with app.app_context():
+                results.append(MinesweeperStat.add_games(
+                    self.u1_id, counts, 1, False, datetime.utcnow())[1])
+                db.session.commit()
+
+        with app.app_context():
+            MinesweeperStat.add_games(
+                self.u1_id, counts, 7, False, datetime.utcnow())
+            db.session.commit()
+
+            with db.engine.connect() as conn:
+                transaction = conn.begin()
+                conn.execute(
+                    text('UPDATE minesweeper_stats SET win_streak = 0 '
+                         'WHERE user_id = :user_id'),
+                    {"user_id": self.u1_id})
+
+                thread = threading.Thread(target = add_win)
+                thread.start()
+                # Let add_games wait on the row lock
+                time.sleep(0.5)
+                transaction.commit()
+
+            thread.join(timeout = 10)
+
+            self.assertEqual(results, [0])
+            self.assertEqual(
+                MinesweeperStat.query.get(self.u1_id).win_streak, 1)
+
+
 #TODO: Figure out how to test calc_time_since_last_played
 
 
@@ -0,0 +1,216 @@
+""" Minesweeper game log and stats projection tests """
+
+import os
+from datetime import datetime
+from unittest import TestCase
+from models import (
+    db, User, Role, MinesweeperStat, MinesweeperGame, MinesweeperStatSnapshot,
+    connect_db, DEFAULT_USER_ROLE)
+from minesweeper import record_minesweeper_games
+from minesweeper_projection import PROJECTED_FIELDS, fold_minesweeper_games
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+
+def make_game_result(level, won, time):
+    """ Build a game result, as sent to /api/minesweeper/games """
+
+    return {
+        "level": level,
+        "time": time,
+        "won": won,
+        "cells_revealed": 50,
+        "finished_at": "2026-10-18T10:00:00"
+    }
+
+
+class FoldMinesweeperGamesTestCase(TestCase):
+    """ Test replaying logged games on top of projected stats """
+
+    def test_fold(self):
+        """ Test that counters accumulate and a loss resets the streak """
+
+        stats = dict.fromkeys(PROJECTED_FIELDS, 0)
+        stats['win_streak'] = 4
+        stats['last_played_at'] = None
+
+        new_stats, last_game_id = fold_minesweeper_games(stats, [
+            (7, 1, 1, True, 10, 71, datetime(2026, 10, 1)),
+            (8, 1, 3, False, 50, 20, datetime(2026, 10, 2)),
+            (9, 1, 2, True, 90, 216, datetime(2026, 10, 3)),
+            (10, 1, None, False, 5, 1, datetime(2026, 10, 4)),
+            (11, 1, 2, True, 80, 216, datetime(2026, 10, 5)),
+        ])
+
+        self.assertEqual(last_game_id, 11)
+        self.assertEqual(new_stats, {
+            "games_played": 5,
+            "games_won": 3,
+            "beginner_games_won": 1,
+            "intermediate_games_won": 2,
+            "expert_games_won": 0,
+            "time_played": 235,
+            "cells_revealed": 524,
+            "win_streak": 1,
+            "last_played_at": datetime(2026, 10, 5)
+        })
+
+
+    def test_fold_no_games(self):
+        """ Test that replaying no games leaves the stats unchanged """
+
+        stats = dict.fromkeys(PROJECTED_FIELDS, 3)
+        stats['last_played_at'] = datetime(2026, 10, 1)
+
+        self.assertEqual(fold_minesweeper_games(stats, []), (stats, None))
+
+
+class MinesweeperProjectionTestCase(TestCase):
+    """ Test logging games and rebuilding stats from the log """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        with app.app_context():
+            User.query.delete()
+
+            u1 = User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+
+            db.session.commit()
+            self.u1_id = u1.id
+
+        self.runner = app.test_cli_runner()
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        with app.app_context():
+            db.session.rollback()
+
+
+    def test_games_logged(self):
+        """ Test that recorded games, including losses, are logged """
+
+        with app.app_context():
+            record_minesweeper_games(self.u1_id, [
+                make_game_result('expert', False, 30),
+                make_game_result('beginner', True, 15),
+            ])
+            db.session.commit()
+
+            games = (MinesweeperGame.query
+                .filter_by(user_id = self.u1_id)
+                .order_by(MinesweeperGame.id)
+                .all())
+
+            self.assertEqual(
+                [(g.level, g.won, g.time) for g in games],
+                [(3, False, 30), (1, True, 15)]
+            )
+
+
+    def test_rebuild(self):
+        """ Test that drifted stats from before the log are rebuilt from the
+        snapshot and the games logged after it """
+
+        with app.app_context():
+            # Played before the log existed
+            db.session.add(MinesweeperStat(
+                user_id = self.u1_id,
+                games_played = 1,
+                games_won = 1,
+                beginner_games_won = 1,
+                time_played = 15,
+                cells_revealed = 71,
+                win_streak = 1
+            ))
+            db.session.commit()
+
+        result = self.runner.invoke(args = ['minesweeper', 'rebuild-stats'])
+        self.assertIn('Rebuilt stats of 0 users from 0 games.', result.output)
+
+        result = self.runner.invoke(args = ['minesweeper', 'snapshot-stats'])
+        self.assertIn('Took 1 snapshots.', result.output)
+
+        with app.app_context():
+            record_minesweeper_games(self.u1_id, [
+                make_game_result('expert', False, 30),
+                make_game_result('intermediate', True, 60),
+            ])
+
+            stat = MinesweeperStat.query.get(self.u1_id)
+            stat.games_played = 100
+            stat.win_streak = 0
+            db.session.commit()
+
+        result = self.runner.invoke(
+            args = ['minesweeper', 'rebuild-stats', '--user-id', self.u1_id])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Rebuilt stats of 1 users from 2 games.', result.output)
+
+        with app.app_context():
+            stat = MinesweeperStat.query.get(self.u1_id)
+            self.assertEqual(stat.games_played, 3)
+            self.assertEqual(stat.games_won, 2)
+            self.assertEqual(stat.intermediate_games_won, 1)
+            self.assertEqual(stat.time_played, 105)
+            self.assertEqual(stat.win_streak, 1)
+
+            snapshot = MinesweeperStatSnapshot.query.get(self.u1_id)
+            last_game_id = (MinesweeperGame.query
+                .filter_by(user_id = self.u1_id)
+                .order_by(MinesweeperGame.id.desc())
+                .first().id)
+            self.assertEqual(snapshot.last_game_id, last_game_id)
+            self.assertEqual(snapshot.stats['games_played'], 3)
+
+        result = self.runner.invoke(args = ['minesweeper', 'rebuild-stats'])
+        self.assertIn('Rebuilt stats of 1 users from 0 games.', result.output)
+
+
+    def test_rebuild_from_zero(self):
+        """ Test that the stats of a user who started playing after the log
+        existed are rebuilt from zero, without snapshot-stats """
+
+        with app.app_context():
+            record_minesweeper_games(self.u1_id, [
+                make_game_result('beginner', True, 15),
+                make_game_result('expert', False, 30),
+            ])
+            db.session.commit()
+
+            self.assertEqual(
+                MinesweeperStatSnapshot.query.get(self.u1_id).last_game_id, 0)
+
+            MinesweeperStat.query.get(self.u1_id).games_played = 100
+            db.session.commit()
+
+        result = self.runner.invoke(args = ['minesweeper', 'rebuild-stats'])
+        self.assertIn('Rebuilt stats of 1 users from 2 games.', result.output)
+
+        with app.app_context():
+            stat = MinesweeperStat.query.get(self.u1_id)
+            self.assertEqual(stat.games_played, 2)
+            self.assertEqual(stat.games_won, 1)
+            self.assertEqual(stat.time_played, 45)
+            self.assertEqual(stat.win_streak, 0)
@@ -0,0 +1,114 @@
+""" Minesweeper score retention tests """
+
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import (db, User, Role, MinesweeperScore, connect_db,
+                    DEFAULT_USER_ROLE)
+from minesweeper import insert_minesweeper_scores
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+
+class CompactScoresTestCase(TestCase):
+    """ Test archiving old minesweeper scores """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        with app.app_context():
+            User.query.delete()
+
+            u1 = User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+            db.session.flush()
+
+            old = datetime.utcnow() - timedelta(days = 100)
+            insert_minesweeper_scores(
+                [
+                    {
+                        "user_id": u1.id,
+                        "time": time,
+                        "level": 'beginner',
+                        "submitted_at": old
+                    }
+                    for time in range(10, 35)
+                ]
+                + [
+                    {
+                        "user_id": u1.id,
+                        "time": 100,
+                        "level": 'beginner',
+                        "submitted_at": datetime.utcnow()
+                    }
+                ]
+            )
+            db.session.commit()
+
+        self.runner = app.test_cli_runner()
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.archive_path = os.path.join(
+            self.archive_dir.name, 'scores.jsonl.gz')
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        with app.app_context():
+            db.session.rollback()
+
+        self.archive_dir.cleanup()
+
+
+    def test_compact_scores(self):
+        """ Test that only old scores below the leaderboards that are not a
+        best are archived, then deleted """
+
+        result = self.runner.invoke(args = [
+            'minesweeper', 'compact-scores',
+            '--archive', self.archive_path,
+            '--batch-size', 2
+        ])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Archived 5 scores', result.output)
+
+        with gzip.open(self.archive_path, 'rt') as archive:
+            archived = [json.loads(line) for line in archive]
+
+        self.assertEqual(
+            sorted(s['time'] for s in archived), [30, 31, 32, 33, 34])
+
+        with app.app_context():
+            times = [
+                time for (time,) in db.session.query(MinesweeperScore.time)
+                .order_by(MinesweeperScore.time)
+            ]
+            self.assertEqual(times, list(range(10, 30)) + [100])
+
+        result = self.runner.invoke(args = [
+            'minesweeper', 'compact-scores', '--archive', self.archive_path])
+        self.assertIn('Archived 0 scores', result.output)
+
+        with gzip.open(self.archive_path, 'rt') as archive:
+            self.assertEqual(len(archive.readlines()), 5)
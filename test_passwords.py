@@ -0,0 +1,102 @@
+""" Password hashing tests """
+
+import os
+from unittest import TestCase
+from passwords import (PasswordHasher, PasswordHasherBusy, MIN_ROUNDS,
+                       MAX_ROUNDS, HASHING_NICENESS, calibrate_rounds,
+                       get_rounds)
+
+
+class PasswordHasherTestCase(TestCase):
+    """ Test hashing passwords in a thread pool """
+
+    def test_hash_and_check(self):
+        """ Test that a hash made by the pool checks against its password """
+
+        hasher = PasswordHasher(workers = 1, rounds = MIN_ROUNDS)
+
+        hashed = hasher.hash('password')
+
+        self.assertEqual(get_rounds(hashed), MIN_ROUNDS)
+        self.assertTrue(hasher.check(hashed, 'password'))
+        self.assertFalse(hasher.check(hashed, 'not_password'))
+
+        metrics = hasher.metrics()
+        self.assertEqual(metrics['completed'], 3)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['peak_in_flight'], 1)
+
+
+    def test_low_priority_threads(self):
+        """ Test that hashes run in a lowered priority thread, leaving the
+        priority of the calling thread """
+
+        hasher = PasswordHasher(workers = 1, rounds = MIN_ROUNDS)
+
+        niceness = os.getpriority(os.PRIO_PROCESS, 0)
+        hashing_niceness = hasher._run(os.getpriority, os.PRIO_PROCESS, 0)
+
+        self.assertEqual(hashing_niceness, max(niceness, HASHING_NICENESS))
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, 0), niceness)
+
+
+    def test_calibrate_on_first_use(self):
+        """ Test that the cost factor is measured on the first hash, not
+        before """
+
+        hasher = PasswordHasher(workers = 1, rounds = None,
+                                target_ms = 0.001)
+
+        self.assertIsNone(hasher.metrics()['rounds'])
+
+        hashed = hasher.hash('password')
+
+        self.assertEqual(get_rounds(hashed), MIN_ROUNDS)
+        self.assertEqual(hasher.metrics()['rounds'], MIN_ROUNDS)
+
+
+    def test_busy(self):
+        """ Test that hashes beyond the in flight cap are refused """
+
+        hasher = PasswordHasher(workers = 0, rounds = MIN_ROUNDS,
+                                max_in_flight = 0)
+
+        with self.assertRaises(PasswordHasherBusy):
+            hasher.hash('password')
+
+        self.assertEqual(hasher.metrics()['rejected'], 1)
+        self.assertEqual(hasher.metrics()['completed'], 0)
+
+
+    def test_check_unknown(self):
+        """ Test that checking a password of an unknown user runs a check at
+        the current cost and fails, making the dummy hash only once """
+
+        hasher = PasswordHasher(workers = 1, rounds = MIN_ROUNDS)
+
+        self.assertFalse(hasher.check_unknown('password'))
+        dummy_hash = hasher.dummy_hash
+        self.assertEqual(get_rounds(dummy_hash), MIN_ROUNDS)
+        self.assertEqual(hasher.metrics()['completed'], 2)
+
+        self.assertFalse(hasher.check_unknown('password'))
+        self.assertEqual(hasher.dummy_hash, dummy_hash)
+        self.assertEqual(hasher.metrics()['completed'], 3)
+
+
+    def test_needs_rehash(self):
+        """ Test that only hashes cheaper than the current cost need
+        rehashing """
+
+        hasher = PasswordHasher(workers = 0, rounds = MIN_ROUNDS + 1)
+
+        self.assertTrue(hasher.needs_rehash(f'$2b${MIN_ROUNDS}$salt'))
+        self.assertFalse(hasher.needs_rehash(f'$2b${MIN_ROUNDS + 1}$salt'))
+        self.assertFalse(hasher.needs_rehash(f'$2b${MIN_ROUNDS + 2}$salt'))
+
+
+    def test_calibrate_rounds(self):
+        """ Test that the measured cost stays within bounds """
+
+        self.assertEqual(calibrate_rounds(0.001), MIN_ROUNDS)
+        self.assertEqual(calibrate_rounds(10 ** 9), MAX_ROUNDS)
@@ -0,0 +1,62 @@
+""" Profile cache tests """
+
+from unittest import TestCase
+from profile_cache import ProfileCache, CachedProfile
+
+
+def make_profile(user_id):
+    """ Build a CachedProfile of a user who has not played """
+
+    return CachedProfile({"id": user_id}, None, None)
+
+
+class ProfileCacheTestCase(TestCase):
+    """ Test caching and invalidation of rendered profiles """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        self.cache = ProfileCache(size = 2, ttl = 3600)
+
+
+    def test_hit_and_miss(self):
+        """ Test that a cached profile is served until it is invalidated """
+
+        profile, version = self.cache.get(1)
+        self.assertIsNone(profile)
+
+        self.cache.set(1, make_profile(1), version)
+        self.assertEqual(self.cache.get(1)[0], make_profile(1))
+
+        self.cache.invalidate([1])
+        self.assertIsNone(self.cache.get(1)[0])
+        self.assertEqual(self.cache.metrics(), {
+            "hits": 1,
+            "misses": 2,
+            "invalidations": 1,
+            "cached_profiles": 0
+        })
+
+
+    def test_evict_least_recently_used(self):
+        """ Test that the least recently viewed profile is evicted first """
+
+        for user_id in [1, 2]:
+            self.cache.set(user_id, make_profile(user_id), self.cache.version)
+
+        self.cache.get(1)
+        self.cache.set(3, make_profile(3), self.cache.version)
+
+        self.assertIsNotNone(self.cache.get(1)[0])
+        self.assertIsNone(self.cache.get(2)[0])
+        self.assertIsNotNone(self.cache.get(3)[0])
+
+
+    def test_set_after_invalidation(self):
+        """ Test that a profile loaded before an invalidation is not cached """
+
+        _, version = self.cache.get(1)
+        self.cache.invalidate([1])
+        self.cache.set(1, make_profile(1), version)
+
+        self.assertIsNone(self.cache.get(1)[0])
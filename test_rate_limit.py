@@ -0,0 +1,62 @@
+""" Rate limiting tests """
+
+from unittest import TestCase
+from unittest.mock import patch
+from rate_limit import TokenBucketLimiter
+
+
+class TokenBucketLimiterTestCase(TestCase):
+    """ Test token bucket rate limiting """
+
+    def test_burst_and_refill(self):
+        """ Test that a key is limited after its burst, until it refills """
+
+        limiter = TokenBucketLimiter(rate = 1, burst = 2)
+
+        with patch('rate_limit.monotonic', return_value = 100):
+            self.assertTrue(limiter.allow('a'))
+            self.assertTrue(limiter.allow('a'))
+            self.assertFalse(limiter.allow('a'))
+            self.assertTrue(limiter.allow('b'))
+
+        with patch('rate_limit.monotonic', return_value = 101):
+            self.assertTrue(limiter.allow('a'))
+            self.assertFalse(limiter.allow('a'))
+
+        self.assertEqual(limiter.metrics(), {
+            "allowed": 4,
+            "limited": 2,
+            "evicted": 0,
+            "tracked_keys": 2
+        })
+
+
+    def test_max_keys(self):
+        """ Test that a new key evicts the least recently used bucket, and
+        that new keys are still limited once every bucket is in use """
+
+        limiter = TokenBucketLimiter(rate = 1, burst = 1, max_keys = 2)
+
+        with patch('rate_limit.monotonic', return_value = 100):
+            self.assertTrue(limiter.allow('a'))
+            self.assertTrue(limiter.allow('b'))
+            self.assertFalse(limiter.allow('a'))
+
+            # Evicts 'b', used longer ago than 'a'
+            self.assertTrue(limiter.allow('c'))
+            self.assertFalse(limiter.allow('c'))
+            self.assertFalse(limiter.allow('a'))
+            self.assertTrue(limiter.allow('b'))
+
+            self.assertEqual(list(limiter.buckets), ['a', 'b'])
+            self.assertEqual(limiter.metrics()['evicted'], 2)
+            self.assertEqual(limiter.metrics()['tracked_keys'], 2)
+
+
+    def test_per_minute(self):
+        """ Test that a per minute limit allows its limit at once """
+
+        limiter = TokenBucketLimiter.per_minute(3)
+
+        self.assertEqual([limiter.allow('a') for _ in range(4)],
+                         [True, True, True, False])
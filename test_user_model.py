@@ -1,9 +1,11 @@
 """ User model tests """
 
 import os
+from datetime import timedelta
 from unittest import TestCase
-from models import (db, User, Role, connect_db, DEFAULT_USER_ROLE,
-                    DEFAULT_USER_IMAGE_URL)
+from models import (db, User, Role, MinesweeperStat, connect_db,
+                    DEFAULT_USER_ROLE, DEFAULT_USER_IMAGE_URL)
+from passwords import password_hasher, hash_password, get_rounds, MIN_ROUNDS
 from sqlalchemy.exc import IntegrityError
 from app import app
 
@@ -192,4 +194,87 @@ class UserModelTestCase(TestCase):
             # Invalid password
             invalid_pwd_auth = User.authenticate('user1', 'not_password')
 
-            self.assertFalse(invalid_pwd_auth)
\ No newline at end of file
+            self.assertFalse(invalid_pwd_auth)
+
+
+    def test_user_search(self):
+        """ Test user search class method """
+
+        with app.app_context():
+            for display_name in ['user_2', 'user%3', 'USER4']:
+                db.session.add(User(
+                    username = display_name,
+                    password = 'password',
+                    display_name = display_name,
+                    email = f'{display_name}@email.com'
+                ))
+            db.session.commit()
+
+            def search(query, qty = 10, after = None):
+                return [u.display_name for u in User.search(query, qty, after)]
+
+            # In the database's collation order
+            ordered = search(None)
+            self.assertEqual(
+                sorted(ordered), ['USER4', 'user%3', 'user1', 'user_2'])
+            self.assertEqual(
+                search('user', 2) + search('user', 2, ordered[1]), ordered)
+
+            # Wildcards are matched literally
+            self.assertEqual(search('_'), ['user_2'])
+            self.assertEqual(search('%'), ['user%3'])
+            self.assertEqual(search('r4'), ['USER4'])
+
+
+    def test_user_authenticate_rehash(self):
+        """ Test that a hash cheaper than the current cost is replaced on
+        login """
+
+        rounds = password_hasher.rounds
+
+        with app.app_context():
+            u1 = User.query.get(self.u1_id)
+            u1.password = hash_password('password', MIN_ROUNDS)
+            db.session.commit()
+
+            password_hasher.rounds = MIN_ROUNDS + 1
+            try:
+                User.authenticate('user1', 'password')
+                db.session.commit()
+            finally:
+                password_hasher.rounds = rounds
+
+            u1 = User.query.get(self.u1_id)
+            self.assertEqual(get_rounds(u1.password), MIN_ROUNDS + 1)
+            self.assertEqual(User.authenticate('user1', 'password'), u1)
+
+
+    def test_guests(self):
+        """ Test that guests cannot log in with a password or be searched,
+        and are purged with their stats once expired """
+
+        with app.app_context():
+            guest = User.create_guest(timedelta(hours = 1))
+            expired = User.create_guest(timedelta(hours = -1))
+            User.create_guest(timedelta(hours = -2))
+            db.session.commit()
+
+            self.assertTrue(guest.is_guest())
+            self.assertFalse(User.query.get(self.u1_id).is_guest())
+            self.assertNotEqual(guest.username, expired.username)
+            self.assertFalse(User.authenticate(guest.username, '!'))
+            self.assertEqual(
+                [u.id for u in User.search(None, 10)], [self.u1_id])
+
+            db.session.add(MinesweeperStat(user_id = expired.id))
+            db.session.commit()
+            guest_id, expired_id = guest.id, expired.id
+
+            result = app.test_cli_runner().invoke(args = [
+                'users', 'purge-guests', '--batch-size', 1])
+            # 1 stats row and the 2 guests
+            self.assertIn('Purged 2 expired guests (3 rows).', result.output)
+
+            self.assertIsNotNone(User.query.get(guest_id))
+            self.assertIsNone(User.query.get(expired_id))
+            self.assertEqual(MinesweeperStat.query.count(), 0)
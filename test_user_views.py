@@ -1,10 +1,16 @@
 """ User view tests """
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
+from flask import session
+from sqlalchemy import event
 from models import (db, User, Role, connect_db, DEFAULT_USER_ROLE,
                     DEFAULT_USER_IMAGE_URL)
-from app import app, CURR_USER_KEY
+from app import (app, CURR_USER_KEY, login_ip_limiter,
+                 login_username_limiter, get_current_user)
+from passwords import password_hasher
+from account_purge import account_purger
 
 os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
 app.config['SQLALCHEMY_DATABASE_URI'] = (
@@ -12,6 +18,7 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['RATE_LIMITS_ENABLED'] = False
 
 connect_db(app)
 with app.app_context():
@@ -131,6 +138,59 @@ class UserLoginViewTestCase(UserBaseViewTestCase):
                                   "User ID should not be set in the session for invalid login.")
 
 
+    def test_login_rate_limited(self):
+        """ Test POST to /login past the attempts allowed to a username """
+
+        app.config['RATE_LIMITS_ENABLED'] = True
+        try:
+            with self.client as c:
+                d = {
+                    "username": "USER1",
+                    "password": "pAsSwOrD",
+                }
+
+                limit = app.config['LOGIN_RATE_LIMIT_PER_USERNAME']
+                for _ in range(limit):
+                    resp = c.post('/login', data=d)
+                    self.assertEqual(resp.status_code, 200)
+
+                d["username"] = "user1"
+                resp = c.post('/login', data=d)
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 429)
+                self.assertEqual(resp.headers['Retry-After'], '60')
+                self.assertIn('Too many login attempts', html)
+                self.assertEqual(login_username_limiter.metrics()['limited'], 1)
+        finally:
+            app.config['RATE_LIMITS_ENABLED'] = False
+            login_ip_limiter.reset()
+            login_username_limiter.reset()
+
+
+    def test_login_hashing_busy(self):
+        """ Test POST to /login while too many hashes are in flight """
+
+        max_in_flight = password_hasher.max_in_flight
+        password_hasher.max_in_flight = 0
+        try:
+            with self.client as c:
+                d = {
+                    "username": "user1",
+                    "password": "password",
+                }
+
+                resp = c.post('/login', data=d)
+
+                self.assertEqual(resp.status_code, 429)
+                self.assertIn('Too many login attempts',
+                              resp.get_data(as_text=True))
+                with c.session_transaction() as sess:
+                    self.assertIsNone(sess.get(CURR_USER_KEY))
+        finally:
+            password_hasher.max_in_flight = max_in_flight
+
+
 class UserSignupTestCase(UserBaseViewTestCase):
     """ Test user signup """
 
@@ -227,6 +287,83 @@ class UserInfoViewTestCase(UserBaseViewTestCase):
             self.assertIn('user1', html)
 
 
+    def test_users_api_pages(self):
+        """ Test paging through GET /api/users """
+
+        with app.app_context():
+            for i in range(2, 5):
+                User.signup(
+                    username = f'user{i}',
+                    password = 'password',
+                    display_name = f'user{i}',
+                    email = f'user{i}@email.com'
+                )
+            db.session.commit()
+
+        page_size = app.config['USERS_PAGE_SIZE']
+        app.config['USERS_PAGE_SIZE'] = 3
+
+        try:
+            with self.client as c:
+                d = {
+                    "username": "user1",
+                    "password": "password",
+                }
+                c.post('/login', data=d, follow_redirects=True)
+
+                resp = c.get('/users')
+                html = resp.get_data(as_text=True)
+                self.assertIn('data-next-cursor="user3"', html)
+                self.assertNotIn('user4', html)
+
+                resp = c.get('/api/users?cursor=user3')
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(
+                    [u['display_name'] for u in resp.json['users']], ['user4'])
+                self.assertIsNone(resp.json['next_cursor'])
+
+                resp = c.get('/api/users?q=ER2')
+                self.assertEqual(
+                    [u['display_name'] for u in resp.json['users']], ['user2'])
+        finally:
+            app.config['USERS_PAGE_SIZE'] = page_size
+
+
+    def test_current_user_loaded_once(self):
+        """ Test that the current user and their role are loaded with one
+        query per request """
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+
+            with app.app_context():
+                engine = db.engine
+            event.listen(engine, 'before_cursor_execute', record_statement)
+
+            try:
+                c.get('/users')
+                c.get('/api/admin/metrics')
+                user_loads = [s for s in statements if 'users.id = %(' in s]
+                self.assertEqual(len(user_loads), 2)
+                self.assertFalse(any('FROM roles' in s for s in statements))
+
+                statements.clear()
+                c.get('/api/minesweeper/rank?level=beginner')
+                user_loads = [s for s in statements if 'users.id = %(' in s]
+                self.assertEqual(len(user_loads), 1)
+            finally:
+                event.remove(engine, 'before_cursor_execute', record_statement)
+
+
     # TODO: Figure out how to test login_required of flask-login
     # def test_users_listing_wo_auth(self):
     #     """ Test accessing /users route without authorization """
@@ -257,6 +394,55 @@ class UserInfoViewTestCase(UserBaseViewTestCase):
             self.assertIn('user1', html)
 
 
+    def test_user_profile_cached(self):
+        """ Test that a cached profile is served without querying its stats
+        and is reloaded once the user's stats change """
+
+        stats = {
+            "games_played": 1,
+            "games_won": 1,
+            "beginner_games_won": 0,
+            "intermediate_games_won": 0,
+            "expert_games_won": 1,
+            "time_played": 100,
+            "cells_revealed": 381,
+            "last_played_at": "Sun, 18 Oct 2026 10:00:00 GMT",
+            "level": "expert"
+        }
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            d = {
+                "username": "user1",
+                "password": "password",
+            }
+            c.post('/login', data=d, follow_redirects=True)
+            c.post('/api/minesweeper/stats', json=stats)
+
+            html = c.get(f'/users/{self.u1_id}').get_data(as_text=True)
+            self.assertIn('GAME STATS', html)
+            self.assertRegex(html, r'fa-play"></i>\s*1\s')
+
+            with app.app_context():
+                engine = db.engine
+            event.listen(engine, 'before_cursor_execute', record_statement)
+            try:
+                c.get(f'/users/{self.u1_id}')
+            finally:
+                event.remove(engine, 'before_cursor_execute', record_statement)
+
+            self.assertFalse(
+                any('minesweeper' in s for s in statements))
+
+            c.post('/api/minesweeper/stats', json=stats)
+
+            html = c.get(f'/users/{self.u1_id}').get_data(as_text=True)
+            self.assertRegex(html, r'fa-play"></i>\s*2\s')
+
+
 class UserUpdateViewTestCase(UserBaseViewTestCase):
     """ Tests for updating a user """
 
@@ -325,6 +511,9 @@ class UserDeleteViewTestCase(UserBaseViewTestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('CREATE AN ACCOUNT', html)
             self.assertIn('User successfully deleted. See you again!', html)
+            self.assertIsNotNone(User.query.get(self.u1_id).deleted_at)
+
+            account_purger.wait()
             self.assertIsNone(User.query.get(self.u1_id))
 
 
@@ -341,6 +530,91 @@ class UserDeleteViewTestCase(UserBaseViewTestCase):
     #         self.assertIn('Unauthorized access.', html)
 
 
+class UserGuestViewTestCase(UserBaseViewTestCase):
+    """ Tests for guest logins """
+
+    def test_guest_login(self):
+        """ Test that each session gets its own guest, kept across guest
+        logins """
+
+        with self.client as c:
+            resp = c.post('/guestlogin', follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Logged in as guest.', resp.get_data(as_text=True))
+            with c.session_transaction() as sess:
+                guest_id = sess[CURR_USER_KEY]
+
+            guest = User.query.get(guest_id)
+            self.assertTrue(guest.is_guest())
+            expires_at = guest.guest_expires_at
+
+            c.post('/guestlogin')
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[CURR_USER_KEY], guest_id)
+            self.assertGreater(
+                User.query.get(guest_id).guest_expires_at, expires_at)
+
+        with app.test_client() as c:
+            c.post('/guestlogin')
+            with c.session_transaction() as sess:
+                self.assertNotEqual(sess[CURR_USER_KEY], guest_id)
+
+
+    def test_guest_kept_while_active(self):
+        """ Test that an active guest is extended once less than half its
+        time is left, and that an expired guest is logged out """
+
+        with self.client as c:
+            c.post('/guestlogin')
+            with c.session_transaction() as sess:
+                guest_id = sess[CURR_USER_KEY]
+
+            guest = User.query.get(guest_id)
+            expires_at = datetime.utcnow() + timedelta(hours = 1)
+            guest.guest_expires_at = expires_at
+            db.session.commit()
+
+            # Extended without committing the request's transaction
+            with app.test_request_context():
+                session[CURR_USER_KEY] = guest_id
+                transaction = db.session.begin()
+                get_current_user()
+                self.assertIs(db.session().get_transaction(), transaction)
+                self.assertFalse(db.session.dirty)
+
+            db.session.expire_all()
+            self.assertGreater(
+                User.query.get(guest_id).guest_expires_at,
+                expires_at + timedelta(hours = 12))
+
+            c.get('/games')
+
+            guest = User.query.get(guest_id)
+            guest.guest_expires_at = datetime.utcnow() - timedelta(hours = 1)
+            db.session.commit()
+
+            resp = c.get('/games')
+            self.assertIn('GUEST LOGIN', resp.get_data(as_text=True))
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+
+    def test_guest_edit(self):
+        """ Test that guests cannot edit their profile """
+
+        with self.client as c:
+            c.post('/guestlogin')
+            with c.session_transaction() as sess:
+                guest_id = sess[CURR_USER_KEY]
+
+            resp = c.get(f'/users/{guest_id}/edit', follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Please sign up to edit your profile.',
+                          resp.get_data(as_text=True))
+
+
 class UserLogoutViewTestCase(UserBaseViewTestCase):
     """ Tests for logging out a user """
 
@@ -0,0 +1,259 @@
+""" Minesweeper write-behind buffer tests """
+
+import json
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+from models import (
+    db, User, Role, MinesweeperScore, MinesweeperStat, MinesweeperGame,
+    connect_db, DEFAULT_USER_ROLE)
+import write_behind
+from write_behind import WriteBehindBuffer, claim_spill_file
+from app import app
+
+os.environ['DATABASE_URL'] = "postgresql:///davids_games_test"
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    os.environ['DATABASE_URL'].replace("postgres://", "postgresql://"))
+
+connect_db(app)
+with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    # Populate default user role
+    user_role = Role(name = DEFAULT_USER_ROLE)
+    db.session.add(user_role)
+    db.session.commit()
+
+GAME_STATS = {
+    "games_played": 1,
+    "games_won": 1,
+    "beginner_games_won": 1,
+    "intermediate_games_won": 0,
+    "expert_games_won": 0,
+    "time_played": 30,
+    "cells_revealed": 71,
+    "last_played_at": "Sun, 18 Oct 2026 10:00:00 GMT",
+    "level": "beginner"
+}
+
+
+class WriteBehindBufferTestCase(TestCase):
+    """ Test buffering and bulk flushing of minesweeper submissions """
+
+    def setUp(self):
+        """ Set up before each test """
+
+        self.spill_dir = tempfile.TemporaryDirectory()
+        app.config['MINESWEEPER_WRITE_BEHIND_MAX_ENTRIES'] = 100
+        app.config['MINESWEEPER_WRITE_BEHIND_INTERVAL'] = 3600
+        app.config['MINESWEEPER_WRITE_BEHIND_SPILL_DIR'] = self.spill_dir.name
+
+        with app.app_context():
+            User.query.delete()
+
+            u1 = User.signup(
+                username = 'user1',
+                password = 'password',
+                display_name = 'user1',
+                email = 'user1@email.com'
+            )
+
+            db.session.commit()
+            self.u1_id = u1.id
+
+
+    def tearDown(self):
+        """ Tear down after each test """
+
+        self.spill_dir.cleanup()
+
+        with app.app_context():
+            db.session.rollback()
+
+
+    def test_flush(self):
+        """ Test that buffered submissions are written on flush """
+
+        buffer = WriteBehindBuffer()
+        buffer.init_app(app)
+
+        buffer.add_score(self.u1_id, 30, 'beginner', '2026-10-18T10:00:00')
+        buffer.add_stats(self.u1_id, GAME_STATS)
+        buffer.add_stats(self.u1_id, {**GAME_STATS, "games_won": 0,
+                                      "beginner_games_won": 0})
+
+        with app.app_context():
+            self.assertEqual(MinesweeperScore.query.count(), 0)
+
+        with open(buffer.spill_path) as spill_file:
+            self.assertEqual(len(spill_file.readlines()), 3)
+
+        buffer.flush()
+
+        with app.app_context():
+            stat = MinesweeperStat.query.get(self.u1_id)
+
+            self.assertEqual(MinesweeperScore.query.count(), 1)
+            self.assertEqual(stat.games_played, 2)
+            self.assertEqual(stat.games_won, 1)
+            self.assertEqual(stat.time_played, 60)
+            self.assertEqual(stat.win_streak, 0)
+
+        with open(buffer.spill_path) as spill_file:
+            self.assertEqual(spill_file.read(), '')
+
+
+    def test_flush_games(self):
+        """ Test that buffered games are written to the scores, stats and
+        game log, scored at the time they were received """
+
+        buffer = WriteBehindBuffer()
+        buffer.init_app(app)
+
+        game = {
+            "level": "beginner",
+            "time": 30,
+            "won": True,
+            "cells_revealed": 71,
+            "finished_at": "Sun, 18 Oct 2026 10:00:00 GMT"
+        }
+        buffer.add_game(self.u1_id, game, '2026-10-18T10:00:05')
+        buffer.add_game(self.u1_id, {**game, "won": False},
+                        '2026-10-18T10:00:10')
+
+        buffer.flush()
+
+        with app.app_context():
+            score = MinesweeperScore.query.one()
+            stat = MinesweeperStat.query.get(self.u1_id)
+
+            self.assertEqual(score.submitted_at,
+                             datetime(2026, 10, 18, 10, 0, 5))
+            self.assertEqual(stat.games_played, 2)
+            self.assertEqual(stat.games_won, 1)
+            self.assertEqual(MinesweeperGame.query.count(), 2)
+
+
+    def test_flush_when_full(self):
+        """ Test that the buffer is flushed once it holds enough entries """
+
+        app.config['MINESWEEPER_WRITE_BEHIND_MAX_ENTRIES'] = 2
+
+        buffer = WriteBehindBuffer()
+        buffer.init_app(app)
+
+        buffer.add_stats(self.u1_id, GAME_STATS)
+
+        with app.app_context():
+            self.assertIsNone(MinesweeperStat.query.get(self.u1_id))
+
+        buffer.add_stats(self.u1_id, GAME_STATS)
+
+        with app.app_context():
+            stat = MinesweeperStat.query.get(self.u1_id)
+            self.assertEqual(stat.games_played, 2)
+            self.assertEqual(stat.win_streak, 2)
+
+
+    def test_recover_spill_file(self):
+        """ Test that entries spilled by a dead worker are recovered """
+
+        # Larger than any pid the kernel hands out
+        dead_spill_path = os.path.join(
+            self.spill_dir.name, 'minesweeper-99999999.jsonl')
+
+        with open(dead_spill_path, 'w') as spill_file:
+            spill_file.write(json.dumps({
+                "type": "stats",
+                "user_id": self.u1_id,
+                "game_stats": GAME_STATS
+            }) + '\n')
+
+        buffer = WriteBehindBuffer()
+        buffer.init_app(app)
+
+        self.assertFalse(os.path.exists(dead_spill_path))
+        self.assertEqual(len(buffer.entries), 1)
+
+        buffer.flush()
+
+        with app.app_context():
+            self.assertEqual(
+                MinesweeperStat.query.get(self.u1_id).games_played, 1)
+
+
+    def test_claimed_spill_files(self):
+        """ Test that a spill file claimed by a live worker is left to it, and
+        one claimed by a dead worker is recovered """
+
+        def write_spill_file(name):
+            path = os.path.join(self.spill_dir.name, name)
+            with open(path, 'w') as spill_file:
+                spill_file.write(json.dumps({
+                    "type": "stats",
+                    "user_id": self.u1_id,
+                    "game_stats": GAME_STATS
+                }) + '\n')
+            return path
+
+        # The parent of this process is alive; 99999999 is never a pid
+        live_path = write_spill_file(
+            f'claimed-{os.getppid()}-minesweeper-99999998.jsonl')
+        dead_path = write_spill_file(
+            'claimed-99999999-minesweeper-99999997.jsonl')
+
+        buffer = WriteBehindBuffer()
+        buffer.init_app(app)
+
+        self.assertTrue(os.path.exists(live_path))
+        self.assertFalse(os.path.exists(dead_path))
+        self.assertEqual(len(buffer.entries), 1)
+
+        # Already claimed by another worker
+        self.assertIsNone(claim_spill_file(dead_path, os.getpid()))
+
+
+    def test_reject_unwritable_entries(self):
+        """ Test that invalid entries, and entries the database refuses, are
+        moved to the rejected file instead of failing every flush """
+
+        dead_spill_path = os.path.join(
+            self.spill_dir.name, 'minesweeper-99999999.jsonl')
+
+        with open(dead_spill_path, 'w') as spill_file:
+            spill_file.write(json.dumps({
+                "type": "score",
+                "user_id": self.u1_id,
+                "level": "beginner"
+            }) + '\n')
+
+        buffer = WriteBehindBuffer()
+        buffer.init_app(app)
+
+        buffer.add_score(self.u1_id, 30, 'beginner', '2026-10-18T10:00:00')
+        buffer.add_score(self.u1_id, 666, 'beginner', '2026-10-18T10:00:00')
+
+        insert_scores = write_behind.insert_minesweeper_scores
+
+        def refuse_666(score_rows):
+            if any(row['time'] == 666 for row in score_rows):
+                raise ValueError('Refused')
+            return insert_scores(score_rows)
+
+        with patch('write_behind.insert_minesweeper_scores', refuse_666):
+            buffer.flush()
+
+        with app.app_context():
+            self.assertEqual(
+                [score.time for score in MinesweeperScore.query], [30])
+
+        with open(buffer.rejected_path) as rejected_file:
+            rejected = [json.loads(line) for line in rejected_file]
+        self.assertEqual([entry.get('time') for entry in rejected], [None, 666])
+
+        self.assertEqual(buffer.entries, [])
+        with open(buffer.spill_path) as spill_file:
+            self.assertEqual(spill_file.read(), '')
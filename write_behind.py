@@ -0,0 +1,425 @@
+""" Write-behind buffer for minesweeper game, score and stats submissions
+
+When enabled, submissions are acknowledged as soon as they are appended to a
+per-worker spill file, and are written to the database in bulk once the buffer
+holds enough entries, after a time interval, or when the worker shuts down.
+
+Entries that can never be written (invalid, or refused by the database) are
+moved to a rejected file in the spill directory instead of failing every
+later flush. Entries are only kept for the next flush when the database
+cannot be reached.
+
+A starting worker recovers the spill files of dead workers, claiming each by
+renaming it first, so workers starting together never replay the same file.
+Delivery is at least once: a worker that dies after a flush commits and before
+its spill file is rewritten leaves entries that are written again.
+"""
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from models import db, User
+from minesweeper import (
+    add_minesweeper_game_stats, insert_minesweeper_scores, validate_score,
+    validate_game_stats, validate_game_result, game_result_stats,
+    parse_game_stats)
+from leaderboard_cache import serialize_entering_scores, add_scores
+from profile_cache import profile_cache
+
+SCORE_ENTRY = 'score'
+STATS_ENTRY = 'stats'
+GAME_ENTRY = 'game'
+
+SPILL_FILE_PREFIX = 'minesweeper-'
+SPILL_FILE_SUFFIX = '.jsonl'
+# Spill files being recovered are renamed to
+# claimed-<recovering pid>-minesweeper-<dead pid>.jsonl
+CLAIMED_FILE_PREFIX = 'claimed-'
+
+# Shared by every worker; not matched by the spill file pattern
+REJECTED_FILE_NAME = 'rejected.jsonl'
+
+# Raised when the database cannot be reached, and the write may succeed later
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+def validate_entry(entry):
+    """ Return an error message if the buffered <entry> is not a valid game,
+    score or stats submission, otherwise None """
+
+    if not isinstance(entry, dict) or not isinstance(entry.get('user_id'), int):
+        return 'Entry must be an object with a user_id.'
+
+    if entry.get('type') == SCORE_ENTRY:
+        return validate_score(entry)
+
+    if entry.get('type') == STATS_ENTRY:
+        return validate_game_stats(entry.get('game_stats'))
+
+    if entry.get('type') == GAME_ENTRY:
+        return validate_game_result(entry.get('result'))
+
+    return f'Invalid entry type: {entry.get("type")}.'
+
+
+def get_spill_file_owner(path):
+    """ Return the pid of the worker owning the spill file at <path>: the
+    worker recovering it if claimed, otherwise the worker that wrote it """
+
+    name = os.path.basename(path)
+
+    if name.startswith(CLAIMED_FILE_PREFIX):
+        return int(name.split('-')[1])
+
+    return int(name[len(SPILL_FILE_PREFIX):-len(SPILL_FILE_SUFFIX)])
+
+
+def claim_spill_file(path, pid):
+    """ Rename the spill file at <path> to one claimed by <pid>. Returns the
+    claimed path, or None if another worker claimed the file first. """
+
+    name = os.path.basename(path)
+    if name.startswith(CLAIMED_FILE_PREFIX):
+        name = name.split('-', 2)[2]
+
+    claimed_path = os.path.join(
+        os.path.dirname(path), f'{CLAIMED_FILE_PREFIX}{pid}-{name}')
+
+    # Atomic, so only one worker's rename of a file succeeds
+    try:
+        os.rename(path, claimed_path)
+    except FileNotFoundError:
+        return None
+
+    return claimed_path
+
+
+def is_process_alive(pid):
+    """ Return true if a process with <pid> exists """
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class WriteBehindBuffer:
+    """ Per-worker buffer of minesweeper submissions, flushed in bulk """
+
+    def __init__(self):
+        self.app = None
+        self.pid = None
+        self.entries = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+
+    def init_app(self, app):
+        """ Configure the buffer from <app> config and start it in this
+        process """
+
+        self.app = app
+        self.max_entries = app.config['MINESWEEPER_WRITE_BEHIND_MAX_ENTRIES']
+        self.interval = app.config['MINESWEEPER_WRITE_BEHIND_INTERVAL']
+        self.spill_dir = app.config['MINESWEEPER_WRITE_BEHIND_SPILL_DIR']
+
+        os.makedirs(self.spill_dir, exist_ok = True)
+        atexit.register(self._flush_logging_errors)
+        self._start()
+
+
+    @property
+    def rejected_path(self):
+        """ Path of the file of entries that could not be written """
+
+        return os.path.join(self.spill_dir, REJECTED_FILE_NAME)
+
+
+    @property
+    def spill_path(self):
+        """ Path of this worker's spill file """
+
+        return os.path.join(
+            self.spill_dir, f'{SPILL_FILE_PREFIX}{self.pid}{SPILL_FILE_SUFFIX}')
+
+
+    def _start(self):
+        """ Recover entries left by dead workers and start the flush timer.
+
+        Runs again if the process has forked since the buffer was started.
+        """
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.entries = []
+            recovered_paths = []
+
+            # Includes files claimed by workers that died recovering them
+            paths = [
+                path
+                for prefix in [SPILL_FILE_PREFIX, CLAIMED_FILE_PREFIX]
+                for path in glob.glob(os.path.join(
+                    self.spill_dir, f'{prefix}*{SPILL_FILE_SUFFIX}'))
+            ]
+
+            for path in paths:
+                owner = get_spill_file_owner(path)
+
+                # A file owned by this pid was left by an earlier process
+                # that had the same pid
+                if owner != self.pid and is_process_alive(owner):
+                    continue
+
+                if path != self.spill_path:
+                    path = claim_spill_file(path, self.pid)
+                    if path is None:
+                        continue
+                    recovered_paths.append(path)
+
+                with open(path) as spill_file:
+                    self.entries.extend(
+                        json.loads(line) for line in spill_file if line.strip())
+
+            # Take over the recovered entries before removing their files
+            self._rewrite_spill_file()
+            for path in recovered_paths:
+                os.remove(path)
+
+        thread = threading.Thread(target = self._flush_periodically, daemon = True)
+        thread.start()
+
+
+    def _flush_periodically(self):
+        """ Flush the buffer every <interval> seconds """
+
+        while True:
+            time.sleep(self.interval)
+            self._flush_logging_errors()
+
+
+    def _flush_logging_errors(self):
+        """ Flush the buffer, logging instead of raising errors, since the
+        entries are kept for the next flush """
+
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Minesweeper write-behind flush failed')
+
+
+    def _rewrite_spill_file(self):
+        """ Replace the spill file with the buffered entries. Call with
+        <lock> held. """
+
+        tmp_path = f'{self.spill_path}.tmp'
+
+        with open(tmp_path, 'w') as spill_file:
+            for entry in self.entries:
+                spill_file.write(json.dumps(entry) + '\n')
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+
+        os.replace(tmp_path, self.spill_path)
+
+
+    def _add(self, entry):
+        """ Durably append an entry to the buffer, flushing if it is full """
+
+        self._start()
+
+        with self.lock:
+            with open(self.spill_path, 'a') as spill_file:
+                spill_file.write(json.dumps(entry) + '\n')
+                spill_file.flush()
+                os.fsync(spill_file.fileno())
+
+            self.entries.append(entry)
+            is_full = len(self.entries) >= self.max_entries
+
+        if is_full:
+            self._flush_logging_errors()
+
+
+    def add_score(self, user_id, time, level, submitted_at):
+        """ Buffer a minesweeper score """
+
+        self._add({
+            "type": SCORE_ENTRY,
+            "user_id": user_id,
+            "time": time,
+            "level": level,
+            "submitted_at": submitted_at
+        })
+
+
+    def add_stats(self, user_id, game_stats):
+        """ Buffer the stats of one minesweeper game, in the format sent to
+        /api/minesweeper/stats """
+
+        self._add({
+            "type": STATS_ENTRY,
+            "user_id": user_id,
+            "game_stats": game_stats
+        })
+
+
+    def add_game(self, user_id, result, submitted_at):
+        """ Buffer a finished minesweeper game, in the format sent to
+        /api/minesweeper/games, received at <submitted_at> """
+
+        self._add({
+            "type": GAME_ENTRY,
+            "user_id": user_id,
+            "result": result,
+            "submitted_at": submitted_at
+        })
+
+
+    def flush(self):
+        """ Write all buffered entries to the database in one transaction.
+
+        Scores are inserted with a single multi-row INSERT, and the stats of
+        each user's games are coalesced into one upsert per user. If the
+        database cannot be reached, the entries stay buffered (and spilled)
+        for the next flush. If it refuses the batch, the entries are written
+        one at a time and those it refuses are rejected.
+        """
+
+        if self.app is None or self.pid != os.getpid():
+            return
+
+        with self.flush_lock:
+            with self.lock:
+                entries = self.entries
+                self.entries = []
+
+            if not entries:
+                return
+
+            # Recovered spill files may hold entries buffered unchecked
+            invalid = [entry for entry in entries if validate_entry(entry)]
+            if invalid:
+                self.app.logger.error(
+                    f'Rejecting {len(invalid)} invalid minesweeper '
+                    f'write-behind entries')
+                self._reject(invalid)
+                entries = [
+                    entry for entry in entries if not validate_entry(entry)]
+
+            try:
+                with self.app.app_context():
+                    self._write(entries)
+            except TRANSIENT_ERRORS:
+                with self.lock:
+                    self.entries = entries + self.entries
+                raise
+            except Exception:
+                self.app.logger.exception(
+                    'Minesweeper write-behind batch refused, writing its '
+                    'entries one at a time')
+                self._write_each(entries)
+
+            with self.lock:
+                self._rewrite_spill_file()
+
+
+    def _write_each(self, entries):
+        """ Write <entries> one at a time, rejecting those the database
+        refuses. Call with <flush_lock> held. """
+
+        for i, entry in enumerate(entries):
+            try:
+                with self.app.app_context():
+                    self._write([entry])
+            except TRANSIENT_ERRORS:
+                with self.lock:
+                    self.entries = entries[i:] + self.entries
+                    self._rewrite_spill_file()
+                raise
+            except Exception:
+                self.app.logger.exception(
+                    'Minesweeper write-behind entry refused')
+                self._reject([entry])
+
+
+    def _reject(self, entries):
+        """ Append <entries>, which can never be written, to the rejected
+        file, where they no longer hold up the buffer """
+
+        with open(self.rejected_path, 'a') as rejected_file:
+            for entry in entries:
+                rejected_file.write(json.dumps(entry) + '\n')
+            rejected_file.flush()
+            os.fsync(rejected_file.fileno())
+
+
+    def _write(self, entries):
+        """ Write <entries> to the database and commit """
+
+        score_rows = []
+        games_by_user = {}
+
+        # Drop submissions from users deleted since they were buffered
+        user_ids = {entry['user_id'] for entry in entries}
+        existing_user_ids = {
+            id for (id,) in
+            db.session.query(User.id)
+                .filter(User.id.in_(user_ids), User.deleted_at.is_(None))
+        }
+
+        for entry in entries:
+            if entry['user_id'] not in existing_user_ids:
+                continue
+
+            if entry['type'] == SCORE_ENTRY:
+                score_rows.append({
+                    "user_id": entry['user_id'],
+                    "time": entry['time'],
+                    "level": entry['level'],
+                    "submitted_at": entry['submitted_at']
+                })
+            elif entry['type'] == GAME_ENTRY:
+                result = entry['result']
+                if result['won']:
+                    score_rows.append({
+                        "user_id": entry['user_id'],
+                        "time": result['time'],
+                        "level": result['level'],
+                        "submitted_at": entry['submitted_at']
+                    })
+                games_by_user.setdefault(entry['user_id'], []).append(
+                    game_result_stats(result))
+            else:
+                games_by_user.setdefault(entry['user_id'], []).append(
+                    parse_game_stats(entry['game_stats']))
+
+        try:
+            new_scores = insert_minesweeper_scores(score_rows)
+            entering_scores = serialize_entering_scores(new_scores)
+
+            for user_id, games in games_by_user.items():
+                add_minesweeper_game_stats(user_id, games)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        profile_cache.invalidate(games_by_user)
+        add_scores(entering_scores)
+
+
+minesweeper_buffer = WriteBehindBuffer()